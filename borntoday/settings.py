@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'django_extensions',
     'django.contrib.sites',
     'django.contrib.sitemaps',
+    'django.contrib.postgres',
 ]
 
 MIDDLEWARE = [
@@ -136,6 +137,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Индекс фотографий по хэшам содержимого (см. star/photo_index.py) - вне раздаваемой папки
+STAR_PHOTO_INDEX_PATH = os.path.join(BASE_DIR, 'var', 'photo-index.json')
 
 CACHES = {
     "default": {
@@ -154,6 +157,17 @@ CACHES = {
 # Время кэширования по умолчанию (в секундах)
 CACHE_TTL = 60 * 60 * 24  # 24 часа
 
+# Ограничение частоты запросов к поиску и спискам с фильтрами (star/throttling.py):
+# токенов в секунду и емкость ведра на адрес, отдельный бюджет для поисковых роботов
+STAR_THROTTLE_ENABLED = True
+STAR_THROTTLE_RATE = 1.0
+STAR_THROTTLE_BURST = 60
+STAR_THROTTLE_CRAWLER_RATE = 5.0
+STAR_THROTTLE_CRAWLER_BURST = 300
+# Заголовок с адресом клиента от прокси: nginx добавляет адрес в конец X-Forwarded-For
+# (proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for); без прокси - None (REMOTE_ADDR)
+STAR_THROTTLE_IP_HEADER = 'HTTP_X_FORWARDED_FOR'
+
 # Использовать Redis для сессий
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
@@ -6,7 +6,7 @@ from django.contrib.sitemaps.views import sitemap, index as sitemap_index
 from django.views.decorators.cache import cache_page
 from django.views.generic.base import RedirectView
 from django.http import HttpResponse
-from star.sitemaps import StarSitemap, CountrySitemap, CategorySitemap, BirthdaySitemap, StaticSitemap, NamesSitemap
+from star.sitemaps import StarSitemap, CountrySitemap, CategorySitemap, TagSitemap, BirthdaySitemap, StaticSitemap, NamesSitemap
 from .views import robots_txt
 
 # Определяем словарь с картами сайта
@@ -14,6 +14,7 @@ sitemaps = {
     'stars': StarSitemap,
     'countries': CountrySitemap,
     'categories': CategorySitemap,
+    'tags': TagSitemap,
     'birthdays': BirthdaySitemap,
     'static': StaticSitemap,
     'names': NamesSitemap,
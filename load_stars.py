@@ -9,12 +9,8 @@ django.setup()
 
 # Импортируем модели после настройки Django
 from star.models import Star, Country, Category
-
 # Словарь для преобразования русских названий месяцев в числа
-MONTHS = {
-   'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
-   'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12
-}
+from star.utils import MONTHS
 
 
 # Функция для преобразования даты вида "11 ноября 1974" в объект date
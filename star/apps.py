@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class StarConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'star'
+
+    def ready(self):
+        # Подключаем обработчики сигналов (счетчики и т.п.)
+        from . import signals  # noqa: F401
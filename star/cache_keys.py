@@ -0,0 +1,104 @@
+"""
+Ключи кэша страниц и блоков сайта.
+
+Представления строят ключи здесь, а импорт и синхронизация справочников - списки ключей
+для удаления, поэтому формат ключа, размер страницы и варианты сортировки и топов
+задаются в одном месте.
+"""
+import datetime
+import math
+
+# Знаменитостей на странице каталога и дней рождения
+CATALOGUE_PAGE_SIZE = 20
+# Сортировки каталога (параметр sort)
+CATALOGUE_SORTS = ('birthday', 'rating', 'name_asc', 'name_desc')
+
+# Топы стран и категорий: в боковой колонке и на странице категории
+TOP_LIST_SIZE = 20
+CATEGORY_TOP_SIZE = 10
+TOP_LIST_SIZES = (CATEGORY_TOP_SIZE, TOP_LIST_SIZE)
+# Теги на странице страны или категории (None - полный список)
+VIABLE_TAGS_LIMIT = 10
+VIABLE_TAG_LIMITS = (VIABLE_TAGS_LIMIT, None)
+
+# Именинники на главной: сегодня и завтра
+INDEX_TODAY_LIMIT = 12
+INDEX_TOMORROW_LIMIT = 8
+
+ALL_COUNTRIES = 'all_countries'
+ALL_CATEGORIES = 'all_categories'
+CELEBRITIES = 'celebrities'
+
+
+def country_prefix(slug):
+    return f'country_{slug}'
+
+
+def category_prefix(slug):
+    return f'category_{slug}'
+
+
+def tag_prefix(slug):
+    return f'tag_{slug}'
+
+
+def birthday_prefix(month, day, year=None):
+    return f'birthday_{month}_{day}_{year}'
+
+
+def page_key(prefix, page, sort=None):
+    """Ключ страницы списка: с сортировкой (каталог) или без нее (дни рождения)."""
+    if sort is None:
+        return f'{prefix}_page{page}'
+    return f'{prefix}_{sort}_page{page}'
+
+
+def page_keys(prefix, count, sorts=CATALOGUE_SORTS):
+    """Ключи всех страниц списка из count знаменитостей (для каждой сортировки, если она есть в ключе)."""
+    pages = range(1, max(1, math.ceil(count / CATALOGUE_PAGE_SIZE)) + 1)
+    if sorts is None:
+        return [page_key(prefix, page) for page in pages]
+    return [page_key(prefix, page, sort) for sort in sorts for page in pages]
+
+
+def top_countries_key(count, exclude_id=None):
+    return f'top_countries_{count}_{exclude_id}'
+
+
+def top_categories_key(count, exclude_id=None):
+    return f'top_categories_{count}_{exclude_id}'
+
+
+def viable_tags_category_key(category_id, limit=None):
+    return f'viable_tags_category_{category_id}_{limit}'
+
+
+def viable_tags_country_key(country_id, limit=None):
+    return f'viable_tags_country_{country_id}_{limit}'
+
+
+def star_detail_key(slug):
+    return f'star_detail_{slug}'
+
+
+def birthday_stars_key(month, day, year=None, limit=None):
+    return f'birthday_stars_{month}_{day}_{year}_{limit}'
+
+
+def index_page_key(month, day):
+    return f'index_page_{month}_{day}'
+
+
+def star_cache_keys(slug, birth_date):
+    """Ключи кэша страниц, на которых видна знаменитость: карточка, ее день рождения и главная."""
+    keys = [star_detail_key(slug)]
+    if birth_date:
+        month, day = birth_date.month, birth_date.day
+        keys += [birthday_stars_key(month, day), birthday_stars_key(month, day, birth_date.year),
+                 birthday_stars_key(month, day, limit=INDEX_TODAY_LIMIT),
+                 birthday_stars_key(month, day, limit=INDEX_TOMORROW_LIMIT),
+                 index_page_key(month, day)]
+        # На главной накануне знаменитость видна среди завтрашних именинников
+        previous_day = birth_date - datetime.timedelta(days=1)
+        keys.append(index_page_key(previous_day.month, previous_day.day))
+    return keys
@@ -0,0 +1,105 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Greatest
+
+from .models import Star, StarCount
+
+# Минимальное количество знаменитостей, при котором виртуальная категория (тег) показывается
+TAG_MIN_STARS = 10
+
+
+def pair_keys(category_ids, country_ids):
+    """Ключи счетчиков пересечений категория x страна."""
+    return [(category_id, country_id) for category_id in category_ids for country_id in country_ids]
+
+
+def star_keys(category_ids, country_ids):
+    """Все ключи счетчиков, в которые входит одна знаменитость."""
+    keys = pair_keys(category_ids, country_ids)
+    keys += [(category_id, None) for category_id in category_ids]
+    keys += [(None, country_id) for country_id in country_ids]
+    return keys
+
+
+def _key_q(key):
+    category_id, country_id = key
+    q = Q(category__isnull=True) if category_id is None else Q(category_id=category_id)
+    q &= Q(country__isnull=True) if country_id is None else Q(country_id=country_id)
+    return q
+
+
+def change_counts(deltas):
+    """
+    Применяет изменения счетчиков: deltas - словарь {(category_id, country_id): delta}.
+    Отсутствующие строки создаются, счетчики не опускаются ниже нуля.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    # Создаем недостающие строки одним запросом, существующие пропускаются
+    new_rows = [
+        StarCount(category_id=category_id, country_id=country_id, count=0)
+        for (category_id, country_id), delta in deltas.items() if delta > 0
+    ]
+    if new_rows:
+        StarCount.objects.bulk_create(new_rows, ignore_conflicts=True)
+
+    # Группируем ключи по величине изменения - обычно это один UPDATE на +1 или -1
+    by_delta = defaultdict(list)
+    for key, delta in deltas.items():
+        by_delta[delta].append(key)
+
+    for delta, keys in by_delta.items():
+        q = Q()
+        for key in keys:
+            q |= _key_q(key)
+        StarCount.objects.filter(q).update(count=Greatest(F('count') + delta, Value(0)))
+
+
+def add_keys(deltas, keys, delta):
+    """Добавляет delta для каждого ключа в накопительный словарь изменений."""
+    for key in keys:
+        deltas[key] = deltas.get(key, 0) + delta
+    return deltas
+
+
+def compute_star_counts():
+    """
+    Считает все счетчики по опубликованным знаменитостям агрегирующими запросами:
+    по пересечениям категория x страна, по странам и по категориям.
+    """
+    published = Star.objects.filter(is_published=True).order_by()
+
+    counts = {}
+    pairs = (published.filter(categories__isnull=False, countries__isnull=False)
+             .values_list('categories', 'countries')
+             .annotate(n=Count('id', distinct=True)))
+    for category_id, country_id, n in pairs:
+        counts[(category_id, country_id)] = n
+
+    for country_id, n in (published.filter(countries__isnull=False)
+                          .values_list('countries').annotate(n=Count('id', distinct=True))):
+        counts[(None, country_id)] = n
+
+    for category_id, n in (published.filter(categories__isnull=False)
+                           .values_list('categories').annotate(n=Count('id', distinct=True))):
+        counts[(category_id, None)] = n
+
+    return counts
+
+
+@transaction.atomic
+def rebuild_star_counts():
+    """Полностью пересчитывает таблицу счетчиков. Возвращает количество строк."""
+    counts = compute_star_counts()
+
+    StarCount.objects.all().delete()
+    StarCount.objects.bulk_create(
+        [StarCount(category_id=category_id, country_id=country_id, count=n)
+         for (category_id, country_id), n in counts.items()],
+        batch_size=1000,
+    )
+    return len(counts)
@@ -0,0 +1,245 @@
+"""
+Проверка файла импорта без записи в базу (import_stars --dry-run).
+
+Файл читается теми же потоковыми читателями, что и при импорте, но проверяется
+частями по DRY_RUN_CHUNK строк векторными операциями pandas: обязательные поля,
+даты, рейтинг, разбиение стран и категорий по '|', неизвестные страны и категории.
+Затем строки сравниваются с базой (несколько запросов на часть) и получают статус:
+new - будет создана, changed - есть в базе и будет обновлена в режиме --update,
+unchanged - совпадает с базой, skipped - будет пропущена как повтор имени в файле,
+invalid - не будет импортирована.
+Правила совпадают с importing.parse_row и обновлением существующих знаменитостей.
+"""
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from .importing import batched, IMPORT_BATCH_SIZE, DEFAULT_COUNTRY, DEFAULT_CATEGORY
+from .models import Star, Country, Category
+
+DRY_RUN_CHUNK = 50000
+
+# Сколько примеров строк каждого статуса показывать в отчете
+SAMPLE_SIZE = 10
+
+STATUSES = ['new', 'changed', 'unchanged', 'skipped', 'invalid']
+
+# Поля, которые сравниваются с базой (обновляются непустыми значениями из файла)
+COMPARED_FIELDS = {
+    'wikipedia': 'Wiki',
+    'ruwiki': 'Ruwiki',
+    'content': 'Txt',
+    'birth_date': 'Born',
+    'death_date': 'Death',
+}
+
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+class DryRunReport:
+    """Итог проверки: количество строк по статусам, примеры, ошибки и новые справочные значения."""
+
+    def __init__(self):
+        self.rows = 0
+        self.counts = Counter({status: 0 for status in STATUSES})
+        self.samples = {status: [] for status in STATUSES}
+        self.errors = Counter()
+        self.warnings = Counter()
+        self.unknown_countries = Counter()
+        self.unknown_categories = Counter()
+
+    def add(self, result):
+        self.rows += len(result)
+        self.counts.update(result['status'].value_counts().to_dict())
+        for status, sample in self.samples.items():
+            missing = SAMPLE_SIZE - len(sample)
+            if missing > 0:
+                rows = result[result['status'] == status].head(missing)
+                sample += list(rows[['row', 'name', 'details']].itertuples(index=False, name=None))
+
+
+def _text(df, column):
+    """Колонка как строки без пробелов по краям; пустые и отсутствующие значения - <NA>."""
+    if column not in df:
+        return pd.Series(pd.NA, index=df.index, dtype='string')
+    values = df[column].astype('string').str.strip()
+    return values.mask(values == '')
+
+
+def _dates(values):
+    """
+    Даты 'ГГГГ-ММ-ДД' (возможно со временем) -> строка 'ГГГГ-ММ-ДД' или <NA>.
+    Разбор без pandas-дат: им недоступны годы раньше 1677.
+    """
+    parts = values.str[:10].str.extract(r'^(\d{4})-(\d{2})-(\d{2})$')
+    year = pd.to_numeric(parts[0]).fillna(0).astype(int)
+    month = pd.to_numeric(parts[1]).fillna(0).astype(int)
+    day = pd.to_numeric(parts[2]).fillna(0).astype(int)
+
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = DAYS_IN_MONTH[month.clip(1, 12) - 1] + ((month == 2) & leap)
+    valid = (year >= 1) & month.between(1, 12) & (day >= 1) & (day <= month_days)
+    return values.str[:10].where(valid)
+
+
+def _split(values, default):
+    """'США|Словения' -> строки (индекс строки, название); пустые ячейки получают default."""
+    names = values.fillna('').str.split('|').explode().str.strip()
+    names = names[names != '']
+    missing = values.index.difference(names.index.unique())
+    defaults = pd.Series(default, index=missing, dtype='string')
+    return pd.concat([names, defaults]).astype('string'), missing
+
+
+def validate_chunk(df, first_row, seen_names, known_countries, known_categories, report):
+    """Проверяет часть файла без обращения к базе. Возвращает кадр с нормализованными значениями."""
+    checked = pd.DataFrame(index=df.index)
+    checked['row'] = np.arange(first_row, first_row + len(df))
+    checked['name'] = _text(df, 'Name')
+    for field, column in COMPARED_FIELDS.items():
+        checked[field] = _text(df, column)
+    checked['birth_date'] = _dates(checked['birth_date'])
+    born = _text(df, 'Born')
+    death = checked['death_date']
+    checked['death_date'] = _dates(death)
+
+    rating_text = _text(df, 'Rating')
+    rating = pd.to_numeric(rating_text, errors='coerce')
+    checked['rating'] = np.trunc(rating.fillna(0)).astype('int64')
+
+    # Ошибки: первая причина на строку
+    reasons = pd.Series(pd.NA, index=df.index, dtype='string')
+    for mask, reason in [
+        (rating_text.notna() & rating.isna(), 'неверный рейтинг'),
+        (checked['birth_date'].isna() & born.notna(), 'неверный формат даты рождения'),
+        (born.isna(), 'не указана дата рождения'),
+        (checked['name'].isna(), 'не указано имя'),
+    ]:
+        reasons = reasons.mask(mask.fillna(False), reason)
+    checked['error'] = reasons
+
+    # Как при импорте, из строк без ошибок с одинаковым именем записывается первая, остальные пропускаются
+    names = checked['name'][reasons.isna()]
+    duplicate = names.duplicated() | names.isin(seen_names)
+    checked['skip'] = pd.Series(pd.NA, index=df.index, dtype='string').mask(
+        duplicate.reindex(df.index, fill_value=False), 'повтор имени в файле')
+    seen_names.update(names)
+
+    report.errors.update(reasons.dropna().value_counts().to_dict())
+    report.warnings['дата смерти не распознана, будет пустой'] += int((death.notna() & checked['death_date'].isna()).sum())
+
+    # Страны и категории: новые значения и подстановка значений по умолчанию
+    valid = checked['error'].isna() & checked['skip'].isna()
+    countries, no_country = _split(_text(df, 'Country')[valid], DEFAULT_COUNTRY)
+    categories, no_category = _split(_text(df, 'Categories')[valid], DEFAULT_CATEGORY)
+    report.warnings[f'не указана страна, будет "{DEFAULT_COUNTRY}"'] += len(no_country)
+    report.warnings[f'не указана категория, будет "{DEFAULT_CATEGORY}"'] += len(no_category)
+    report.unknown_countries.update(countries[~countries.isin(known_countries)].value_counts().to_dict())
+    report.unknown_categories.update(categories[~categories.isin(known_categories)].value_counts().to_dict())
+
+    return checked, countries, categories
+
+
+def _links(through, title_field, names):
+    """Пары (имя знаменитости, название страны или категории) из базы."""
+    return pd.DataFrame.from_records(
+        through.objects.filter(star__name__in=names).values_list('star__name', title_field),
+        columns=['name', 'value'])
+
+
+def _existing(names):
+    """Знаменитости из базы с такими именами: кадр полей для сравнения и пары (имя, страна) и (имя, категория)."""
+    fields = ['id', 'name', 'rating', *COMPARED_FIELDS]
+    frames, countries, categories = [], [], []
+    for chunk in batched(names, IMPORT_BATCH_SIZE):
+        frames.append(pd.DataFrame.from_records(
+            Star.objects.filter(name__in=chunk).values_list(*fields), columns=fields))
+        countries.append(_links(Star.countries.through, 'country__name', chunk))
+        categories.append(_links(Star.categories.through, 'category__title', chunk))
+
+    stars = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=fields)
+    # Как при импорте, при одинаковых именах обновляется последняя найденная знаменитость
+    stars = stars.drop_duplicates('name', keep='last').set_index('name')
+    for field in ('birth_date', 'death_date'):
+        stars[field] = stars[field].map(lambda value: value.isoformat() if value else None)
+
+    def concat(frames):
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['name', 'value'])
+    return stars, concat(countries), concat(categories)
+
+
+def _links_differ(values, default, matched, pairs):
+    """
+    Строки matched, у которых множество стран или категорий из файла отличается от связей
+    в базе. Как при импорте, строки только со значением по умолчанию связи не меняют.
+    """
+    values = values[values.index.isin(matched.index)]
+    explicit = (values != default) | (values.groupby(level=0).transform('size') > 1)
+    values = values[explicit.groupby(level=0).transform('any')]
+
+    wanted = pd.DataFrame({'name': matched['name'].reindex(values.index), 'value': values})
+    wanted = wanted.rename_axis('index').reset_index().drop_duplicates()
+    merged = wanted.merge(pairs[pairs['name'].isin(wanted['name'])], on=['name', 'value'], how='outer', indicator=True)
+
+    # Лишние связи в базе (right_only) относим к строке файла по имени
+    row_by_name = dict(zip(wanted['name'], wanted['index']))
+    differing = set(merged.loc[merged['_merge'] == 'left_only', 'index'])
+    differing.update(merged.loc[merged['_merge'] == 'right_only', 'name'].map(row_by_name))
+    return matched.index.isin(list(differing))
+
+
+def compare_chunk(checked, countries, categories):
+    """Сравнивает проверенные строки с базой: статус и список отличающихся полей."""
+    result = checked[['row', 'name']].copy()
+    result['status'] = 'invalid'
+    result['details'] = checked['error']
+    skipped = checked['skip'].notna()
+    result.loc[skipped, 'status'] = 'skipped'
+    result.loc[skipped, 'details'] = checked['skip']
+
+    valid = checked[checked['error'].isna() & ~skipped]
+    stars, country_pairs, category_pairs = _existing(valid['name'].tolist())
+    exists = valid['name'].isin(stars.index)
+    result.loc[valid.index[~exists], 'status'] = 'new'
+    result.loc[valid.index[~exists], 'details'] = ''
+
+    matched = valid[exists]
+    if matched.empty:
+        return result
+
+    current = stars.loc[matched['name']].set_axis(matched.index)
+    differs = pd.DataFrame(index=matched.index)
+    for field in COMPARED_FIELDS:
+        differs[field] = matched[field].notna() & (matched[field] != current[field].astype('string')).fillna(True)
+    differs['rating'] = (matched['rating'] != 0) & (matched['rating'] != current['rating'])
+
+    differs['countries'] = _links_differ(countries, DEFAULT_COUNTRY, matched, country_pairs)
+    differs['categories'] = _links_differ(categories, DEFAULT_CATEGORY, matched, category_pairs)
+
+    changed_fields = differs.dot(differs.columns + ', ').str.rstrip(', ')
+    result.loc[matched.index, 'status'] = np.where(changed_fields != '', 'changed', 'unchanged')
+    result.loc[matched.index, 'details'] = changed_fields
+    return result
+
+
+def dry_run(rows, report_file=None, chunk_size=DRY_RUN_CHUNK):
+    """
+    Проверяет поток строк (см. importing.read_rows) без записи в базу. Если передан
+    report_file, в него пишется CSV со статусом каждой строки. Возвращает DryRunReport.
+    """
+    report = DryRunReport()
+    known_countries = set(Country.objects.values_list('name', flat=True))
+    known_categories = set(Category.objects.values_list('title', flat=True))
+    seen_names = set()
+
+    for chunk in batched(rows, chunk_size):
+        df = pd.DataFrame.from_records(chunk)
+        checked, countries, categories = validate_chunk(df, report.rows + 1, seen_names,
+                                             known_countries, known_categories, report)
+        result = compare_chunk(checked, countries, categories)
+        report.add(result)
+        if report_file is not None:
+            result.to_csv(report_file, header=report.rows == len(result), index=False)
+
+    return report
@@ -0,0 +1,539 @@
+"""
+Массовый импорт знаменитостей из Excel, CSV или JSONL.
+
+Импорт устроен как конвейер генераторов: чтение файла строка за строкой (openpyxl
+в режиме read_only, csv, построчный JSON) -> разбор и проверка строк -> запись
+пакетами по IMPORT_BATCH_SIZE. В памяти одновременно находится только один пакет,
+поэтому потребление памяти не зависит от размера файла, а первые строки попадают
+в базу сразу после чтения первого пакета.
+
+Для пакета одним запросом находятся уже существующие имена, slug новых знаменитостей
+подбираются пакетом (см. slugs.SlugAllocator), звезды
+и их связи со странами и категориями вставляются через bulk_create. Каждый пакет -
+отдельная транзакция. Фотографии пакета находятся по индексу хэшей содержимого
+(photo_index) и копируются в пуле потоков до начала транзакции.
+
+Повторный импорт инкрементален: у каждой знаменитости хранится отпечаток ее строки
+(source_fingerprint), строки с тем же отпечатком пропускаются без чтения знаменитости.
+У измененных записываются только отличающиеся поля, связи со странами и категориями
+сверяются как множества (добавляются и удаляются только различия), time_update
+меняется только у действительно измененных. Список их id возвращается в ImportStats.
+
+Сигналы при массовой вставке не срабатывают, поэтому после импорта счетчики и теги
+пересчитываются целиком (если менялись связи), индексы поиска помечаются устаревшими
+(если менялось видимое в поиске), а из кэша удаляются страницы измененных знаменитостей.
+"""
+import csv
+import datetime
+import hashlib
+import itertools
+import json
+import math
+import os
+import time
+
+from openpyxl import load_workbook
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache_keys import star_cache_keys
+from .counts import rebuild_star_counts
+from .models import Star, Country, Category
+from .photo_index import PhotoIndex, PHOTO_THREADS, photo_pool, copy_files
+from .search import invalidate_search_indexes
+from .search_export import refresh_search_export
+from .slugs import bulk_create_with_slugs
+from .tags import rebuild_tags
+
+IMPORT_BATCH_SIZE = 1000
+
+REQUIRED_COLUMNS = ['Name', 'Country', 'Categories', 'Born', 'Txt']
+
+# Значения по умолчанию, если у знаменитости не указаны страна или категория
+DEFAULT_COUNTRY = 'Неизвестно'
+DEFAULT_CATEGORY = 'Другое'
+
+# Поля, которые обновляются у существующих знаменитостей в режиме --update (непустыми значениями из файла)
+UPDATE_FIELDS = ['wikipedia', 'ruwiki', 'rating', 'content', 'birth_date', 'death_date']
+
+# Изменение этих полей требует перестроить индексы поиска
+SEARCH_FIELDS = {'rating', 'birth_date'}
+
+# Значения разобранной строки, из которых считается отпечаток
+FINGERPRINT_KEYS = ['name', 'birth_date', 'death_date', 'content', 'wikipedia', 'ruwiki', 'rating',
+                    'countries', 'categories', 'img']
+
+
+class ImportStats:
+    """Счетчики импорта и скорость обработки."""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.errors = []
+        # Имена, уже встреченные в файле: повторы пропускаются
+        self.seen_names = set()
+        # id созданных и измененных знаменитостей и ключи их страниц в кэше
+        self.changed_ids = []
+        self.cache_keys = set()
+        # Что пересчитать после импорта
+        self.relations_changed = False
+        self.search_changed = False
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def _clean(value):
+    """Пустые ячейки (NaN, пустая строка) -> None."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def parse_date(value):
+    """Дата из ячейки: datetime/date или строка 'ГГГГ-ММ-ДД' (возможно со временем). Иначе None."""
+    value = _clean(value)
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def split_names(value):
+    """Список названий из ячейки вида 'США|Словения'."""
+    value = _clean(value)
+    if value is None:
+        return []
+    return [name.strip() for name in str(value).split('|') if name.strip()]
+
+
+def row_fingerprint(data):
+    """Отпечаток разобранной строки: меняется при изменении любого импортируемого значения."""
+    values = [sorted(data[key]) if key in ('countries', 'categories') else data[key] for key in FINGERPRINT_KEYS]
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+def parse_row(row):
+    """Строка таблицы -> словарь полей знаменитости. ValueError, если строку нельзя импортировать."""
+    name = _clean(row.get('Name'))
+    if name is None:
+        raise ValueError('не указано имя')
+    name = str(name)
+
+    birth_date = parse_date(row.get('Born'))
+    if birth_date is None:
+        raise ValueError(f'неверный формат даты рождения для {name}')
+
+    rating = _clean(row.get('Rating'))
+    try:
+        rating = int(float(rating)) if rating is not None else 0
+    except ValueError:
+        raise ValueError(f'неверный рейтинг для {name}: {rating}')
+
+    data = {
+        'name': name,
+        'birth_date': birth_date,
+        'death_date': parse_date(row.get('Death')),
+        'content': _clean(row.get('Txt')) or '',
+        'wikipedia': _clean(row.get('Wiki')),
+        'ruwiki': _clean(row.get('Ruwiki')),
+        'rating': rating,
+        'countries': split_names(row.get('Country')) or [DEFAULT_COUNTRY],
+        'categories': split_names(row.get('Categories')) or [DEFAULT_CATEGORY],
+        'img': _clean(row.get('Img')),
+    }
+    data['fingerprint'] = row_fingerprint(data)
+    return data
+
+
+def _check_columns(columns, path, required=REQUIRED_COLUMNS):
+    missing = [column for column in required if column not in columns]
+    if missing:
+        raise ValueError(f'в файле {path} отсутствуют обязательные колонки: {", ".join(missing)}')
+
+
+def read_xlsx_rows(path, required=REQUIRED_COLUMNS):
+    """Строки первого листа Excel-файла в виде словарей, без загрузки книги в память."""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else None for cell in next(rows, ())]
+        _check_columns(header, path, required)
+        for values in rows:
+            if any(value is not None for value in values):
+                yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def read_csv_rows(path, required=REQUIRED_COLUMNS):
+    """Строки CSV-файла (UTF-8, первая строка - заголовок) в виде словарей."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        _check_columns(reader.fieldnames or [], path, required)
+        yield from reader
+
+
+def read_jsonl_rows(path, required=REQUIRED_COLUMNS):
+    """Строки файла JSON Lines: один объект с колонками на строку."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+READERS = {
+    '.xlsx': read_xlsx_rows,
+    '.xlsm': read_xlsx_rows,
+    '.csv': read_csv_rows,
+    '.jsonl': read_jsonl_rows,
+    '.ndjson': read_jsonl_rows,
+}
+
+
+def read_rows(path, required=REQUIRED_COLUMNS):
+    """
+    Генератор строк файла по его расширению. ValueError для неизвестного формата
+    и при отсутствии колонок required (в JSONL колонки не проверяются).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in READERS:
+        raise ValueError(f'неизвестный формат файла {extension}, поддерживаются: {", ".join(READERS)}')
+    return READERS[extension](path, required)
+
+
+def parse_rows(rows, stats):
+    """Стадия разбора: разобранные строки, ошибки накапливаются в stats."""
+    for row in rows:
+        stats.rows += 1
+        try:
+            yield parse_row(row)
+        except ValueError as e:
+            stats.errors.append(f'строка {stats.rows}: {e}')
+
+
+def batched(items, size):
+    """Разбивает поток на списки по size элементов."""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class References:
+    """Страны и категории по названию -> id. Недостающие создаются один раз на название."""
+
+    def __init__(self):
+        self.countries = dict(Country.objects.values_list('name', 'id'))
+        self.categories = dict(Category.objects.values_list('title', 'id'))
+
+    def country_ids(self, names):
+        return [self._resolve(self.countries, Country, 'name', name) for name in names]
+
+    def category_ids(self, names):
+        return [self._resolve(self.categories, Category, 'title', name) for name in names]
+
+    @staticmethod
+    def _resolve(known, model, field, name):
+        if name not in known:
+            # save() модели подбирает slug
+            obj = model(**{field: name})
+            obj.save()
+            known[name] = obj.id
+        return known[name]
+
+
+class PhotoLocator:
+    """
+    Находит фотографии знаменитостей пакетом: файл из папки источника, содержимое которого
+    уже есть в MEDIA_ROOT/photos (под любым именем), переиспользуется по индексу хэшей,
+    остальные копируются в пуле потоков. Вызывающий обязан закрыть локатор (close).
+    """
+
+    def __init__(self, source_dir, threads=PHOTO_THREADS):
+        self.source_dir = source_dir
+        self.target_subdir = timezone.localdate().strftime('photos/%Y/%m/%d')
+        self.pool = photo_pool(threads)
+        self.index = PhotoIndex().load().refresh(self.pool)
+        self.resolved = {}
+
+    def _target_path(self, filename, taken):
+        """Свободное имя в папке дня: при совпадении имени с другим файлом добавляется суффикс."""
+        stem, ext = os.path.splitext(filename)
+        candidate = filename
+        n = 1
+        while True:
+            relative_path = f'{self.target_subdir}/{candidate}'
+            if relative_path not in taken and not os.path.exists(os.path.join(settings.MEDIA_ROOT, relative_path)):
+                return relative_path
+            candidate = f'{stem}-{n}{ext}'
+            n += 1
+
+    def locate_many(self, filenames):
+        """{имя файла: относительный путь в MEDIA_ROOT или None, если файла нет}."""
+        pending = {filename for filename in filenames if filename and filename not in self.resolved}
+        if pending:
+            # Хэши источника кэшируются по абсолютному пути - не зависят от текущей папки
+            sources = {filename: os.path.abspath(os.path.join(self.source_dir, filename)) for filename in pending}
+            hashes = self.index.source_hashes(sources.values(), self.pool)
+
+            copies, taken = {}, set()
+            for filename, source_path in sorted(sources.items()):
+                content_hash = hashes.get(source_path)
+                if content_hash is None:
+                    self.resolved[filename] = None
+                    continue
+                relative_path = self.index.get(content_hash)
+                if relative_path is None and content_hash not in copies:
+                    relative_path = self._target_path(filename, taken)
+                    taken.add(relative_path)
+                    copies[content_hash] = (source_path, relative_path)
+                self.resolved[filename] = relative_path or copies[content_hash][1]
+
+            if copies:
+                os.makedirs(os.path.join(settings.MEDIA_ROOT, self.target_subdir), exist_ok=True)
+                copy_files([(source_path, os.path.join(settings.MEDIA_ROOT, relative_path))
+                            for source_path, relative_path in copies.values()], self.pool)
+                for content_hash, (source_path, relative_path) in copies.items():
+                    self.index.add(relative_path, content_hash)
+
+        return {filename: self.resolved.get(filename) for filename in filenames}
+
+    def locate(self, filename):
+        return self.locate_many([filename])[filename]
+
+    def close(self):
+        self.index.save()
+        self.pool.shutdown()
+
+
+def _relation_rows(through, column, star_id, related_ids):
+    return [through(star_id=star_id, **{column: related_id}) for related_id in dict.fromkeys(related_ids)]
+
+
+def _create_stars(parsed, references, photo_paths, stats):
+    """Вставляет новых знаменитостей и их связи."""
+    stars = []
+    for data in parsed:
+        star = Star(
+            name=data['name'],
+            birth_date=data['birth_date'],
+            death_date=data['death_date'],
+            content=data['content'],
+            wikipedia=data['wikipedia'],
+            ruwiki=data['ruwiki'],
+            rating=data['rating'],
+            photo=photo_paths.get(data['img']),
+            source_fingerprint=data['fingerprint'],
+            is_published=True,
+        )
+        star.fill_name_fields()
+        stars.append(star)
+
+    bulk_create_with_slugs(Star, stars, [star.name for star in stars], 'star')
+
+    # Базы без RETURNING не возвращают id - находим их по slug
+    if any(star.pk is None for star in stars):
+        ids = dict(Star.objects.filter(slug__in=[star.slug for star in stars]).values_list('slug', 'id'))
+        for star in stars:
+            star.pk = ids[star.slug]
+
+    country_rows = []
+    category_rows = []
+    for star, data in zip(stars, parsed):
+        country_rows += _relation_rows(Star.countries.through, 'country_id', star.pk,
+                                       references.country_ids(data['countries']))
+        category_rows += _relation_rows(Star.categories.through, 'category_id', star.pk,
+                                        references.category_ids(data['categories']))
+        stats.changed_ids.append(star.pk)
+        stats.cache_keys.update(star_cache_keys(star.slug, star.birth_date))
+    Star.countries.through.objects.bulk_create(country_rows, ignore_conflicts=True)
+    Star.categories.through.objects.bulk_create(category_rows, ignore_conflicts=True)
+
+    stats.created += len(stars)
+    stats.relations_changed = stats.search_changed = True
+
+
+def _current_links(through, column, star_ids):
+    """Связи знаменитостей {star_id: множество id стран или категорий} одним запросом."""
+    links = {star_id: set() for star_id in star_ids}
+    for star_id, related_id in through.objects.filter(star_id__in=star_ids).values_list('star_id', column):
+        links[star_id].add(related_id)
+    return links
+
+
+def _reconcile_links(through, column, wanted, current):
+    """
+    Приводит связи к нужным множествам: вставляет недостающие и удаляет лишние.
+    wanted: {star_id: множество id}. Возвращает id знаменитостей, у которых связи изменились.
+    """
+    added, removed = [], Q()
+    changed = set()
+    for star_id, related_ids in wanted.items():
+        extra = current[star_id] - related_ids
+        missing = related_ids - current[star_id]
+        if extra:
+            removed |= Q(star_id=star_id, **{f'{column}__in': extra})
+        added += [through(star_id=star_id, **{column: related_id}) for related_id in missing]
+        if extra or missing:
+            changed.add(star_id)
+
+    if removed:
+        through.objects.filter(removed).delete()
+    through.objects.bulk_create(added, ignore_conflicts=True)
+    return changed
+
+
+def _update_stars(parsed, existing_ids, references, photo_paths, stats):
+    """
+    Обновляет существующих знаменитостей с изменившимися строками. Записываются только
+    отличающиеся поля; пустые ячейки (и значения по умолчанию для стран и категорий)
+    не затирают данные в базе.
+    """
+    by_id = Star.objects.only('id', 'slug', 'photo', *UPDATE_FIELDS).in_bulk(existing_ids.values())
+    relations = [
+        ('countries', Star.countries.through, 'country_id', references.country_ids, DEFAULT_COUNTRY),
+        ('categories', Star.categories.through, 'category_id', references.category_ids, DEFAULT_CATEGORY),
+    ]
+
+    changed_fields = {}
+    relations_changed = set()
+    for key, through, column, resolve, default in relations:
+        wanted = {}
+        for data in parsed:
+            if data[key] != [default]:
+                wanted[existing_ids[data['name']]] = set(resolve(data[key]))
+        relations_changed |= _reconcile_links(through, column, wanted, _current_links(through, column, list(wanted)))
+
+    # bulk_update не заполняет auto_now
+    now = timezone.now()
+    groups = {}
+    for data in parsed:
+        star = by_id[existing_ids[data['name']]]
+        old_birth_date = star.birth_date
+        changed = [field for field in UPDATE_FIELDS if data[field] and data[field] != getattr(star, field)]
+        for field in changed:
+            setattr(star, field, data[field])
+        photo = photo_paths.get(data['img'])
+        if not star.photo and photo:
+            star.photo = photo
+            changed.append('photo')
+
+        star.source_fingerprint = data['fingerprint']
+        fields = ['source_fingerprint']
+        if changed or star.pk in relations_changed:
+            star.time_update = now
+            fields += changed + ['time_update']
+            stats.updated += 1
+            stats.changed_ids.append(star.pk)
+            stats.cache_keys.update(star_cache_keys(star.slug, star.birth_date))
+            if old_birth_date != star.birth_date:
+                stats.cache_keys.update(star_cache_keys(star.slug, old_birth_date))
+            if SEARCH_FIELDS.intersection(changed):
+                stats.search_changed = True
+        else:
+            stats.unchanged += 1
+        # Одна запись на набор измененных полей
+        groups.setdefault(tuple(fields), []).append(star)
+
+    for fields, stars in groups.items():
+        Star.objects.bulk_update(stars, fields)
+    if relations_changed:
+        stats.relations_changed = True
+
+
+def import_batch(parsed, stats, references, photos, update_existing=False):
+    """Записывает пакет разобранных строк в одной транзакции."""
+    # Существующие имена - одним запросом на пакет; повторы имени в файле пропускаются
+    names = [data['name'] for data in parsed]
+    existing_ids, fingerprints, without_photo = {}, {}, set()
+    for name, star_id, fingerprint, photo in Star.objects.filter(name__in=names).values_list(
+            'name', 'id', 'source_fingerprint', 'photo'):
+        existing_ids[name] = star_id
+        fingerprints[name] = fingerprint
+        if not photo:
+            without_photo.add(name)
+
+    new, existing = [], []
+    for data in parsed:
+        if data['name'] in stats.seen_names:
+            stats.skipped += 1
+            continue
+        stats.seen_names.add(data['name'])
+        if data['name'] not in existing_ids:
+            new.append(data)
+        elif not update_existing:
+            stats.skipped += 1
+        elif fingerprints[data['name']] == data['fingerprint']:
+            stats.unchanged += 1
+        else:
+            existing.append(data)
+
+    # Фотографии копируются до транзакции, чтобы не держать ее открытой на время работы с диском
+    photo_paths = photos.locate_many(
+        [data['img'] for data in new] + [data['img'] for data in existing if data['name'] in without_photo])
+
+    with transaction.atomic():
+        if new:
+            _create_stars(new, references, photo_paths, stats)
+        if existing:
+            _update_stars(existing, existing_ids, references, photo_paths, stats)
+
+
+def finish_import(stats):
+    """Пересчитывает то, что при обычном сохранении поддерживают сигналы, и чистит кэш измененных."""
+    if stats.relations_changed:
+        rebuild_star_counts()
+        rebuild_tags()
+    if stats.search_changed:
+        invalidate_search_indexes()
+        refresh_search_export()
+    if stats.created:
+        cache.delete_many(['star_count', 'site_stats'])
+    cache.delete_many(list(stats.cache_keys))
+
+
+def import_stars(rows, update_existing=False, images_dir='img-2', batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """
+    Импортирует знаменитостей из потока строк-словарей (см. read_rows). progress(stats)
+    вызывается после каждого записанного пакета. Возвращает ImportStats.
+    """
+    stats = ImportStats()
+    references = References()
+    photos = PhotoLocator(images_dir)
+
+    try:
+        for batch in batched(parse_rows(rows, stats), batch_size):
+            import_batch(batch, stats, references, photos, update_existing)
+            if progress:
+                progress(stats)
+    finally:
+        photos.close()
+
+    if stats.changed_ids:
+        finish_import(stats)
+    return stats
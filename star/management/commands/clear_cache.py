@@ -34,7 +34,7 @@ class Command(BaseCommand):
         cache.delete('sitemap_index_alt')
 
         # Для секционных файлов
-        for section in ['stars', 'countries', 'categories', 'birthdays', 'static', 'names']:
+        for section in ['stars', 'countries', 'categories', 'tags', 'birthdays', 'static', 'names']:
             cache.delete(f'django.contrib.sitemaps.views.sitemap.{section}')
             # Для пагинированных секций
             for i in range(1, 30):  # Предполагая до 30 страниц
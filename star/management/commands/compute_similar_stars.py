@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from star.recommendations import rebuild_similar_stars, SIMILAR_TOP_K
+
+
+class Command(BaseCommand):
+    help = 'Рассчитывает похожих знаменитостей для блока на странице звезды'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Пересчитать только звезды, затронутые изменениями после прошлого расчета')
+        parser.add_argument('--top', type=int, default=SIMILAR_TOP_K,
+                            help='Количество соседей для каждой звезды')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = rebuild_similar_stars(incremental=options['incremental'], top_k=options['top'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие знаменитости рассчитаны для {count} звезд за {elapsed:.1f} с'
+        ))
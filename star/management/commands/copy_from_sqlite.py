@@ -0,0 +1,237 @@
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection
+
+from star.models import Star
+from star.search import invalidate_search_indexes
+from star.search_export import export_search_index
+
+# Промежуточные таблицы импорта не переносятся
+SKIP_MODELS = {'star.importrow', 'star.importlink'}
+
+COPY_CHUNK_SIZE = 10000
+COPY_JOBS = 4
+
+FILL_BATCH_SIZE = 5000
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY: NULL - \\N, спецсимволы экранируются."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        return '\\\\x' + value.hex()
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class CopyStream:
+    """
+    Файлоподобный объект для copy_expert (psycopg2): строки COPY читаются из SQLite по мере надобности.
+    read отдает данные из текущего куска по смещению, без пересборки буфера - copy_expert читает по 8 КБ.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.chunk = ''
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            data = self.chunk[self.offset:] + ''.join(self.chunks)
+            self.chunk, self.offset = '', 0
+            return data
+        while self.offset >= len(self.chunk):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return ''
+            self.chunk, self.offset = chunk, 0
+        data = self.chunk[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    readline = read
+
+
+def copied_models(app_labels):
+    """Модели приложений с таблицами для переноса (вместе с промежуточными таблицами M2M)."""
+    models = []
+    for label in app_labels:
+        for model in apps.get_app_config(label).get_models(include_auto_created=True):
+            if model._meta.managed and not model._meta.proxy and model._meta.label_lower not in SKIP_MODELS:
+                models.append(model)
+    return models
+
+
+def dependency_levels(models):
+    """Модели по уровням: таблицы уровня ссылаются только на таблицы предыдущих и копируются параллельно."""
+    remaining = list(models)
+    done = set()
+    levels = []
+    while remaining:
+        level = [model for model in remaining if all(
+            field.related_model in done or field.related_model not in models or field.related_model is model
+            for field in model._meta.concrete_fields if field.is_relation
+        )]
+        if not level:
+            raise CommandError('Циклические ссылки между таблицами: ' +
+                               ', '.join(model._meta.db_table for model in remaining))
+        levels.append(level)
+        done.update(level)
+        remaining = [model for model in remaining if model not in done]
+    return levels
+
+
+class Command(BaseCommand):
+    help = 'Переносит данные из SQLite в PostgreSQL через COPY: таблицы потоком, независимые - параллельно'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sqlite_path', nargs='?', default=str(settings.BASE_DIR / 'db.sqlite3'),
+                            help='Файл базы SQLite')
+        parser.add_argument('--apps', nargs='+', default=['star'], help='Приложения, таблицы которых переносятся')
+        parser.add_argument('--jobs', type=int, default=COPY_JOBS, help='Сколько таблиц копировать одновременно')
+        parser.add_argument('--chunk-size', type=int, default=COPY_CHUNK_SIZE,
+                            help='Сколько строк читать из SQLite за раз')
+        parser.add_argument('--truncate', action='store_true',
+                            help='Очистить таблицы PostgreSQL перед переносом')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('База по умолчанию должна быть PostgreSQL')
+
+        self.sqlite_path = options['sqlite_path']
+        self.chunk_size = options['chunk_size']
+        source = sqlite3.connect(f'file:{self.sqlite_path}?mode=ro', uri=True)
+
+        models = copied_models(options['apps'])
+
+        # Столбцы источника: таблицы, которых нет в SQLite, пропускаются; недостающие столбцы - значения по умолчанию
+        self.plans = {}
+        for model in models:
+            table = model._meta.db_table
+            source_columns = {row[1] for row in source.execute(f'PRAGMA table_info("{table}")')}
+            if not source_columns:
+                self.stdout.write(self.style.WARNING(f'{table}: нет в SQLite, пропускается'))
+                continue
+            self.plans[model] = self.select_plan(model, source_columns)
+        source.close()
+
+        models = [model for model in models if model in self.plans]
+        self.prepare_target(models, options['truncate'])
+
+        started = time.monotonic()
+        total = 0
+        for level in dependency_levels(models):
+            with ThreadPoolExecutor(max_workers=options['jobs']) as pool:
+                futures = [pool.submit(self.copy_table, model) for model in level]
+                for future in as_completed(futures):
+                    table, rows, elapsed = future.result()
+                    total += rows
+                    rate = rows / elapsed if elapsed else 0
+                    self.stdout.write(f'{table}: {rows} строк за {elapsed:.1f} с ({rate:.0f} строк/с)')
+
+        self.finish_target(models)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено {total} строк за {elapsed:.1f} с ({total / elapsed if elapsed else 0:.0f} строк/с)'))
+
+    def select_plan(self, model, source_columns):
+        """(столбцы, SELECT для SQLite, параметры SELECT, недостающие столбцы)."""
+        columns, select, params, missing = [], [], [], []
+        for field in model._meta.concrete_fields:
+            column = field.column
+            columns.append(column)
+            if column in source_columns:
+                select.append(f'"{column}"')
+                continue
+            default = field.get_default() if field.has_default() else None
+            if default is None and not field.null or not isinstance(default, (str, int, bool, type(None))):
+                raise CommandError(f'{model._meta.db_table}.{column}: нет в SQLite и нет простого значения по умолчанию')
+            select.append('?')
+            params.append(default)
+            missing.append(column)
+        sql = f'SELECT {", ".join(select)} FROM "{model._meta.db_table}"'
+        return columns, sql, params, missing
+
+    def prepare_target(self, models, truncate):
+        tables = [connection.ops.quote_name(model._meta.db_table) for model in models]
+        with connection.cursor() as cursor:
+            if truncate:
+                cursor.execute(f'TRUNCATE TABLE {", ".join(tables)} RESTART IDENTITY CASCADE')
+                return
+            for model, table in zip(models, tables):
+                cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {table})')
+                if cursor.fetchone()[0]:
+                    raise CommandError(f'Таблица {model._meta.db_table} не пуста - запустите с --truncate')
+
+    def copy_table(self, model):
+        """Копирует одну таблицу одной командой COPY, читая SQLite частями. Выполняется в своем потоке."""
+        columns, sql, params, missing = self.plans[model]
+        table = model._meta.db_table
+        copy_sql = (f'COPY {connection.ops.quote_name(table)} '
+                    f'({", ".join(connection.ops.quote_name(column) for column in columns)}) FROM STDIN')
+        started = time.monotonic()
+        count = 0
+
+        source = sqlite3.connect(f'file:{self.sqlite_path}?mode=ro', uri=True)
+
+        def chunks():
+            nonlocal count
+            cursor = source.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    return
+                count += len(rows)
+                yield ''.join('\t'.join(map(copy_value, row)) + '\n' for row in rows)
+
+        try:
+            with connection.cursor() as cursor:
+                raw = cursor.cursor
+                if hasattr(raw, 'copy'):
+                    # psycopg 3
+                    with raw.copy(copy_sql) as copy:
+                        for chunk in chunks():
+                            copy.write(chunk)
+                else:
+                    raw.copy_expert(copy_sql, CopyStream(chunks()))
+        finally:
+            source.close()
+            # У каждого потока свое соединение Django
+            connection.close()
+        return table, count, time.monotonic() - started
+
+    def finish_target(self, models):
+        """Сбрасывает последовательности id, заполняет вычисляемые поля и обновляет статистику планировщика."""
+        # Промежуточные таблицы M2M тоже: sequence_reset_sql сбрасывает только собственный id каждой модели
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+        if Star in self.plans and set(Star.NAME_FIELDS) & set(self.plans[Star][3]):
+            self.stdout.write('Заполнение полей имени знаменитостей...')
+            batch = []
+            for star in Star.objects.only('id', 'name').iterator(chunk_size=FILL_BATCH_SIZE):
+                star.fill_name_fields()
+                batch.append(star)
+                if len(batch) >= FILL_BATCH_SIZE:
+                    Star.objects.bulk_update(batch, Star.NAME_FIELDS)
+                    batch = []
+            if batch:
+                Star.objects.bulk_update(batch, Star.NAME_FIELDS)
+
+        with connection.cursor() as cursor:
+            for model in models:
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+        # Знаменитости заменены в обход time_update: снимок для поиска в браузере - заново целиком
+        if Star in self.plans:
+            invalidate_search_indexes()
+            export_search_index(incremental=False)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from star.search_export import export_search_index, refresh_search_export
+
+
+class Command(BaseCommand):
+    help = 'Выгружает сжатый снимок индекса имен для поиска в браузере'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Собрать заново, не используя предыдущий снимок')
+        parser.add_argument('--if-changed', action='store_true',
+                            help='Собирать, только если знаменитости изменились после прошлой сборки')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['if_changed'] and not options['full']:
+            result = refresh_search_export()
+            if result is None:
+                self.stdout.write('Снимок актуален или уже собирается')
+                return
+            manifest, changed = result
+        else:
+            manifest, changed = export_search_index(incremental=not options['full'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Снимок {manifest["hash"]}: {manifest["count"]} звезд, изменено {changed}, '
+            f'{manifest["size"] / 1024:.0f} КБ за {elapsed:.1f} с'
+        ))
@@ -0,0 +1,91 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from star.import_check import dry_run, STATUSES
+from star.importing import import_stars, read_rows, IMPORT_BATCH_SIZE
+from star.staging import import_stars_staged
+
+
+class Command(BaseCommand):
+    help = 'Импортирует знаменитостей из Excel, CSV или JSONL потоково, пакетной вставкой'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу .xlsx, .csv или .jsonl')
+        parser.add_argument('--update', action='store_true',
+                            help='Обновлять уже существующих знаменитостей')
+        parser.add_argument('--images', default='img-2',
+                            help='Папка с фотографиями из колонки Img')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='Количество строк в одной транзакции')
+        parser.add_argument('--staged', action='store_true',
+                            help='Загрузить в промежуточные таблицы и опубликовать одной короткой транзакцией')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только проверить файл и сравнить с базой, ничего не записывая')
+        parser.add_argument('--report', help='CSV-файл для статуса каждой строки (с --dry-run)')
+        parser.add_argument('--changed-ids', help='Файл для id созданных и измененных знаменитостей, по одному в строке')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'Файл {path} не найден')
+
+        if options['dry_run']:
+            self.report_dry_run(path, options['report'])
+            return
+
+        def progress(stats):
+            self.stdout.write(f'Обработано {stats.rows} строк ({stats.rows_per_second:.0f} строк/с)')
+
+        try:
+            run_import = import_stars_staged if options['staged'] else import_stars
+            stats = run_import(read_rows(path), update_existing=options['update'], images_dir=options['images'],
+                               batch_size=options['batch_size'], progress=progress)
+        except ValueError as e:
+            raise CommandError(f'Ошибка: {e}')
+
+        for error in stats.errors:
+            self.stderr.write(f'Ошибка: {error}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Импорт завершен за {stats.elapsed:.1f} с ({stats.rows_per_second:.0f} строк/с): '
+            f'создано {stats.created}, обновлено {stats.updated}, без изменений {stats.unchanged}, '
+            f'пропущено {stats.skipped}, ошибок {len(stats.errors)}'
+        ))
+
+        if options['changed_ids']:
+            with open(options['changed_ids'], 'w') as f:
+                f.writelines(f'{star_id}\n' for star_id in stats.changed_ids)
+
+    def report_dry_run(self, path, report_path):
+        """Проверка без записи: сводка по статусам, ошибкам и новым странам и категориям."""
+        started = time.monotonic()
+        try:
+            if report_path:
+                with open(report_path, 'w', newline='', encoding='utf-8') as report_file:
+                    report = dry_run(read_rows(path), report_file)
+            else:
+                report = dry_run(read_rows(path))
+        except ValueError as e:
+            raise CommandError(f'Ошибка: {e}')
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(f'Проверено {report.rows} строк за {elapsed:.1f} с, в базу ничего не записано')
+        labels = {'new': 'новых', 'changed': 'изменится', 'unchanged': 'без изменений',
+                  'skipped': 'будет пропущено', 'invalid': 'с ошибками'}
+        for status in STATUSES:
+            self.stdout.write(f'  {labels[status]}: {report.counts[status]}')
+            for row, name, details in report.samples[status]:
+                self.stdout.write(f'    строка {row}: {name}' + (f' ({details})' if details else ''))
+
+        for reason, count in report.errors.most_common():
+            self.stdout.write(self.style.ERROR(f'Ошибка "{reason}": {count} строк'))
+        for warning, count in report.warnings.most_common():
+            if count:
+                self.stdout.write(self.style.WARNING(f'Предупреждение "{warning}": {count} строк'))
+        for title, values in (('Новые страны', report.unknown_countries),
+                              ('Новые категории', report.unknown_categories)):
+            if values:
+                self.stdout.write(f'{title} ({len(values)}): ' + ', '.join(
+                    f'{name} ({count})' for name, count in values.most_common()))
@@ -0,0 +1,103 @@
+import re
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from star.models import Star, Country, Category
+from star.search import search_stars, search_biographies, use_postgres_search, DateQuery
+from star.views import apply_sort
+
+# Имена индексов в планах PostgreSQL и SQLite
+INDEX_PATTERNS = [
+    re.compile(r'Index (?:Only )?Scan(?: Backward)? using (\S+)'),
+    re.compile(r'Bitmap Index Scan on (\S+)'),
+    re.compile(r'USING (?:COVERING )?INDEX (\S+)'),
+]
+# Полный просмотр таблицы
+SEQ_SCAN_PATTERNS = [
+    re.compile(r'Seq Scan on (\S+)'),
+    re.compile(r'\bSCAN (\w+)(?! USING)\s*$', re.MULTILINE),
+]
+
+# Отдельный шаг сортировки вместо чтения в порядке индекса
+SORT_PATTERN = re.compile(r'^\s*(?:->\s*)?(?:Incremental )?Sort\b|USE TEMP B-TREE FOR (?:ORDER BY|RIGHT PART OF ORDER BY)',
+                          re.MULTILINE)
+
+SORTS = ['rating', 'name_asc', 'name_desc', 'birthday']
+
+
+def used_indexes(plan):
+    """Возвращает (индексы, таблицы с полным просмотром) из текстового плана запроса."""
+    indexes = []
+    for pattern in INDEX_PATTERNS:
+        for name in pattern.findall(plan):
+            if name not in indexes:
+                indexes.append(name)
+
+    seq_scans = []
+    for pattern in SEQ_SCAN_PATTERNS:
+        for name in pattern.findall(plan):
+            if name not in seq_scans:
+                seq_scans.append(name)
+
+    return indexes, seq_scans
+
+
+class Command(BaseCommand):
+    help = 'Показывает, какие индексы используют запросы основных страниц (по EXPLAIN)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plans', action='store_true', help='Печатать планы запросов целиком')
+        parser.add_argument('--analyze', action='store_true',
+                            help='EXPLAIN ANALYZE (только PostgreSQL, запросы выполняются)')
+
+    def query_shapes(self):
+        """Запросы в том виде, в каком их строят представления."""
+        published = Star.objects.filter(is_published=True)
+        country = Country.objects.order_by('-star_counts__count').first()
+        category = Category.objects.order_by('-star_counts__count').first()
+        today = date.today()
+
+        for sort_by in SORTS:
+            yield f'celebrities [{sort_by}]', apply_sort(published, sort_by)[:20]
+            if country:
+                yield f'stars_by_country [{sort_by}]', apply_sort(published.filter(countries=country), sort_by)[:20]
+            if category:
+                yield f'stars_by_category [{sort_by}]', apply_sort(published.filter(categories=category), sort_by)[:20]
+            if country and category:
+                yield f'tag [{sort_by}]', apply_sort(
+                    published.filter(countries=country, categories=category), sort_by)[:20]
+
+        yield 'birthday', published.filter(
+            birth_date__month=today.month, birth_date__day=today.day).order_by('-rating')
+        yield 'search [year]', published.filter(
+            birth_date__range=DateQuery(None, None, 1988).date_range()).order_by('-rating')[:20]
+        if use_postgres_search():
+            yield 'search', search_stars(published, 'Анна')[:20]
+            yield 'search [bio]', search_biographies(published, 'олимпийский чемпион')[:20]
+        yield 'names_letter', published.filter(name_letter='А').order_by('name_sort', 'id')[:200]
+
+    def handle(self, *args, **options):
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                self.stderr.write('EXPLAIN ANALYZE поддерживается только для PostgreSQL')
+                return
+            explain_options = {'analyze': True, 'buffers': True}
+
+        for label, queryset in self.query_shapes():
+            plan = queryset.explain(**explain_options)
+            indexes, seq_scans = used_indexes(plan)
+
+            line = f'{label}: ' + (', '.join(indexes) if indexes else 'индексы не используются')
+            if SORT_PATTERN.search(plan):
+                line += ' (+ сортировка)'
+            if seq_scans:
+                self.stdout.write(self.style.WARNING(f'{line}; полный просмотр: {", ".join(seq_scans)}'))
+            else:
+                self.stdout.write(line)
+
+            if options['plans']:
+                self.stdout.write(plan)
+                self.stdout.write('')
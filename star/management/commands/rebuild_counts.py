@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from star.counts import rebuild_star_counts
+from star.tags import rebuild_tags
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу счетчиков знаменитостей и реестр тегов'
+
+    def handle(self, *args, **options):
+        rows = rebuild_star_counts()
+        self.stdout.write(f'Счетчики пересчитаны: {rows} строк')
+
+        created, updated, deleted = rebuild_tags()
+        self.stdout.write(self.style.SUCCESS(
+            f'Реестр тегов обновлен: создано {created}, обновлено {updated}, удалено {deleted}'
+        ))
@@ -0,0 +1,52 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from star.importing import read_rows
+from star.reference_sync import CATEGORY_SOURCE, COUNTRY_SOURCE, sync_references
+
+
+class Command(BaseCommand):
+    help = ('Загружает справочные данные стран (Country, Country-2, Name, Slug) и категорий '
+            '(Category, Title, Slug) из Excel, CSV или JSONL одним проходом')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--countries', help='Файл со странами: колонка Country и новые значения')
+        parser.add_argument('--categories', help='Файл с категориями: колонка Category и новые значения')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать изменения, ничего не записывая')
+
+    def handle(self, *args, **options):
+        if not (options['countries'] or options['categories']):
+            raise CommandError('Укажите --countries и/или --categories')
+
+        sources = []
+        for option, source in (('countries', COUNTRY_SOURCE), ('categories', CATEGORY_SOURCE)):
+            path = options[option]
+            if path and not os.path.exists(path):
+                raise CommandError(f'Файл {path} не найден')
+            sources.append(read_rows(path, [source['key_column']]) if path else None)
+
+        try:
+            countries, categories, deleted_keys = sync_references(*sources, dry_run=options['dry_run'])
+        except ValueError as e:
+            raise CommandError(f'Ошибка: {e}')
+
+        for stats in (countries, categories):
+            if not stats.rows:
+                continue
+            title = stats.model._meta.verbose_name_plural
+            for error in stats.errors:
+                self.stderr.write(f'{title}: {error}')
+            for name in stats.not_found:
+                self.stderr.write(f'{title}: "{name}" не найдено в базе')
+            if options['verbosity'] > 1:
+                for pk, old in stats.changes.items():
+                    changes = ', '.join(f'{field} было "{value}"' for field, value in old.items())
+                    self.stdout.write(f'{title} #{pk}: {changes}')
+            self.stdout.write(f'{title}: строк {stats.rows}, изменено {stats.updated}, без изменений {stats.unchanged}, '
+                              f'не найдено {len(stats.not_found)}, ошибок {len(stats.errors)}')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Проверка без записи: база и кэш не изменены'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Справочники обновлены, удалено ключей кэша: {deleted_keys}'))
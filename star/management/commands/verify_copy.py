@@ -0,0 +1,242 @@
+import datetime
+import decimal
+import hashlib
+import json
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils.dateparse import parse_date, parse_datetime
+
+from star.management.commands.copy_from_sqlite import copied_models
+
+VERIFY_RANGE_SIZE = 50000
+VERIFY_JOBS = 4
+
+# Сколько отличающихся id показывать для одного диапазона
+MAX_LISTED_IDS = 20
+
+CHECKSUM_MODULUS = 2 ** 64
+
+
+def _datetime(value):
+    # SQLite хранит 'ГГГГ-ММ-ДД ЧЧ:ММ:СС[.мкс]' в UTC - такие строки не разбираются
+    if isinstance(value, str):
+        if len(value) == 26 and value[10] == ' ':
+            return value
+        if len(value) == 19 and value[10] == ' ':
+            return value + '.000000'
+        value = parse_datetime(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=' ', timespec='microseconds')
+
+
+def _date(value):
+    if isinstance(value, str):
+        return value if len(value) == 10 else parse_date(value).isoformat()
+    return value.isoformat()
+
+
+def _json(value):
+    if isinstance(value, str):
+        value = json.loads(value)
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+
+def _other(value):
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+# Приведение значений к одинаковому для SQLite и PostgreSQL виду: SQLite возвращает
+# даты строками, булевы - числами, JSON - текстом без нормализации
+CONVERTERS = {
+    'BooleanField': lambda value: '1' if value else '0',
+    'DateTimeField': _datetime,
+    'DateField': _date,
+    'JSONField': _json,
+    'FloatField': lambda value: repr(float(value)),
+    'DecimalField': lambda value: str(decimal.Decimal(str(value)).normalize()),
+    'BinaryField': _other,
+}
+
+
+def row_hash(row, converters):
+    data = '\x1f'.join(['\\N' if value is None else convert(value) for value, convert in zip(row, converters)])
+    return int.from_bytes(hashlib.blake2b(data.encode(), digest_size=8).digest(), 'big')
+
+
+# Соединения с файлами SQLite процесса пула: одно на файл, на все диапазоны
+_sources = {}
+
+
+def _source(sqlite_path):
+    source = _sources.get(sqlite_path)
+    if source is None:
+        source = _sources[sqlite_path] = sqlite3.connect(f'file:{sqlite_path}?mode=ro', uri=True)
+    return source
+
+
+def _fetch(side, sqlite_path, database, sql, params):
+    """Курсор с результатом запроса: source - файл SQLite, target - база Django."""
+    if side == 'source':
+        return _source(sqlite_path).execute(sql.replace('%s', '?'), params)
+    cursor = connections[database].cursor()
+    cursor.execute(sql, params)
+    return cursor
+
+
+def range_checksum(side, sqlite_path, database, table, columns, kinds, lo, hi, with_rows=False):
+    """
+    Контрольная сумма строк диапазона id [lo, hi): количество и сумма хэшей строк по модулю 2^64 -
+    от порядка строк не зависит. С with_rows - хэши отдельных строк {id: хэш}.
+    Выполняется в процессе пула.
+    """
+    pk = columns[0]
+    sql = f'SELECT {", ".join(columns)} FROM {table}'
+    params = []
+    if lo is not None:
+        sql += f' WHERE {pk} >= %s AND {pk} < %s'
+        params = [lo, hi]
+
+    converters = [CONVERTERS.get(kind, str) for kind in kinds]
+    cursor = _fetch(side, sqlite_path, database, sql, params)
+    count, total, rows = 0, 0, {}
+    while True:
+        chunk = cursor.fetchmany(10000)
+        if not chunk:
+            break
+        for row in chunk:
+            value = row_hash(row, converters)
+            count += 1
+            total = (total + value) % CHECKSUM_MODULUS
+            if with_rows:
+                rows[row[0]] = value
+    cursor.close()
+    return (count, total, rows) if with_rows else (count, total)
+
+
+def _close_connections():
+    # Каждый процесс открывает свои соединения
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Сверяет данные SQLite и базы сайта по контрольным суммам диапазонов id, параллельно'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sqlite_path', nargs='?', default=str(settings.BASE_DIR / 'db.sqlite3'),
+                            help='Файл базы SQLite - источник переноса')
+        parser.add_argument('--database', default='default', help='Псевдоним базы Django, куда перенесены данные')
+        parser.add_argument('--apps', nargs='+', default=['star'], help='Приложения, таблицы которых сверяются')
+        parser.add_argument('--range-size', type=int, default=VERIFY_RANGE_SIZE,
+                            help='Сколько id входит в один диапазон')
+        parser.add_argument('--jobs', type=int, default=VERIFY_JOBS, help='Количество рабочих процессов')
+        parser.add_argument('--rows', action='store_true',
+                            help='Для отличающихся диапазонов показать id отличающихся строк')
+
+    def table_plan(self, model, source):
+        """(таблица, столбцы с первичным ключом первым, типы полей, диапазоны id) или None."""
+        table = model._meta.db_table
+        source_columns = {row[1] for row in source.execute(f'PRAGMA table_info("{table}")')}
+        if not source_columns:
+            return None
+        # Сверяются только столбцы, которые есть в обеих базах (новые столбцы в SQLite могут отсутствовать)
+        pk = model._meta.pk
+        fields = [pk] + [field for field in model._meta.concrete_fields
+                         if field is not pk and field.column in source_columns]
+        columns = [f'"{field.column}"' for field in fields]
+        kinds = [field.get_internal_type() for field in fields]
+
+        if pk.get_internal_type() not in ('AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField',
+                                          'OneToOneField', 'ForeignKey'):
+            return table, columns, kinds, [(None, None)]
+
+        bounds = [source.execute(f'SELECT MIN({columns[0]}), MAX({columns[0]}) FROM "{table}"').fetchone()]
+        with connections[self.database].cursor() as cursor:
+            cursor.execute(f'SELECT MIN({columns[0]}), MAX({columns[0]}) FROM "{table}"')
+            bounds.append(cursor.fetchone())
+        lows = [low for low, high in bounds if low is not None]
+        highs = [high for low, high in bounds if high is not None]
+        if not lows:
+            return table, columns, kinds, []
+        start = min(lows) // self.range_size * self.range_size
+        ranges = [(lo, lo + self.range_size) for lo in range(start, max(highs) + 1, self.range_size)]
+        return table, columns, kinds, ranges
+
+    def handle(self, *args, **options):
+        self.sqlite_path = options['sqlite_path']
+        self.database = options['database']
+        self.range_size = options['range_size']
+        started = time.monotonic()
+
+        source = sqlite3.connect(f'file:{self.sqlite_path}?mode=ro', uri=True)
+        plans = []
+        for model in copied_models(options['apps']):
+            plan = self.table_plan(model, source)
+            if plan is None:
+                self.stdout.write(self.style.WARNING(f'{model._meta.db_table}: нет в SQLite, пропускается'))
+            else:
+                plans.append(plan)
+        source.close()
+
+        _close_connections()
+        with ProcessPoolExecutor(max_workers=options['jobs'], initializer=_close_connections) as pool:
+            futures = {}
+            for table, columns, kinds, ranges in plans:
+                for lo, hi in ranges:
+                    for side in ('source', 'target'):
+                        futures[table, lo, side] = pool.submit(
+                            range_checksum, side, self.sqlite_path, self.database,
+                            f'"{table}"', columns, kinds, lo, hi)
+
+            differing = 0
+            for table, columns, kinds, ranges in plans:
+                bad = [(lo, hi) for lo, hi in ranges
+                       if futures[table, lo, 'source'].result() != futures[table, lo, 'target'].result()]
+                source_rows = sum(futures[table, lo, 'source'].result()[0] for lo, hi in ranges)
+                target_rows = sum(futures[table, lo, 'target'].result()[0] for lo, hi in ranges)
+                if not bad:
+                    self.stdout.write(f'{table}: совпадает ({source_rows} строк, диапазонов: {len(ranges)})')
+                    continue
+
+                differing += 1
+                self.stdout.write(self.style.ERROR(
+                    f'{table}: отличается {len(bad)} из {len(ranges)} диапазонов '
+                    f'(строк в SQLite {source_rows}, в базе {target_rows})'))
+                for lo, hi in bad:
+                    source_count = futures[table, lo, 'source'].result()[0]
+                    target_count = futures[table, lo, 'target'].result()[0]
+                    where = f'id {lo}..{hi - 1}' if lo is not None else 'вся таблица'
+                    self.stdout.write(f'  {where}: строк в SQLite {source_count}, в базе {target_count}')
+                    if options['rows']:
+                        self.report_rows(pool, f'"{table}"', columns, kinds, lo, hi)
+
+        elapsed = time.monotonic() - started
+        if differing:
+            self.stdout.write(self.style.ERROR(f'Отличаются таблиц: {differing}, проверка за {elapsed:.1f} с'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Все таблицы совпадают, проверка за {elapsed:.1f} с'))
+
+    def report_rows(self, pool, table, columns, kinds, lo, hi):
+        """id строк диапазона, которых нет на одной из сторон или которые отличаются."""
+        source, target = [
+            pool.submit(range_checksum, side, self.sqlite_path, self.database, table, columns, kinds, lo, hi, True)
+            for side in ('source', 'target')
+        ]
+        source_rows, target_rows = source.result()[2], target.result()[2]
+        for title, ids in (
+            ('нет в базе', source_rows.keys() - target_rows.keys()),
+            ('нет в SQLite', target_rows.keys() - source_rows.keys()),
+            ('отличаются', {pk for pk in source_rows.keys() & target_rows.keys()
+                            if source_rows[pk] != target_rows[pk]}),
+        ):
+            if ids:
+                listed = ', '.join(map(str, sorted(ids)[:MAX_LISTED_IDS]))
+                more = f' и еще {len(ids) - MAX_LISTED_IDS}' if len(ids) > MAX_LISTED_IDS else ''
+                self.stdout.write(f'    {title} ({len(ids)}): {listed}{more}')
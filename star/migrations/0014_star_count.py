@@ -0,0 +1,63 @@
+# Generated by Django 4.2.19 on 2026-10-19 16:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_star_counts(apps, schema_editor):
+    """Первичное заполнение счетчиков по опубликованным знаменитостям."""
+    Star = apps.get_model('star', 'Star')
+    StarCount = apps.get_model('star', 'StarCount')
+
+    published = Star.objects.filter(is_published=True).order_by()
+    rows = []
+    pairs = (published.filter(categories__isnull=False, countries__isnull=False)
+             .values_list('categories', 'countries')
+             .annotate(n=models.Count('id', distinct=True)))
+    for category_id, country_id, n in pairs:
+        rows.append(StarCount(category_id=category_id, country_id=country_id, count=n))
+    for country_id, n in (published.filter(countries__isnull=False)
+                          .values_list('countries').annotate(n=models.Count('id', distinct=True))):
+        rows.append(StarCount(country_id=country_id, count=n))
+    for category_id, n in (published.filter(categories__isnull=False)
+                           .values_list('categories').annotate(n=models.Count('id', distinct=True))):
+        rows.append(StarCount(category_id=category_id, count=n))
+
+    StarCount.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0013_alter_category_options_alter_country_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StarCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Количество')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='star_counts', to='star.category', verbose_name='Категория')),
+                ('country', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='star_counts', to='star.country', verbose_name='Страна')),
+            ],
+            options={
+                'verbose_name': 'Счетчик знаменитостей',
+                'verbose_name_plural': 'Счетчики знаменитостей',
+                'indexes': [models.Index(fields=['category', '-count'], name='star_count_category_idx'), models.Index(fields=['country', '-count'], name='star_count_country_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='starcount',
+            constraint=models.UniqueConstraint(fields=('category', 'country'), name='star_count_pair_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='starcount',
+            constraint=models.UniqueConstraint(condition=models.Q(('country__isnull', True)), fields=('category',), name='star_count_category_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='starcount',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('country',), name='star_count_country_uniq'),
+        ),
+        migrations.RunPython(fill_star_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.19 on 2026-10-19 16:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_tags(apps, schema_editor):
+    """Первичное заполнение реестра тегов по таблице счетчиков."""
+    StarCount = apps.get_model('star', 'StarCount')
+    Tag = apps.get_model('star', 'Tag')
+
+    rows = StarCount.objects.filter(
+        category__isnull=False,
+        country__isnull=False,
+        count__gte=10
+    ).select_related('category', 'country').order_by('-count')
+
+    tags = []
+    seen = set()
+    for row in rows:
+        slug = f"{row.category.slug}-{row.country.slug}"
+        if slug in seen:
+            continue
+        seen.add(slug)
+        tags.append(Tag(slug=slug, category_id=row.category_id, country_id=row.country_id, count=row.count))
+
+    Tag.objects.bulk_create(tags, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0014_star_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=255, unique=True, verbose_name='URL')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Количество знаменитостей')),
+                ('time_update', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tags', to='star.category', verbose_name='Категория')),
+                ('country', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tags', to='star.country', verbose_name='Страна')),
+            ],
+            options={
+                'verbose_name': 'Тег',
+                'verbose_name_plural': 'Теги',
+                'ordering': ['-count'],
+                'indexes': [models.Index(fields=['category', '-count'], name='tag_category_idx'), models.Index(fields=['country', '-count'], name='tag_country_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('category', 'country'), name='tag_pair_uniq'),
+        ),
+        migrations.RunPython(fill_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.19 on 2026-10-19 16:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0015_tag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarStars',
+            fields=[
+                ('star', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similar', serialize=False, to='star.star', verbose_name='Знаменитость')),
+                ('neighbour_ids', models.JSONField(default=list, verbose_name='ID похожих знаменитостей')),
+                ('time_update', models.DateTimeField(auto_now=True, verbose_name='Дата расчета')),
+            ],
+            options={
+                'verbose_name': 'Похожие знаменитости',
+                'verbose_name_plural': 'Похожие знаменитости',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.19 on 2026-10-19 16:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0016_similarstars'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='star',
+            name='published_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='star',
+            name='rating_idx',
+        ),
+        migrations.AddIndex(
+            model_name='star',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-rating', 'id'], name='star_pub_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='star',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['name', 'id'], name='star_pub_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='star',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-time_create', 'id'], name='star_pub_created_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Обратные составные индексы на промежуточных таблицах M2M.
+    Django создает только unique (star_id, X_id) и одиночный индекс X_id;
+    (X_id, star_id) позволяет index-only scan при выборке звезд страны или категории.
+    """
+
+    dependencies = [
+        ('star', '0017_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS star_countries_rev_idx ON star_star_countries (country_id, star_id);',
+            'DROP INDEX IF EXISTS star_countries_rev_idx;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS star_categories_rev_idx ON star_star_categories (category_id, star_id);',
+            'DROP INDEX IF EXISTS star_categories_rev_idx;',
+        ),
+    ]
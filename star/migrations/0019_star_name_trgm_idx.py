@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    # Триграммный индекс есть только в PostgreSQL; на остальных базах работает индекс в памяти
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS star_name_trgm_idx ON star_star USING gin (name gin_trgm_ops);'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS star_name_trgm_idx;')
+
+
+class Migration(migrations.Migration):
+    """GIN-индекс по триграммам имени для поиска (ILIKE и word_similarity)."""
+
+    dependencies = [
+        ('star', '0018_m2m_reverse_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
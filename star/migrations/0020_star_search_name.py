@@ -0,0 +1,90 @@
+# Generated by Django 4.2.19 on 2026-10-19 16:41
+
+import re
+
+from django.db import migrations, models
+from transliterate import translit
+
+# Правила вариантов имени на момент миграции (копия star.utils: миграция не должна
+# зависеть от их последующих изменений)
+WORD_RE = re.compile(r'\w+')
+LATIN_RE = re.compile(r'[a-z]')
+PARTICLE_MAX_LENGTH = 3
+
+
+def tokenize(text):
+    return WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def transliterate_text(text, to_latin=True):
+    result = translit(text, 'ru', reversed=to_latin)
+    return ' '.join(tokenize(result.replace("'", '')))
+
+
+def build_search_name(text):
+    """Нормализованное имя, транслитерация и они же со слитными частицами: '/вариант/вариант/'."""
+    name = ' '.join(tokenize(text))
+    if not name:
+        return ''
+
+    variants = [name, transliterate_text(name, to_latin=not LATIN_RE.search(name))]
+    for variant in variants[:2]:
+        words = variant.split()
+        for position in range(len(words) - 1):
+            if len(words[position]) <= PARTICLE_MAX_LENGTH:
+                merged = words[:position] + [words[position] + words[position + 1]] + words[position + 2:]
+                variants.append(' '.join(merged))
+
+    variants = list(dict.fromkeys(variant for variant in variants if variant))
+    return '/' + '/'.join(variants) + '/'
+
+
+def fill_search_names(apps, schema_editor):
+    """Заполняет варианты написания имен для поиска."""
+    Star = apps.get_model('star', 'Star')
+
+    batch = []
+    for star in Star.objects.only('id', 'name').iterator(chunk_size=5000):
+        star.search_name = build_search_name(star.name)
+        batch.append(star)
+        if len(batch) >= 5000:
+            Star.objects.bulk_update(batch, ['search_name'])
+            batch = []
+    if batch:
+        Star.objects.bulk_update(batch, ['search_name'])
+
+
+def move_trigram_index(apps, schema_editor):
+    # Триграммный индекс переезжает с name на search_name (только PostgreSQL)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS star_search_name_trgm_idx ON star_star USING gin (search_name gin_trgm_ops);'
+    )
+    schema_editor.execute('DROP INDEX IF EXISTS star_name_trgm_idx;')
+
+
+def restore_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS star_name_trgm_idx ON star_star USING gin (name gin_trgm_ops);'
+    )
+    schema_editor.execute('DROP INDEX IF EXISTS star_search_name_trgm_idx;')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0019_star_name_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='star',
+            name='search_name',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_names, migrations.RunPython.noop),
+        migrations.RunPython(move_trigram_index, restore_trigram_index),
+    ]
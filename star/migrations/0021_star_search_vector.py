@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+def create_search_vector(apps, schema_editor):
+    # Полнотекстовый поиск по биографиям есть только в PostgreSQL; на других базах
+    # используется поиск подстрокой (star.search.search_biographies)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # Генерируемый столбец пересчитывается самой базой при каждом сохранении биографии
+    schema_editor.execute(
+        "ALTER TABLE star_star ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('russian', coalesce(content, ''))) STORED;"
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS star_search_vector_idx ON star_star USING gin (search_vector);'
+    )
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS star_search_vector_idx;')
+    schema_editor.execute('ALTER TABLE star_star DROP COLUMN IF EXISTS search_vector;')
+
+
+class Migration(migrations.Migration):
+    """
+    Столбец search_vector (tsvector по биографии, русская морфология) с GIN-индексом.
+    В модели не описан: SQLite такого типа не знает, запросы к нему - через RawSQL.
+    """
+
+    dependencies = [
+        ('star', '0020_star_search_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.19 on 2026-10-19 17:05
+
+import re
+
+from django.db import migrations, models
+
+# Правило буквы указателя на момент миграции (копия star.utils.first_letter)
+WORD_RE = re.compile(r'\w+')
+
+
+def first_letter(text):
+    match = WORD_RE.search((text or '').lower().replace('ё', 'е'))
+    return match.group()[0].upper() if match else ''
+
+
+def fill_name_letters(apps, schema_editor):
+    """Заполняет букву алфавитного указателя для существующих знаменитостей."""
+    Star = apps.get_model('star', 'Star')
+
+    batch = []
+    for star in Star.objects.only('id', 'name').iterator(chunk_size=5000):
+        star.name_letter = first_letter(star.name)
+        batch.append(star)
+        if len(batch) >= 5000:
+            Star.objects.bulk_update(batch, ['name_letter'])
+            batch = []
+    if batch:
+        Star.objects.bulk_update(batch, ['name_letter'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0021_star_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='star',
+            name='name_letter',
+            field=models.CharField(blank=True, default='', editable=False, max_length=1),
+        ),
+        migrations.RunPython(fill_name_letters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='star',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['name_letter', 'name', 'id'], name='star_pub_letter_idx'),
+        ),
+    ]
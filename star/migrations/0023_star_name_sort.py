@@ -0,0 +1,79 @@
+# Generated by Django 4.2.19 on 2026-10-19 17:20
+
+import re
+
+from django.db import migrations, models
+
+# Правило ключа сортировки на момент миграции (копия star.utils.name_sort_key)
+WORD_RE = re.compile(r'\w+')
+NAME_SORT_LENGTH = 120
+
+
+def name_sort_key(text):
+    words = WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+    if not words:
+        return ''
+    first = words[0][0]
+    group = '1' if 'а' <= first <= 'я' else '2' if 'a' <= first <= 'z' else '3'
+    return (group + ' '.join(words))[:NAME_SORT_LENGTH]
+
+
+def fill_name_sort(apps, schema_editor):
+    """Заполняет ключ сортировки имени для существующих знаменитостей."""
+    Star = apps.get_model('star', 'Star')
+
+    batch = []
+    for star in Star.objects.only('id', 'name').iterator(chunk_size=5000):
+        star.name_sort = name_sort_key(star.name)
+        batch.append(star)
+        if len(batch) >= 5000:
+            Star.objects.bulk_update(batch, ['name_sort'])
+            batch = []
+    if batch:
+        Star.objects.bulk_update(batch, ['name_sort'])
+
+
+def set_binary_collation(apps, schema_editor):
+    # Ключ сравнивается побайтно: правила сравнения "C" (только PostgreSQL, в SQLite BINARY по умолчанию)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE star_star ALTER COLUMN name_sort TYPE varchar(120) COLLATE "C";')
+
+
+def reset_collation(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE star_star ALTER COLUMN name_sort TYPE varchar(120) COLLATE "default";')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0022_star_name_letter'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='star',
+            name='star_pub_name_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='star',
+            name='star_pub_letter_idx',
+        ),
+        migrations.AddField(
+            model_name='star',
+            name='name_sort',
+            field=models.CharField(blank=True, default='', editable=False, max_length=120),
+        ),
+        migrations.RunPython(fill_name_sort, migrations.RunPython.noop),
+        migrations.RunPython(set_binary_collation, reset_collation),
+        migrations.AddIndex(
+            model_name='star',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['name_sort', 'id'], name='star_pub_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='star',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['name_letter', 'name_sort', 'id'], name='star_pub_letter_idx'),
+        ),
+    ]
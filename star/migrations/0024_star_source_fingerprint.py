@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0023_star_name_sort'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='star',
+            name='source_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+    ]
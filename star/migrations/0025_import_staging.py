@@ -0,0 +1,66 @@
+# Generated by Django 4.2.19 on 2026-10-19 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0024_star_source_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run', models.CharField(max_length=32)),
+                ('line', models.PositiveIntegerField()),
+                ('kind', models.CharField(max_length=10)),
+                ('related_id', models.IntegerField()),
+            ],
+            options={
+                'verbose_name': 'Связь строки импорта',
+                'verbose_name_plural': 'Связи строк импорта',
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run', models.CharField(max_length=32, verbose_name='Запуск импорта')),
+                ('line', models.PositiveIntegerField(verbose_name='Номер строки')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.CharField(blank=True, default='', max_length=255)),
+                ('birth_date', models.DateField()),
+                ('death_date', models.DateField(null=True)),
+                ('content', models.TextField(null=True)),
+                ('wikipedia', models.CharField(max_length=200, null=True)),
+                ('ruwiki', models.CharField(max_length=200, null=True)),
+                ('rating', models.IntegerField(default=0)),
+                ('photo', models.CharField(max_length=100, null=True)),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('search_name', models.TextField(default='')),
+                ('name_letter', models.CharField(default='', max_length=1)),
+                ('name_sort', models.CharField(default='', max_length=120)),
+                ('countries_given', models.BooleanField(default=True)),
+                ('categories_given', models.BooleanField(default=True)),
+                ('star_id', models.IntegerField(null=True)),
+                ('action', models.CharField(default='', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Строка импорта',
+                'verbose_name_plural': 'Строки импорта',
+                'indexes': [models.Index(fields=['run', 'name'], name='import_row_name_idx'), models.Index(fields=['run', 'action'], name='import_row_action_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='importrow',
+            constraint=models.UniqueConstraint(fields=('run', 'line'), name='import_row_line_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='importlink',
+            index=models.Index(fields=['run', 'line', 'kind'], name='import_link_line_idx'),
+        ),
+    ]
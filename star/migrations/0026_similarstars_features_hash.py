@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-19 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('star', '0025_import_staging'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='similarstars',
+            name='features_hash',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+    ]
@@ -1,7 +1,8 @@
 from django.db import models
 from datetime import date
-from django.utils.text import slugify
-from transliterate import translit
+
+from .slugs import save_with_slug
+from .utils import build_search_name, first_letter, name_sort_key, NAME_SORT_LENGTH
 
 
 class Country(models.Model):
@@ -13,19 +14,7 @@ class Country(models.Model):
         return self.name
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            translit_name = translit(self.name, 'ru', reversed=True)
-            base_slug = slugify(translit_name)
-
-            slug = base_slug
-            n = 1
-            while Country.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{n}"
-                n += 1
-
-            self.slug = slug
-
-        super().save(*args, **kwargs)
+        save_with_slug(self, self.name, lambda: super(Country, self).save(*args, **kwargs), 'country')
 
     class Meta:
         verbose_name = 'Страна'
@@ -43,19 +32,7 @@ class Category(models.Model):
         return self.title
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            translit_name = translit(self.title, 'ru', reversed=True)
-            base_slug = slugify(translit_name)
-
-            slug = base_slug
-            n = 1
-            while Category.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{n}"
-                n += 1
-
-            self.slug = slug
-
-        super().save(*args, **kwargs)
+        save_with_slug(self, self.title, lambda: super(Category, self).save(*args, **kwargs), 'category')
 
     class Meta:
         verbose_name = 'Категория'
@@ -77,6 +54,14 @@ class Star(models.Model):
     rating = models.IntegerField(verbose_name="Рейтинг", default=0)
     wikipedia = models.URLField(verbose_name="Ссылка на Wikipedia", blank=True, null=True)
     ruwiki = models.URLField(verbose_name="Ссылка на RuWiki", blank=True, null=True)
+    # Варианты написания имени для поиска (кириллица, транслитерация), заполняется при сохранении
+    search_name = models.TextField(blank=True, default='', editable=False)
+    # Буква в алфавитном указателе имен (Ё -> Е), заполняется при сохранении
+    name_letter = models.CharField(max_length=1, blank=True, default='', editable=False)
+    # Ключ сортировки по имени (см. utils.name_sort_key), заполняется при сохранении
+    name_sort = models.CharField(max_length=NAME_SORT_LENGTH, blank=True, default='', editable=False)
+    # Отпечаток строки файла импорта (см. importing.row_fingerprint), по нему пропускаются неизменившиеся строки
+    source_fingerprint = models.CharField(max_length=40, blank=True, default='', editable=False)
 
     is_published = models.BooleanField(default=True)
     time_create = models.DateTimeField(auto_now_add=True)
@@ -109,20 +94,22 @@ class Star(models.Model):
             return f"{birth_year}-{death_year}"
         return str(birth_year)
 
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            translit_name = translit(self.name, 'ru', reversed=True)
-            base_slug = slugify(translit_name)
+    # Поля, которые вычисляются из имени
+    NAME_FIELDS = ('search_name', 'name_letter', 'name_sort')
 
-            slug = base_slug
-            n = 1
-            while Star.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{n}"
-                n += 1
+    def fill_name_fields(self):
+        """Заполняет поля, вычисляемые из имени: варианты для поиска, букву указателя, ключ сортировки."""
+        self.search_name = build_search_name(self.name)
+        self.name_letter = first_letter(self.name)
+        self.name_sort = name_sort_key(self.name)
 
-            self.slug = slug
+    def save(self, *args, **kwargs):
+        self.fill_name_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, *self.NAME_FIELDS}
 
-        super().save(*args, **kwargs)
+        save_with_slug(self, self.name, lambda: super(Star, self).save(*args, **kwargs), 'star')
 
     def get_absolute_url(self):
         from django.urls import reverse
@@ -134,14 +121,22 @@ class Star(models.Model):
         ordering = ['-time_create']
         indexes = [
             models.Index(fields=['-time_create']),
-            # Новые индексы для оптимизации
-            models.Index(fields=['is_published'], name='published_idx'),
-            models.Index(fields=['rating'], name='rating_idx'),
             models.Index(fields=['name'], name='name_idx'),
             # Индекс для поиска дней рождения
             models.Index(fields=['birth_date'], name='birth_date_idx'),
             # Композитные индексы для частых запросов
             models.Index(fields=['is_published', 'birth_date'], name='published_bday_idx'),
+            # Частичные индексы под листинги: WHERE is_published ORDER BY ... LIMIT 20.
+            # id в ключе делает их покрывающими для полу-соединения со связями M2M
+            models.Index(fields=['-rating', 'id'], name='star_pub_rating_idx',
+                         condition=models.Q(is_published=True)),
+            models.Index(fields=['name_sort', 'id'], name='star_pub_name_idx',
+                         condition=models.Q(is_published=True)),
+            models.Index(fields=['-time_create', 'id'], name='star_pub_created_idx',
+                         condition=models.Q(is_published=True)),
+            # Алфавитный указатель: звезды на букву в порядке имени
+            models.Index(fields=['name_letter', 'name_sort', 'id'], name='star_pub_letter_idx',
+                         condition=models.Q(is_published=True)),
         ]
 
 
@@ -158,4 +153,136 @@ class FeedbackMessage(models.Model):
     class Meta:
         verbose_name = "Сообщение обратной связи"
         verbose_name_plural = "Сообщения обратной связи"
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+
+class StarCount(models.Model):
+    """Материализованные счетчики опубликованных знаменитостей.
+
+    Строка с категорией и страной хранит размер пересечения (виртуальной категории),
+    строка только со страной или только с категорией - общее количество по ней.
+    Пересчитывается целиком командой rebuild_counts и поддерживается сигналами.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='star_counts', verbose_name="Категория")
+    country = models.ForeignKey(Country, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='star_counts', verbose_name="Страна")
+    count = models.PositiveIntegerField(default=0, verbose_name="Количество")
+
+    def __str__(self):
+        return f"{self.category or '*'} / {self.country or '*'}: {self.count}"
+
+    class Meta:
+        verbose_name = 'Счетчик знаменитостей'
+        verbose_name_plural = 'Счетчики знаменитостей'
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'country'], name='star_count_pair_uniq'),
+            models.UniqueConstraint(fields=['category'], condition=models.Q(country__isnull=True),
+                                    name='star_count_category_uniq'),
+            models.UniqueConstraint(fields=['country'], condition=models.Q(category__isnull=True),
+                                    name='star_count_country_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['category', '-count'], name='star_count_category_idx'),
+            models.Index(fields=['country', '-count'], name='star_count_country_idx'),
+        ]
+
+
+class Tag(models.Model):
+    """Виртуальная категория (тег): пересечение категории и страны с достаточным количеством знаменитостей.
+
+    Реестр перестраивается из счетчиков командой rebuild_counts и поддерживается сигналами.
+    """
+    slug = models.SlugField(max_length=255, unique=True, verbose_name="URL")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='tags', verbose_name="Категория")
+    country = models.ForeignKey(Country, on_delete=models.CASCADE, related_name='tags', verbose_name="Страна")
+    count = models.PositiveIntegerField(default=0, verbose_name="Количество знаменитостей")
+    time_update = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
+
+    def __str__(self):
+        return self.slug
+
+    def get_absolute_url(self):
+        from django.urls import reverse
+        return reverse('tag', kwargs={'tag_slug': self.slug})
+
+    class Meta:
+        verbose_name = 'Тег'
+        verbose_name_plural = 'Теги'
+        ordering = ['-count']
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'country'], name='tag_pair_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['category', '-count'], name='tag_category_idx'),
+            models.Index(fields=['country', '-count'], name='tag_country_idx'),
+        ]
+
+
+class SimilarStars(models.Model):
+    """Предрассчитанный список похожих знаменитостей (команда compute_similar_stars)."""
+    star = models.OneToOneField(Star, on_delete=models.CASCADE, primary_key=True,
+                                related_name='similar', verbose_name="Знаменитость")
+    neighbour_ids = models.JSONField(default=list, verbose_name="ID похожих знаменитостей")
+    # Отпечаток признаков звезды на момент расчета (см. recommendations.feature_fingerprints)
+    features_hash = models.BigIntegerField(null=True, editable=False)
+    time_update = models.DateTimeField(auto_now=True, verbose_name="Дата расчета")
+
+    def __str__(self):
+        return f"Похожие на {self.star_id}"
+
+    class Meta:
+        verbose_name = 'Похожие знаменитости'
+        verbose_name_plural = 'Похожие знаменитости'
+
+
+class ImportRow(models.Model):
+    """Строка файла импорта в промежуточной таблице (см. staging): проверяется и публикуется одним пакетом."""
+    run = models.CharField(max_length=32, verbose_name="Запуск импорта")
+    line = models.PositiveIntegerField(verbose_name="Номер строки")
+    name = models.CharField(max_length=100)
+    slug = models.CharField(max_length=255, blank=True, default='')
+    birth_date = models.DateField()
+    death_date = models.DateField(null=True)
+    content = models.TextField(null=True)
+    wikipedia = models.CharField(max_length=200, null=True)
+    ruwiki = models.CharField(max_length=200, null=True)
+    rating = models.IntegerField(default=0)
+    photo = models.CharField(max_length=100, null=True)
+    fingerprint = models.CharField(max_length=40)
+    search_name = models.TextField(default='')
+    name_letter = models.CharField(max_length=1, default='')
+    name_sort = models.CharField(max_length=NAME_SORT_LENGTH, default='')
+    # Указаны ли страны и категории явно (иначе у существующей знаменитости связи не меняются)
+    countries_given = models.BooleanField(default=True)
+    categories_given = models.BooleanField(default=True)
+    # Заполняются при проверке: найденная знаменитость и действие при публикации
+    star_id = models.IntegerField(null=True)
+    action = models.CharField(max_length=10, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Строка импорта'
+        verbose_name_plural = 'Строки импорта'
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'line'], name='import_row_line_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['run', 'name'], name='import_row_name_idx'),
+            models.Index(fields=['run', 'action'], name='import_row_action_idx'),
+        ]
+
+
+class ImportLink(models.Model):
+    """Связь строки импорта со страной или категорией (kind - 'countries' или 'categories')."""
+    run = models.CharField(max_length=32)
+    line = models.PositiveIntegerField()
+    kind = models.CharField(max_length=10)
+    related_id = models.IntegerField()
+
+    class Meta:
+        verbose_name = 'Связь строки импорта'
+        verbose_name_plural = 'Связи строк импорта'
+        indexes = [
+            models.Index(fields=['run', 'line', 'kind'], name='import_link_line_idx'),
+        ]
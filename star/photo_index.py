@@ -0,0 +1,157 @@
+"""
+Индекс загруженных фотографий по содержимому: sha256 файла -> путь в MEDIA_ROOT.
+
+Индекс хранится вне раздаваемой папки MEDIA_ROOT (настройка STAR_PHOTO_INDEX_PATH) вместе
+с размером и временем изменения каждого файла, поэтому при обновлении (refresh) заново хэшируются только
+новые и измененные файлы - например, загруженные через форму после прошлого импорта.
+Так же кэшируются хэши файлов источника импорта: повторный импорт той же папки
+не читает картинки заново.
+
+Хэширование и копирование выполняются в пуле потоков (работа с диском отпускает GIL);
+сам индекс меняется только в вызывающем потоке.
+"""
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+PHOTO_DIR = 'photos'
+PHOTO_INDEX_NAME = 'photo-index.json'
+PHOTO_INDEX_FORMAT = 1
+
+PHOTO_THREADS = 8
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat_key(path):
+    """(размер, mtime в нс) или None, если файла нет."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class PhotoIndex:
+    """Хэш содержимого -> относительный путь фотографии в MEDIA_ROOT."""
+
+    def __init__(self, media_root=None, path=None):
+        self.media_root = os.path.abspath(media_root or settings.MEDIA_ROOT)
+        self.path = path or getattr(settings, 'STAR_PHOTO_INDEX_PATH', None) or \
+            os.path.join(settings.BASE_DIR, 'var', PHOTO_INDEX_NAME)
+        # относительный путь -> [размер, mtime, хэш]
+        self.files = {}
+        # абсолютный путь в источнике -> [размер, mtime, хэш]
+        self.sources = {}
+        self.by_hash = {}
+        self.changed = False
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self
+        if data.get('format') == PHOTO_INDEX_FORMAT:
+            # Пути файлов относятся к своей MEDIA_ROOT, хэши источника - нет
+            if data.get('media_root') == self.media_root:
+                self.files = data['files']
+                self._rebuild_by_hash()
+            self.sources = data['sources']
+        return self
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': PHOTO_INDEX_FORMAT, 'media_root': self.media_root,
+                       'files': self.files, 'sources': self.sources}, f)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    def _rebuild_by_hash(self):
+        self.by_hash = {}
+        for relative_path, (size, mtime, content_hash) in sorted(self.files.items()):
+            self.by_hash.setdefault(content_hash, relative_path)
+
+    def refresh(self, pool):
+        """
+        Сверяет индекс с папкой фотографий одним обходом: удаленные файлы убираются,
+        новые и измененные хэшируются в пуле потоков.
+        """
+        root = os.path.join(self.media_root, PHOTO_DIR)
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                relative_path = os.path.relpath(path, self.media_root).replace(os.sep, '/')
+                found[relative_path] = _stat_key(path)
+
+        removed = self.files.keys() - found.keys()
+        for relative_path in removed:
+            del self.files[relative_path]
+
+        stale = [relative_path for relative_path, stat in found.items()
+                 if stat is not None and self.files.get(relative_path, [None, None])[:2] != stat]
+        hashes = pool.map(lambda relative_path: file_hash(os.path.join(self.media_root, relative_path)), stale)
+        for relative_path, content_hash in zip(stale, hashes):
+            self.files[relative_path] = found[relative_path] + [content_hash]
+
+        if removed or stale:
+            self.changed = True
+            self._rebuild_by_hash()
+        return self
+
+    def source_hashes(self, paths, pool):
+        """Хэши файлов источника {путь: хэш}; отсутствующие файлы пропускаются."""
+        result = {}
+        stale = []
+        for path in paths:
+            stat = _stat_key(path)
+            if stat is None:
+                continue
+            cached = self.sources.get(path)
+            if cached and cached[:2] == stat:
+                result[path] = cached[2]
+            else:
+                stale.append((path, stat))
+
+        for (path, stat), content_hash in zip(stale, pool.map(lambda item: file_hash(item[0]), stale)):
+            self.sources[path] = stat + [content_hash]
+            result[path] = content_hash
+        if stale:
+            self.changed = True
+        return result
+
+    def get(self, content_hash):
+        return self.by_hash.get(content_hash)
+
+    def add(self, relative_path, content_hash):
+        self.files[relative_path] = _stat_key(os.path.join(self.media_root, relative_path)) + [content_hash]
+        self.by_hash.setdefault(content_hash, relative_path)
+        self.changed = True
+
+
+def photo_pool(threads=PHOTO_THREADS):
+    return ThreadPoolExecutor(max_workers=threads, thread_name_prefix='photos')
+
+
+def copy_files(pairs, pool):
+    """Копирует файлы [(откуда, куда)] в пуле потоков."""
+    for _ in pool.map(lambda pair: shutil.copy2(*pair), pairs):
+        pass
@@ -0,0 +1,295 @@
+"""
+Офлайн-расчет похожих знаменитостей.
+
+Все опубликованные звезды загружаются в матрицы признаков: категории и страны - битовые
+маски (разреженные признаки упакованы в uint64), эпоха рождения, рейтинг и признак
+"жив/умер" - плотные столбцы. Кандидаты в соседи звезды - лучшие по рейтингу звезды
+каждой ее категории (не больше CATEGORY_POOL_SIZE на категорию), похожесть на них
+считается векторно блоками строк. Работа на звезду ограничена числом ее категорий,
+поэтому время растет линейно с количеством звезд. Результат - top-K id соседей
+на звезду в таблице SimilarStars.
+
+Вместе со списком хранится отпечаток признаков звезды. Инкрементальный расчет
+сравнивает отпечатки с текущими данными и пересчитывает звезды с изменившимися
+признаками (в том числе связями M2M, которые не меняют time_update), новые звезды,
+звезды, в списках которых есть измененные, снятые с публикации или удаленные соседи,
+и звезды категорий, в пул кандидатов которых входят измененные звезды.
+"""
+import numpy as np
+import pandas as pd
+from django.db import transaction
+
+from .models import Star, SimilarStars
+
+# Сколько соседей хранится для каждой звезды
+SIMILAR_TOP_K = 10
+
+# Сколько лучших по рейтингу звезд каждой категории проверяется как кандидаты в соседи
+CATEGORY_POOL_SIZE = 1000
+
+# Ограничение на размер матрицы оценок одного блока строк (ячеек float32)
+MAX_SCORE_CELLS = 8_000_000
+
+# Веса признаков похожести
+WEIGHT_CATEGORY = 3.0
+WEIGHT_COUNTRY = 2.0
+WEIGHT_ERA = 1.0
+WEIGHT_RATING = 1.0
+WEIGHT_ALIVE = 0.5
+
+
+def _bitsets(star_index, links, n_stars):
+    """
+    Упаковывает связи (star_id, related_id) в матрицу битовых масок (n_stars x words).
+    Возвращает ее вместе со связями в виде (строки звезд, позиции связанных объектов).
+    """
+    positions = pd.Index(sorted(links['related_id'].unique()))
+    words = max(1, (len(positions) + 63) // 64)
+    bits = np.zeros((n_stars, words), dtype=np.uint64)
+
+    rows = star_index.get_indexer(links['star_id'])
+    cols = positions.get_indexer(links['related_id'])
+    mask = rows >= 0
+    rows, cols = rows[mask], cols[mask]
+
+    np.bitwise_or.at(bits, (rows, cols // 64), np.left_shift(np.uint64(1), (cols % 64).astype(np.uint64)))
+    return bits, (rows, cols)
+
+
+def load_features():
+    """Загружает опубликованные звезды и их связи в матрицы признаков."""
+    stars = pd.DataFrame.from_records(
+        Star.objects.filter(is_published=True).order_by('id')
+        .values_list('id', 'birth_date', 'death_date', 'rating').iterator(chunk_size=20000),
+        columns=['id', 'birth_date', 'death_date', 'rating'],
+    )
+    star_index = pd.Index(stars['id'])
+    n_stars = len(stars)
+
+    category_links = pd.DataFrame.from_records(
+        Star.categories.through.objects.filter(star__is_published=True)
+        .values_list('star_id', 'category_id').iterator(chunk_size=50000),
+        columns=['star_id', 'related_id'],
+    )
+    country_links = pd.DataFrame.from_records(
+        Star.countries.through.objects.filter(star__is_published=True)
+        .values_list('star_id', 'country_id').iterator(chunk_size=50000),
+        columns=['star_id', 'related_id'],
+    )
+
+    categories, category_pairs = _bitsets(star_index, category_links, n_stars)
+    countries, _ = _bitsets(star_index, country_links, n_stars)
+
+    # Год берется из date напрямую: pd.to_datetime не принимает даты раньше 1677 года
+    birth_year = np.fromiter((birth_date.year for birth_date in stars['birth_date']), dtype=np.int32, count=n_stars)
+    rating = stars['rating'].fillna(0).to_numpy(dtype=np.float32)
+    rating_range = max(float(rating.max() - rating.min()), 1.0) if n_stars else 1.0
+    alive = stars['death_date'].isna().to_numpy()
+
+    return {
+        'ids': stars['id'].to_numpy(dtype=np.int64),
+        'fingerprints': feature_fingerprints(star_index, category_links, country_links, birth_year,
+                                             stars['rating'].fillna(0).to_numpy(dtype=np.int64), alive),
+        'categories': categories,
+        'countries': countries,
+        'category_pairs': category_pairs,
+        'era': (birth_year // 10).astype(np.float32),
+        'rating': rating / rating_range,
+        'alive': alive,
+    }
+
+
+def _links_hash(star_index, links, n_stars, salt):
+    """Хэш набора связей каждой звезды: сумма хэшей id по модулю 2^64, от порядка не зависит."""
+    result = np.zeros(n_stars, dtype=np.uint64)
+    rows = star_index.get_indexer(links['star_id'])
+    mask = rows >= 0
+    hashes = pd.util.hash_array(links['related_id'].to_numpy(dtype=np.int64)[mask], hash_key=salt)
+    np.add.at(result, rows[mask], hashes)
+    return result
+
+
+def feature_fingerprints(star_index, category_links, country_links, birth_year, rating, alive):
+    """Отпечаток признаков каждой звезды (int64) - по нему находятся звезды, требующие пересчета."""
+    n_stars = len(star_index)
+    columns = pd.DataFrame({
+        'categories': _links_hash(star_index, category_links, n_stars, 'categories000000'),
+        'countries': _links_hash(star_index, country_links, n_stars, 'countries0000000'),
+        'birth_year': birth_year,
+        'rating': rating,
+        'alive': alive,
+    })
+    return pd.util.hash_pandas_object(columns, index=False).to_numpy().view(np.int64)
+
+
+def _shared(bits_a, bits_b, out):
+    """Добавляет в out количество общих признаков для всех пар строк двух матриц масок."""
+    for word in range(bits_a.shape[1]):
+        out += np.bitwise_count(bits_a[:, word, None] & bits_b[None, :, word])
+    return out
+
+
+def _score(features, rows, block):
+    """Матрица оценок похожести строк rows на все звезды блока block (float32, без копий)."""
+    f = features
+    score = np.zeros((len(rows), len(block)), dtype=np.float32)
+    shared = np.zeros_like(score)
+
+    score += WEIGHT_CATEGORY * _shared(f['categories'][rows], f['categories'][block], shared)
+    shared[:] = 0
+    score += WEIGHT_COUNTRY * _shared(f['countries'][rows], f['countries'][block], shared)
+
+    # Эпоха: 1 для одного десятилетия, 0.5 для соседнего
+    gap = np.subtract(f['era'][rows, None], f['era'][None, block], out=shared)
+    np.abs(gap, out=gap)
+    gap *= -0.5
+    gap += 1.0
+    np.clip(gap, 0.0, 1.0, out=gap)
+    score += WEIGHT_ERA * gap
+
+    # Близость рейтинга
+    gap = np.subtract(f['rating'][rows, None], f['rating'][None, block], out=shared)
+    np.abs(gap, out=gap)
+    score += WEIGHT_RATING * (1.0 - gap)
+
+    score += WEIGHT_ALIVE * (f['alive'][rows, None] == f['alive'][None, block])
+    return score
+
+
+def _category_members(features):
+    """
+    Строки звезд каждой категории [(строки звезд, пул кандидатов)], пул - лучшие по рейтингу
+    (CATEGORY_POOL_SIZE). Звезды без категорий образуют отдельную группу.
+    """
+    rows, cols = features['category_pairs']
+    n_stars = len(features['ids'])
+    uncategorized = np.setdiff1d(np.arange(n_stars), rows)
+    rows = np.concatenate([rows, uncategorized])
+    cols = np.concatenate([cols, np.full(len(uncategorized), -1, dtype=cols.dtype)])
+
+    # Внутри категории - по убыванию рейтинга, затем по id
+    order = np.lexsort((rows, -features['rating'][rows], cols))
+    rows, cols = rows[order], cols[order]
+    starts = np.flatnonzero(np.r_[True, cols[1:] != cols[:-1]]) if len(cols) else np.array([], dtype=np.int64)
+    ends = np.r_[starts[1:], len(cols)]
+    return [(rows[start:end], rows[start:min(end, start + CATEGORY_POOL_SIZE)]) for start, end in zip(starts, ends)]
+
+
+def compute_neighbours(features, targets=None, top_k=SIMILAR_TOP_K):
+    """
+    Возвращает {star_id: [id соседей]} для звезд с targets[строка] = True (None - для всех).
+    Кандидаты - пулы всех категорий звезды, пара из нескольких пулов учитывается один раз.
+    """
+    ids = features['ids']
+    if targets is None:
+        targets = np.ones(len(ids), dtype=bool)
+
+    found_rows, found_neighbours, found_scores = [], [], []
+    for members, pool in _category_members(features):
+        queries = members[targets[members]]
+        k = min(top_k, len(pool))
+        if not len(queries) or k <= 0:
+            continue
+
+        chunk = max(1, MAX_SCORE_CELLS // len(pool))
+        for start in range(0, len(queries), chunk):
+            rows = queries[start:start + chunk]
+            score = _score(features, rows, pool)
+            # Сама звезда не может быть своим соседом
+            score[rows[:, None] == pool[None, :]] = -np.inf
+
+            top = np.argpartition(-score, k - 1, axis=1)[:, :k]
+            found_rows.append(np.repeat(rows, k))
+            found_neighbours.append(pool[top].ravel())
+            found_scores.append(np.take_along_axis(score, top, axis=1).ravel())
+
+    result = {int(star_id): [] for star_id in ids[targets]}
+    if not found_rows:
+        return result
+
+    rows = np.concatenate(found_rows)
+    neighbours = np.concatenate(found_neighbours)
+    scores = np.concatenate(found_scores)
+    valid = np.isfinite(scores)
+    rows, neighbours, scores = rows[valid], neighbours[valid], scores[valid]
+
+    # Оценка пары не зависит от пула, поэтому после сортировки повторы из разных пулов стоят рядом
+    order = np.lexsort((neighbours, -scores, rows))
+    rows, neighbours = rows[order], neighbours[order]
+    unique = np.r_[True, (rows[1:] != rows[:-1]) | (neighbours[1:] != neighbours[:-1])]
+    rows, neighbours = rows[unique], neighbours[unique]
+
+    # Первые top_k в каждой группе строки (порядок сохранен: по убыванию оценки)
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    keep = rank < top_k
+    for row, neighbour in zip(rows[keep].tolist(), ids[neighbours[keep]].tolist()):
+        result[int(ids[row])].append(neighbour)
+    return result
+
+
+def changed_stars(features):
+    """
+    Звезды, требующие пересчета (маска строк): с изменившимся отпечатком признаков или еще
+    без списка, звезды, в списках которых есть такие звезды или звезды, снятые с публикации
+    и удаленные, и все звезды категорий, в пул которых входят измененные звезды.
+    """
+    ids = features['ids']
+    stored_ids, stored_hashes, owners, neighbours = [], [], [], []
+    for star_id, features_hash, neighbour_ids in (SimilarStars.objects.values_list('star_id', 'features_hash',
+                                                                                    'neighbour_ids')
+                                                  .iterator(chunk_size=20000)):
+        stored_ids.append(star_id)
+        stored_hashes.append(features_hash)
+        owners += [star_id] * len(neighbour_ids)
+        neighbours += neighbour_ids
+
+    stored = pd.Series(stored_hashes, index=stored_ids, dtype='Int64')
+    current = stored.reindex(ids)
+    changed = (current.isna() | (current != features['fingerprints'])).to_numpy(dtype=bool)
+
+    # Соседи, которых больше нет среди опубликованных или у которых изменились признаки
+    neighbours = np.asarray(neighbours, dtype=np.int64)
+    stale = ~np.isin(neighbours, ids) | np.isin(neighbours, ids[changed])
+    changed |= np.isin(ids, np.asarray(owners, dtype=np.int64)[stale])
+
+    # Измененная звезда в пуле категории может стать соседом любой звезды категории. Если она
+    # вышла из пула, затронуты только звезды, у которых она в списке, - они уже отмечены выше
+    targets = changed.copy()
+    for members, pool in _category_members(features):
+        if changed[pool].any():
+            targets[members] = True
+    return targets
+
+
+def save_neighbours(neighbours, fingerprints, batch_size=5000):
+    """Сохраняет списки соседей и отпечатки признаков пакетами (вставка или обновление)."""
+    items = list(neighbours.items())
+    for start in range(0, len(items), batch_size):
+        SimilarStars.objects.bulk_create(
+            [SimilarStars(star_id=star_id, neighbour_ids=ids, features_hash=fingerprints[star_id])
+             for star_id, ids in items[start:start + batch_size]],
+            update_conflicts=True,
+            unique_fields=['star'],
+            update_fields=['neighbour_ids', 'features_hash', 'time_update'],
+        )
+
+
+def rebuild_similar_stars(incremental=False, top_k=SIMILAR_TOP_K):
+    """
+    Пересчитывает похожих знаменитостей. В инкрементальном режиме пересчитываются
+    только звезды, затронутые изменениями после прошлого расчета (см. changed_stars).
+    Возвращает количество пересчитанных звезд.
+    """
+    features = load_features()
+
+    targets = changed_stars(features) if incremental and SimilarStars.objects.exists() else None
+    neighbours = compute_neighbours(features, targets, top_k=top_k)
+    fingerprints = dict(zip(features['ids'].tolist(), features['fingerprints'].tolist()))
+
+    with transaction.atomic():
+        # Строки снятых с публикации звезд не нужны (удаленные уходят каскадом)
+        SimilarStars.objects.filter(star__is_published=False).delete()
+        save_neighbours(neighbours, fingerprints)
+
+    return len(neighbours)
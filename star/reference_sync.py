@@ -0,0 +1,299 @@
+"""
+Загрузка справочных данных стран и категорий из таблицы: родительный падеж (name_2),
+названия и slug.
+
+Все строки сопоставляются с одной заранее загруженной картой названий (без учета регистра,
+лишних пробелов и ё/е; если название не найдено - по slug), изменения применяются
+в памяти и записываются одним bulk_update на модель в общей транзакции. save() и подбор
+slug не вызываются: slug из таблицы проверяются на формат и уникальность заранее.
+
+Из кэша удаляются только списки и страницы, где видно измененное:
+- родительный падеж страны - страницы страны, ее тегов и карточки ее знаменитостей
+  (заголовки блоков тегов);
+- название или slug - вдобавок списки стран/категорий, топы, списки тегов связанных
+  стран/категорий, дни рождения связанных знаменитостей и страницы каталога (страны,
+  категории, теги, все знаменитости), на которых есть фильтры и топы со ссылками.
+Номера страниц каталога вычисляются по таблице счетчиков и реестру тегов.
+При смене slug реестр тегов перестраивается (slug тега состоит из slug категории и страны).
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils.text import slugify
+
+from .cache_keys import (ALL_CATEGORIES, ALL_COUNTRIES, CELEBRITIES, TOP_LIST_SIZES, VIABLE_TAG_LIMITS,
+                         birthday_prefix, category_prefix, country_prefix, page_keys, star_cache_keys,
+                         star_detail_key, tag_prefix, top_categories_key, top_countries_key,
+                         viable_tags_category_key, viable_tags_country_key)
+from .importing import _clean, batched
+from .models import Category, Country, Star, StarCount, Tag
+from .tags import rebuild_tags
+from .utils import normalize_text
+
+# Описание таблиц: колонка с текущим названием и колонки с новыми значениями полей
+COUNTRY_SOURCE = {
+    'model': Country,
+    'name_field': 'name',
+    'key_column': 'Country',
+    'columns': {'Country-2': 'name_2', 'Name': 'name', 'Slug': 'slug'},
+}
+CATEGORY_SOURCE = {
+    'model': Category,
+    'name_field': 'title',
+    'key_column': 'Category',
+    'columns': {'Title': 'title', 'Slug': 'slug'},
+}
+
+CACHE_DELETE_BATCH = 1000
+BULK_UPDATE_BATCH = 500
+
+
+def _name_key(name):
+    return normalize_text(' '.join(str(name).split()))
+
+
+class ReferenceStats:
+    """Итоги синхронизации одного справочника."""
+
+    def __init__(self, model):
+        self.model = model
+        self.rows = 0
+        self.unchanged = 0
+        self.not_found = []
+        self.errors = []
+        # id -> {поле: старое значение}
+        self.changes = {}
+
+    @property
+    def updated(self):
+        return len(self.changes)
+
+    def changed_ids(self, *fields):
+        """id объектов, у которых изменилось хотя бы одно из полей fields."""
+        return {pk for pk, old in self.changes.items() if old.keys() & set(fields)}
+
+
+def _apply_rows(source, objects, rows, stats):
+    """Сопоставляет строки с объектами и меняет их поля в памяти."""
+    by_name = {}
+    for obj in objects:
+        by_name.setdefault(_name_key(getattr(obj, source['name_field'])), obj)
+    by_slug = {obj.slug: obj for obj in objects}
+    model = source['model']
+
+    for row in rows:
+        stats.rows += 1
+        key = _clean(row.get(source['key_column']))
+        if key is None:
+            stats.errors.append(f'строка {stats.rows}: пустая колонка {source["key_column"]}')
+            continue
+        key = str(key)
+        obj = by_name.get(_name_key(key)) or by_slug.get(key)
+        if obj is None:
+            stats.not_found.append(key)
+            continue
+
+        changed = False
+        for column, field_name in source['columns'].items():
+            value = _clean(row.get(column))
+            if value is None:
+                continue
+            value = ' '.join(str(value).split())
+            max_length = model._meta.get_field(field_name).max_length
+            if len(value) > max_length:
+                stats.errors.append(f'строка {stats.rows}: {column} длиннее {max_length} символов')
+                continue
+            if field_name == 'slug' and slugify(value) != value:
+                stats.errors.append(f'строка {stats.rows}: недопустимый slug "{value}"')
+                continue
+            old = getattr(obj, field_name)
+            if value != old:
+                stats.changes.setdefault(obj.pk, {}).setdefault(field_name, old)
+                setattr(obj, field_name, value)
+                changed = True
+        if not changed:
+            stats.unchanged += 1
+
+
+def _check_slugs(objects, stats):
+    """
+    Новые slug не должны совпадать с чужими - ни с текущими, ни с прежними slug записей,
+    которые меняются в этом же файле: уникальность в PostgreSQL проверяется для каждой
+    строки bulk_update, и обмен slug между записями не проходит. Такие изменения
+    отменяются с ошибкой.
+    """
+    while True:
+        owners = {}
+        for obj in objects:
+            owners.setdefault(obj.slug, []).append(obj)
+        vacated = {old['slug'] for old in stats.changes.values() if 'slug' in old}
+        conflicts = []
+        for obj in objects:
+            if 'slug' not in stats.changes.get(obj.pk, {}):
+                continue
+            if len(owners[obj.slug]) > 1:
+                conflicts.append((obj, 'уже занят'))
+            elif obj.slug in vacated:
+                conflicts.append((obj, 'освобождается другой записью этого же файла'))
+        if not conflicts:
+            return
+        for obj, reason in conflicts:
+            stats.errors.append(f'slug "{obj.slug}" {reason}, у "{obj}" оставлен прежний')
+            old = stats.changes[obj.pk].pop('slug')
+            obj.slug = old
+            if not stats.changes[obj.pk]:
+                del stats.changes[obj.pk]
+
+
+def prepare_sync(source, rows):
+    """
+    Сопоставляет строки с записями справочника за один запрос.
+    Возвращает (ReferenceStats, измененные объекты); в базу ничего не пишется.
+    """
+    stats = ReferenceStats(source['model'])
+    objects = list(source['model'].objects.all())
+    _apply_rows(source, objects, rows, stats)
+    _check_slugs(objects, stats)
+    changed = [obj for obj in objects if obj.pk in stats.changes]
+    return stats, changed
+
+
+def _catalogue_page_keys(country_ids=None, category_ids=None):
+    """Ключи страниц стран country_ids и категорий category_ids (None - всех) по таблице счетчиков."""
+    rows = StarCount.objects.filter(Q(category__isnull=True, country__isnull=False) |
+                                    Q(country__isnull=True, category__isnull=False))
+    if country_ids is not None:
+        rows = rows.filter(Q(category__isnull=True, country_id__in=country_ids) | Q(country__isnull=True))
+    if category_ids is not None:
+        rows = rows.filter(Q(country__isnull=True, category_id__in=category_ids) | Q(category__isnull=True))
+
+    keys = []
+    for country_slug, category_slug, count in rows.values_list('country__slug', 'category__slug', 'count'):
+        prefix = country_prefix(country_slug) if country_slug else category_prefix(category_slug)
+        keys += page_keys(prefix, count)
+    return keys
+
+
+def _tag_page_keys(tags):
+    """Ключи страниц тегов [(slug, количество)]."""
+    return [key for slug, count in tags for key in page_keys(tag_prefix(slug), count)]
+
+
+def _birthday_page_keys(birth_dates):
+    """Ключи страниц дней рождения для дат знаменитостей - без фильтра по году и с ним."""
+    days = {(birth_date.month, birth_date.day) for birth_date in birth_dates}
+    by_day, by_date = {}, {}
+    counts = (Star.objects.filter(is_published=True).values_list('birth_date')
+              .annotate(count=Count('id')).order_by())
+    for birth_date, count in counts:
+        day = (birth_date.month, birth_date.day)
+        if day in days:
+            by_day[day] = by_day.get(day, 0) + count
+            by_date[birth_date] = count
+
+    keys = []
+    for (month, day), count in by_day.items():
+        keys += page_keys(birthday_prefix(month, day), count, sorts=None)
+    for birth_date in birth_dates:
+        keys += page_keys(birthday_prefix(birth_date.month, birth_date.day, birth_date.year),
+                          by_date.get(birth_date, 0), sorts=None)
+    return keys
+
+
+def _linked_star_ids(country_ids, category_ids):
+    ids = set(Star.countries.through.objects.filter(country_id__in=country_ids).values_list('star_id', flat=True))
+    ids.update(Star.categories.through.objects.filter(category_id__in=category_ids)
+               .values_list('star_id', flat=True))
+    return ids
+
+
+def reference_cache_keys(countries, categories, old_tags):
+    """
+    Ключи кэша, которые нужно удалить после изменения справочников (см. описание модуля).
+    old_tags - [(slug, количество)] тегов до перестройки реестра.
+    """
+    shown_countries = countries.changed_ids('name', 'name_2', 'slug')
+    listed_countries = countries.changed_ids('name', 'slug')
+    listed_categories = categories.changed_ids('title', 'slug')
+
+    tags = list(Tag.objects.filter(Q(country_id__in=shown_countries) | Q(category_id__in=listed_categories))
+                .values_list('slug', 'count', 'country_id', 'category_id'))
+    keys = set(_catalogue_page_keys(shown_countries, listed_categories))
+    keys.update(_tag_page_keys([(slug, count) for slug, count, country_id, category_id in tags]))
+    keys.update(_tag_page_keys(old_tags))
+
+    # Страницы по прежним slug
+    for stats, column, other, prefix in ((countries, 'country', 'category', country_prefix),
+                                         (categories, 'category', 'country', category_prefix)):
+        moved = stats.changed_ids('slug')
+        if moved:
+            counts = dict(StarCount.objects.filter(**{f'{column}_id__in': moved, f'{other}__isnull': True})
+                          .values_list(f'{column}_id', 'count'))
+            for pk in moved:
+                keys.update(page_keys(prefix(stats.changes[pk]['slug']), counts.get(pk, 0)))
+
+    # Карточки связанных знаменитостей; при смене названия или slug - и их дни рождения с главной
+    listed_ids = _linked_star_ids(listed_countries, listed_categories)
+    star_ids = _linked_star_ids(shown_countries, listed_categories)
+    birth_dates = set()
+    for batch in batched(sorted(star_ids), CACHE_DELETE_BATCH):
+        for pk, slug, birth_date in Star.objects.filter(id__in=batch).values_list('id', 'slug', 'birth_date'):
+            if pk in listed_ids:
+                keys.update(star_cache_keys(slug, birth_date))
+                birth_dates.add(birth_date)
+            else:
+                keys.add(star_detail_key(slug))
+
+    if listed_countries or listed_categories:
+        keys.update(_birthday_page_keys(birth_dates))
+        # Фильтры и топы со ссылками есть на всех страницах каталога
+        keys.update(_catalogue_page_keys())
+        keys.update(_tag_page_keys(Tag.objects.values_list('slug', 'count')))
+        keys.update(page_keys(CELEBRITIES, Star.objects.filter(is_published=True).count()))
+
+    if listed_countries:
+        keys.add(ALL_COUNTRIES)
+        ids = [None] + list(Country.objects.values_list('id', flat=True))
+        keys.update(top_countries_key(size, pk) for size in TOP_LIST_SIZES for pk in ids)
+        # Списки тегов категорий показывают названия стран
+        paired = {category_id for slug, count, country_id, category_id in tags if country_id in listed_countries}
+        keys.update(viable_tags_category_key(pk, limit) for pk in paired for limit in VIABLE_TAG_LIMITS)
+    if listed_categories:
+        keys.add(ALL_CATEGORIES)
+        ids = [None] + list(Category.objects.values_list('id', flat=True))
+        keys.update(top_categories_key(size, pk) for size in TOP_LIST_SIZES for pk in ids)
+        paired = {country_id for slug, count, country_id, category_id in tags if category_id in listed_categories}
+        keys.update(viable_tags_country_key(pk, limit) for pk in paired for limit in VIABLE_TAG_LIMITS)
+    return keys
+
+
+def sync_references(country_rows=None, category_rows=None, dry_run=False):
+    """
+    Загружает справочные данные стран и категорий из потоков строк-словарей.
+    Возвращает (ReferenceStats стран, ReferenceStats категорий, количество удаленных ключей кэша).
+    """
+    countries, changed_countries = prepare_sync(COUNTRY_SOURCE, country_rows or [])
+    categories, changed_categories = prepare_sync(CATEGORY_SOURCE, category_rows or [])
+    if dry_run or not (countries.changes or categories.changes):
+        return countries, categories, 0
+
+    slugs_changed = countries.changed_ids('slug') or categories.changed_ids('slug')
+    old_tags = []
+    if slugs_changed:
+        old_tags = list(Tag.objects.filter(Q(country_id__in=countries.changed_ids('slug')) |
+                                           Q(category_id__in=categories.changed_ids('slug')))
+                        .values_list('slug', 'count'))
+
+    with transaction.atomic():
+        for model, stats, objs in ((Country, countries, changed_countries),
+                                   (Category, categories, changed_categories)):
+            if objs:
+                fields = sorted({field for old in stats.changes.values() for field in old})
+                model.objects.bulk_update(objs, fields, batch_size=BULK_UPDATE_BATCH)
+        if slugs_changed:
+            rebuild_tags()
+
+    keys = reference_cache_keys(countries, categories, old_tags)
+    for batch in batched(sorted(keys), CACHE_DELETE_BATCH):
+        cache.delete_many(batch)
+    return countries, categories, len(keys)
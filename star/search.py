@@ -0,0 +1,785 @@
+"""
+Поиск знаменитостей по имени.
+
+Ищется по столбцу Star.search_name - вариантам написания имени (кириллица, латиница,
+слитные частицы, см. utils.build_search_name). На PostgreSQL используется GIN-индекс
+по триграммам (pg_trgm), на других базах (SQLite, тесты) - инвертированный индекс
+в памяти процесса. Оба варианта ранжируют результаты по качеству совпадения, затем
+по рейтингу, и при малом числе точных совпадений добавляют совпадения с опечатками.
+Подсказки при вводе на всех базах обслуживаются префиксным индексом в памяти.
+"""
+import bisect
+import calendar
+import html
+import heapq
+import itertools
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, Counter, namedtuple
+from datetime import date
+
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, When, Value, Q, FloatField, BooleanField, IntegerField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Substr
+from django.utils.html import escape, strip_tags
+from django.utils.safestring import mark_safe
+
+from .models import Star
+from .utils import tokenize, normalize_text, split_search_name, MONTHS
+
+# Сколько лучших совпадений возвращает индекс в памяти
+SEARCH_RESULT_LIMIT = 500
+
+# Сколько кандидатов (лучших по рейтингу) проверяется по самому редкому слову запроса
+# и по каждому из остальных слов
+MAX_CANDIDATES = 1000
+PARTIAL_CANDIDATES = 200
+
+# Префиксы до этой длины хранятся готовыми списками, более длинные раскрываются по словарю
+SHORT_PREFIX_LENGTH = 3
+# Длинный префикс раскрывается по словарю и сливается из списков слов, либо (если слов
+# слишком много) проверяется просмотром списка своего короткого префикса
+MAX_PREFIX_WORDS = 5000
+SCAN_COST_RATIO = 10
+
+# Короткие слова ищутся только целиком, без раскрытия префикса
+MIN_PREFIX_LENGTH = 2
+
+# Качество совпадения: точное имя > все слова целиком > все слова по префиксу > частичное
+MATCH_EXACT = 3.0
+MATCH_ALL_WORDS = 2.0
+MATCH_ALL_PREFIXES = 1.5
+MATCH_FUZZY = 1.0
+
+# Нечеткий поиск: с какой длины слова допускается одна опечатка, с какой - две,
+# и при скольких найденных точных совпадениях он не включается
+FUZZY_MIN_LENGTH = 5
+FUZZY_LONG_WORD = 8
+FUZZY_MIN_RESULTS = 5
+# Сколько ближайших по триграммам кандидатов PostgreSQL проверяется на число опечаток
+FUZZY_CANDIDATES = 200
+
+# Поиск по биографиям: сколько символов начала биографии используется для фрагмента
+# с подсветкой (ограничивает время ts_headline и разбора в Python) и его длина
+BIO_SNIPPET_SOURCE_LENGTH = 5000
+BIO_SNIPPET_LENGTH = 240
+# Маркеры подсветки в тексте фрагмента до экранирования HTML
+HIGHLIGHT_START = '\u27e6'
+HIGHLIGHT_END = '\u27e7'
+
+# Запросы-даты: формы названий месяцев и слова, не меняющие смысл запроса ("родились в 1988 году")
+MONTH_WORDS = {
+    **MONTHS,
+    **{name[:3]: number for name, number in MONTHS.items()},
+    'январь': 1, 'февраль': 2, 'март': 3, 'апрель': 4, 'май': 5, 'июнь': 6,
+    'июль': 7, 'август': 8, 'сентябрь': 9, 'октябрь': 10, 'ноябрь': 11, 'декабрь': 12, 'сент': 9,
+}
+MONTHS_PREPOSITIONAL = ['январе', 'феврале', 'марте', 'апреле', 'мае', 'июне',
+                        'июле', 'августе', 'сентябре', 'октябре', 'ноябре', 'декабре']
+DATE_FILLER_WORDS = {'родились', 'родился', 'родилась', 'рожденные', 'рождения', 'день', 'дни',
+                     'кто', 'в', 'году', 'год', 'года', 'г'}
+
+# Подсказки: сколько имен возвращается, на какую длину префикса строится индекс,
+# и для префиксов с каким числом совпадений лучшие имена считаются заранее
+SUGGEST_LIMIT = 10
+SUGGEST_KEY_LENGTH = 32
+SUGGEST_SMALL_RANGE = 256
+
+# Версия индексов в общем кэше: меняется при изменении опубликованных знаменитостей
+SEARCH_INDEX_VERSION_KEY = 'search_index_version'
+# Как часто (в секундах) процесс сверяет свою версию индексов с кэшем
+SEARCH_INDEX_CHECK_INTERVAL = 5
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def word_grams(word):
+    """Триграммы слова с границами: 'анна' -> '^ан', 'анн', 'нна', 'на$'."""
+    padded = f'^{word}$'
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def max_edit_distance(token):
+    """Допустимое число опечаток в слове запроса."""
+    if len(token) >= FUZZY_LONG_WORD:
+        return 2
+    if len(token) >= FUZZY_MIN_LENGTH:
+        return 1
+    return 0
+
+
+def within_edit_distance(a, b, max_distance):
+    """Проверяет, что расстояние Левенштейна между a и b не больше max_distance (с ранним выходом)."""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+
+    # Считаем только полосу шириной 2 * max_distance вокруг диагонали, остальное - "слишком далеко"
+    far = max_distance + 1
+    previous = [j if j <= max_distance else far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        start = max(1, i - max_distance)
+        end = min(len(b), i + max_distance)
+        current = [far] * (len(b) + 1)
+        if start == 1:
+            current[0] = i if i <= max_distance else far
+        for j in range(start, end + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        if min(current[start - 1:end + 1]) > max_distance:
+            return False
+        previous = current
+    return previous[len(b)] <= max_distance
+
+
+class DateQuery(namedtuple('DateQuery', 'day month year')):
+    """Дата из поискового запроса; любое из полей может отсутствовать (None)."""
+
+    def date_range(self):
+        """Границы дат рождения для запроса с годом (весь год или месяц года)."""
+        if self.month:
+            last_day = calendar.monthrange(self.year, self.month)[1]
+            return date(self.year, self.month, 1), date(self.year, self.month, last_day)
+        return date(self.year, 1, 1), date(self.year, 12, 31)
+
+    def title(self):
+        if self.month:
+            return f'Родились в {MONTHS_PREPOSITIONAL[self.month - 1]} {self.year} года'
+        return f'Родились в {self.year} году'
+
+
+def parse_date_query(query):
+    """
+    Распознает запрос-дату: "5 мая", "05.05", "5 мая 1988", "1988-05-05", "родились 1988",
+    "май 1988". Возвращает DateQuery или None, если в запросе есть что-то кроме даты.
+    """
+    text = normalize_text(query)
+    iso = re.fullmatch(r'\s*(\d{4})-(\d{1,2})-(\d{1,2})\s*', text)
+    if iso:
+        year, month, day = (int(part) for part in iso.groups())
+        return _valid_date_query(day, month, year)
+
+    month = year = None
+    small_numbers = []
+    for token in re.findall(r'\d+|[^\W\d_]+', text):
+        if token.isdigit():
+            if len(token) == 4 and year is None:
+                year = int(token)
+            elif len(token) <= 2:
+                small_numbers.append(int(token))
+            else:
+                return None
+        elif token in MONTH_WORDS and month is None:
+            month = MONTH_WORDS[token]
+        elif token not in DATE_FILLER_WORDS:
+            return None
+
+    # Без названия месяца два числа - день и месяц (05.05)
+    if month is None and len(small_numbers) == 2:
+        day, month = small_numbers
+    elif len(small_numbers) == 1 and month is not None:
+        day = small_numbers[0]
+    elif not small_numbers:
+        day = None
+    else:
+        return None
+
+    if day is None and year is None:
+        return None
+    return _valid_date_query(day, month, year)
+
+
+def _valid_date_query(day, month, year):
+    if year is not None and not 1000 <= year <= date.today().year:
+        return None
+    try:
+        # Високосный год, чтобы 29 февраля без года было допустимой датой
+        date(year or 2000, month or 1, day or 1)
+    except ValueError:
+        return None
+    return DateQuery(day, month, year)
+
+
+class NameIndex:
+    """
+    Инвертированный индекс имен опубликованных знаменитостей.
+
+    Звезды пронумерованы по убыванию рейтинга (ранг), списки вхождений слов и коротких
+    префиксов хранят ранги по возрастанию - поэтому лучшие по рейтингу кандидаты берутся
+    из начала списков без сортировки, а число проверяемых кандидатов ограничено MAX_CANDIDATES.
+    Точные совпадения имени проверяются всегда, независимо от рейтинга: по словарю однословных
+    имен или по пересечению полных списков вхождений слов запроса.
+    """
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: (-(row[2] or 0), row[0]))
+        self.ids = [star_id for star_id, search_name, rating in rows]
+        # Варианты написания имени (кириллица, транслитерация, слитные частицы) - кортежи слов
+        self.variants = []
+        postings = defaultdict(list)
+
+        for rank, (star_id, search_name, rating) in enumerate(rows):
+            variants = tuple(split_search_name(search_name))
+            self.variants.append(variants)
+            for token in {token for variant in variants for token in variant}:
+                postings[token].append(rank)
+
+        self.postings = dict(postings)
+        # Однословные имена (псевдонимы): для них точное совпадение не найти пересечением списков
+        single_words = defaultdict(list)
+        for rank, variants in enumerate(self.variants):
+            for token in {variant[0] for variant in variants if len(variant) == 1}:
+                single_words[token].append(rank)
+        self.single_words = dict(single_words)
+        # Отсортированный словарь для поиска слов по префиксу бинарным поиском
+        self.vocabulary = sorted(self.postings)
+
+        # Готовые списки для коротких префиксов: их раскрытие дает слишком много слов
+        prefix_postings = defaultdict(list)
+        for rank, variants in enumerate(self.variants):
+            prefixes = {token[:length] for variant in variants for token in variant
+                        for length in range(MIN_PREFIX_LENGTH, SHORT_PREFIX_LENGTH + 1) if len(token) >= length}
+            for prefix in prefixes:
+                prefix_postings[prefix].append(rank)
+        self.prefix_postings = dict(prefix_postings)
+
+        # Триграммы слов словаря (с учетом длины слова) для подбора кандидатов с опечатками
+        grams = defaultdict(list)
+        for word_id, word in enumerate(self.vocabulary):
+            for gram in set(word_grams(word)):
+                grams[(gram, len(word))].append(word_id)
+        self.grams = dict(grams)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def expand_prefix(self, prefix):
+        """Слова словаря, начинающиеся с prefix."""
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + '\uffff')
+        return self.vocabulary[start:end]
+
+    def _token_candidates(self, token, limit):
+        """
+        Возвращает (оценка числа совпадений, первые limit рангов звезд со словом token
+        или, для слов от MIN_PREFIX_LENGTH букв, со словом, начинающимся с token).
+        """
+        if len(token) < MIN_PREFIX_LENGTH:
+            posting = self.postings.get(token, [])
+            return len(posting), posting[:limit]
+
+        if len(token) <= SHORT_PREFIX_LENGTH:
+            posting = self.prefix_postings.get(token, [])
+            return len(posting), posting[:limit]
+
+        words = self.expand_prefix(token)
+        posting = self.prefix_postings.get(token[:SHORT_PREFIX_LENGTH], [])
+        if len(words) <= MAX_PREFIX_WORDS:
+            lists = [self.postings[word] for word in words]
+            size = sum(len(ranks) for ranks in lists)
+            # Слияние стоит порядка числа слов, просмотр - доли списка короткого префикса
+            if not size or len(posting) * min(limit, size) <= size * len(words) * SCAN_COST_RATIO:
+                return size, self._scan(posting, token, limit)
+            if len(lists) == 1:
+                return size, lists[0][:limit]
+            return size, list(itertools.islice(heapq.merge(*lists), limit))
+
+        return len(posting), self._scan(posting, token, limit)
+
+    def _scan(self, posting, token, limit):
+        """Первые limit рангов из posting, у которых есть слово с префиксом token."""
+        matched = (rank for rank in posting
+                   if any(word.startswith(token) for variant in self.variants[rank] for word in variant))
+        return list(itertools.islice(matched, limit))
+
+    def _exact_candidates(self, query_tokens):
+        """
+        Ранги всех звезд, у которых есть вариант имени из стольких же слов, сколько в запросе,
+        и все слова запроса в нем целиком. Ограничение MAX_CANDIDATES здесь не действует:
+        точное имя звезды с низким рейтингом не должно теряться среди частых слов.
+        """
+        total = len(query_tokens)
+        if total == 1:
+            return self.single_words.get(query_tokens[0], [])
+
+        lists = sorted((self.postings.get(token, []) for token in query_tokens), key=len)
+        ranks = np.asarray(lists[0], dtype=np.int64)
+        for posting in lists[1:]:
+            if not len(ranks):
+                return []
+            ranks = np.intersect1d(ranks, np.asarray(posting, dtype=np.int64), assume_unique=True)
+        return [rank for rank in ranks.tolist() if any(len(variant) == total for variant in self.variants[rank])]
+
+    def similar_words(self, token):
+        """Слова словаря на расстоянии редактирования не больше допустимого для token."""
+        max_distance = max_edit_distance(token)
+        token_grams = set(word_grams(token))
+        # Слова на расстоянии k теряют не больше 3k триграмм запроса
+        required = len(token_grams) - 3 * max_distance
+        if not max_distance or required <= 0:
+            return set()
+
+        shared = Counter()
+        for length in range(len(token) - max_distance, len(token) + max_distance + 1):
+            for gram in token_grams:
+                shared.update(self.grams.get((gram, length), ()))
+
+        words = set()
+        for word_id, count in shared.items():
+            word = self.vocabulary[word_id]
+            if count >= required and word != token and within_edit_distance(token, word, max_distance):
+                words.add(word)
+        return words
+
+    def _quality(self, variants, query_tokens, similar):
+        best = 0.0
+        total = len(query_tokens)
+        for tokens in variants:
+            whole = prefix = close = 0
+            for token in query_tokens:
+                if token in tokens:
+                    whole += 1
+                elif len(token) >= MIN_PREFIX_LENGTH and any(word.startswith(token) for word in tokens):
+                    prefix += 1
+                elif token in similar and any(word in similar[token] for word in tokens):
+                    close += 1
+
+            if whole == total and len(tokens) == total:
+                return MATCH_EXACT
+            if whole == total:
+                quality = MATCH_ALL_WORDS
+            elif whole + prefix == total:
+                quality = MATCH_ALL_PREFIXES
+            elif whole + prefix + close == total:
+                quality = MATCH_FUZZY
+            else:
+                quality = (whole + 0.5 * prefix + 0.25 * close) / total
+            best = max(best, quality)
+        return best
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT, fuzzy=False):
+        """
+        Возвращает [(star_id, качество)] по убыванию качества и рейтинга.
+        С fuzzy=True учитываются и слова с опечатками (в пределах max_edit_distance).
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+
+        per_token = [self._token_candidates(token, MAX_CANDIDATES) for token in query_tokens]
+        similar = {}
+        if fuzzy:
+            for position, token in enumerate(query_tokens):
+                words = self.similar_words(token)
+                if not words:
+                    continue
+                similar[token] = words
+                lists = [self.postings[word] for word in words]
+                size, ranks = per_token[position]
+                size += sum(len(ranks) for ranks in lists)
+                ranks = list(itertools.islice(heapq.merge(ranks, *lists), MAX_CANDIDATES))
+                per_token[position] = size, ranks
+
+        if not any(size for size, ranks in per_token):
+            return []
+
+        # Полные совпадения ищем по самому редкому из найденных слов запроса, частичные - по остальным
+        driver = min((size, position) for position, (size, ranks) in enumerate(per_token) if size)[1]
+        candidates = set(per_token[driver][1])
+        for position, (size, ranks) in enumerate(per_token):
+            if position != driver:
+                candidates.update(ranks[:PARTIAL_CANDIDATES])
+            # Совпадения слова целиком не должны теряться среди префиксных
+            candidates.update(self.postings.get(query_tokens[position], [])[:PARTIAL_CANDIDATES])
+        candidates.update(self._exact_candidates(query_tokens))
+
+        scored = [(-self._quality(self.variants[rank], query_tokens, similar), rank) for rank in candidates]
+        best = heapq.nsmallest(limit, scored)
+        return [(self.ids[rank], -quality) for quality, rank in best]
+
+
+class SuggestIndex:
+    """
+    Компактный префиксный индекс для подсказок при вводе.
+
+    Нормализованные имена склеены в одну строку, отсортированный массив позиций начала
+    каждого слова позволяет найти бинарным поиском все имена, в которых с префикса
+    запроса начинается какое-либо слово. Для префиксов с большим числом совпадений
+    лучшие по рейтингу звезды посчитаны заранее.
+    """
+
+    def __init__(self, rows, limit=SUGGEST_LIMIT):
+        rows = sorted(rows, key=lambda row: (-(row[3] or 0), row[0]))
+        self.limit = limit
+
+        # Отображаемые имена и slug хранятся склеенными строками со смещениями
+        self.names = ''.join(name for star_id, name, slug, rating, search_name in rows)
+        self.name_offsets = np.cumsum([0] + [len(name) for star_id, name, slug, rating, search_name in rows], dtype=np.int64)
+        self.slugs = ''.join(slug for star_id, name, slug, rating, search_name in rows)
+        self.slug_offsets = np.cumsum([0] + [len(slug) for star_id, name, slug, rating, search_name in rows], dtype=np.int64)
+
+        # Нормализованные имена через '\x00'; дополнение в конце избавляет от проверок границ
+        # Подсказки ищутся по всем вариантам написания, показывается исходное имя
+        normalized = [' '.join(tokenize(search_name or name)) for star_id, name, slug, rating, search_name in rows]
+        self.text = '\x00'.join(normalized) + '\x00' * SUGGEST_KEY_LENGTH
+
+        starts, ranks = [], []
+        offset = 0
+        for rank, name in enumerate(normalized):
+            for match in _WORD_RE.finditer(name):
+                starts.append(offset + match.start())
+                ranks.append(rank)
+            offset += len(name) + 1
+
+        order = sorted(range(len(starts)), key=lambda i: self.text[starts[i]:starts[i] + SUGGEST_KEY_LENGTH])
+        self.positions = np.array(starts, dtype=np.int64)[order]
+        self.ranks = np.array(ranks, dtype=np.int32)[order]
+
+        self.tops = {}
+        self._build_tops(0, len(self.positions), 0, '')
+
+    def __len__(self):
+        return len(self.name_offsets) - 1
+
+    def _range(self, prefix, lo=0, hi=None):
+        """Границы [lo, hi) позиций, с которых начинается prefix."""
+        if hi is None:
+            hi = len(self.positions)
+        length = len(prefix)
+        text, positions = self.text, self.positions
+
+        # Бинарный поиск левой и правой границы по первым length символам ключа
+        left, right = lo, hi
+        while left < right:
+            middle = (left + right) // 2
+            position = positions[middle]
+            if text[position:position + length] < prefix:
+                left = middle + 1
+            else:
+                right = middle
+        lo = left
+
+        right = hi
+        while left < right:
+            middle = (left + right) // 2
+            position = positions[middle]
+            if text[position:position + length] <= prefix:
+                left = middle + 1
+            else:
+                right = middle
+        return lo, left
+
+    def _top(self, lo, hi):
+        """Лучшие по рейтингу звезды среди позиций [lo, hi)."""
+        return np.unique(self.ranks[lo:hi])[:self.limit]
+
+    def _build_tops(self, lo, hi, depth, prefix):
+        if hi - lo <= SUGGEST_SMALL_RANGE or depth >= SUGGEST_KEY_LENGTH:
+            return
+        if prefix:
+            self.tops[prefix] = self._top(lo, hi)
+
+        while lo < hi:
+            char = self.text[self.positions[lo] + depth]
+            child_lo, child_hi = self._range(prefix + char, lo, hi)
+            if char != '\x00':
+                self._build_tops(child_lo, child_hi, depth + 1, prefix + char)
+            lo = child_hi
+
+    def _name(self, rank):
+        return self.names[self.name_offsets[rank]:self.name_offsets[rank + 1]]
+
+    def _slug(self, rank):
+        return self.slugs[self.slug_offsets[rank]:self.slug_offsets[rank + 1]]
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        """Возвращает [(имя, slug)] лучших по рейтингу звезд, имя которых содержит слово с префиксом query."""
+        prefix = ' '.join(tokenize(query))[:SUGGEST_KEY_LENGTH]
+        if not prefix:
+            return []
+
+        ranks = self.tops.get(prefix)
+        if ranks is None:
+            ranks = self._top(*self._range(prefix))
+        return [(self._name(rank), self._slug(rank)) for rank in ranks[:limit]]
+
+
+class ProcessIndex:
+    """
+    Индекс в памяти процесса, общий для всех запросов. Перестраивается, когда в общем
+    кэше меняется версия (invalidate_search_indexes), но сверяется с кэшем не чаще
+    SEARCH_INDEX_CHECK_INTERVAL секунд. Синхронно строится только первый индекс;
+    новые версии строятся в фоновом потоке, а запросы до замены обслуживает прежний.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.lock = threading.Lock()
+        self.index = None
+        self.version = None
+        self.checked_at = 0.0
+        self.building = False
+
+    def get(self):
+        now = time.monotonic()
+        if self.index is not None and now - self.checked_at < SEARCH_INDEX_CHECK_INTERVAL:
+            return self.index
+
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    version = search_index_version()
+                    self.index = self.build()
+                    self.version = version
+                    self.checked_at = now
+            return self.index
+
+        self.checked_at = now
+        version = search_index_version()
+        if version != self.version:
+            self._start_rebuild(version)
+        return self.index
+
+    def _start_rebuild(self, version):
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+        threading.Thread(target=self._rebuild, args=(version,), name='search-index', daemon=True).start()
+
+    def _rebuild(self, version):
+        try:
+            index = self.build()
+            self.index, self.version = index, version
+        except Exception:
+            # Остается прежний индекс; сборка повторится при следующей сверке версии
+            pass
+        finally:
+            # У потока свое соединение с базой
+            connection.close()
+            self.building = False
+
+
+def search_index_version():
+    """Текущая версия индексов поиска (меняется при каждой инвалидации)."""
+    version = cache.get(SEARCH_INDEX_VERSION_KEY)
+    if version is None:
+        cache.add(SEARCH_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(SEARCH_INDEX_VERSION_KEY)
+    return version
+
+
+def invalidate_search_indexes():
+    """Помечает индексы поиска и подсказок устаревшими во всех процессах."""
+    cache.set(SEARCH_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _published_rows(*fields):
+    return Star.objects.filter(is_published=True).values_list(*fields).iterator(chunk_size=20000)
+
+
+name_index = ProcessIndex(lambda: NameIndex(_published_rows('id', 'search_name', 'rating')))
+suggest_index = ProcessIndex(lambda: SuggestIndex(_published_rows('id', 'name', 'slug', 'rating', 'search_name')))
+
+
+def get_name_index():
+    """Актуальный индекс имен для поиска."""
+    return name_index.get()
+
+
+def suggest_names(query, limit=SUGGEST_LIMIT):
+    """Подсказки для строки поиска: [(имя, slug)] по убыванию рейтинга."""
+    return suggest_index.get().suggest(query, min(limit, SUGGEST_LIMIT))
+
+
+def use_postgres_search():
+    """Искать средствами PostgreSQL или индексом в памяти (настройка STAR_SEARCH_BACKEND)."""
+    backend = getattr(settings, 'STAR_SEARCH_BACKEND', None)
+    if backend:
+        return backend == 'postgres'
+    return connection.vendor == 'postgresql'
+
+
+def _postgres_search(queryset, query, extra_ids=()):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    words = tokenize(query)
+    normalized = ' '.join(words)
+    # Слова от трех букв ищутся по GIN-индексу триграмм; более короткие - только для ранжирования
+    indexed_words = [word for word in words if len(word) >= 3] or words
+    any_word = Q(id__in=list(extra_ids)) if extra_ids else Q()
+    for word in indexed_words:
+        any_word |= Q(search_name__contains=word)
+    all_words = Q()
+    for word in words:
+        all_words &= Q(search_name__contains=word)
+
+    return queryset.filter(any_word).annotate(
+        match_rank=Case(
+            When(search_name__contains=f'/{normalized}/', then=Value(MATCH_EXACT)),
+            When(all_words, then=Value(MATCH_ALL_WORDS)),
+            default=Value(0.0),
+            output_field=FloatField()
+        ) + TrigramWordSimilarity(normalized, 'search_name')
+    ).order_by('-match_rank', '-rating', 'id')
+
+
+def _postgres_fuzzy_ids(queryset, query):
+    """
+    Id звезд, совпадающих с запросом с учетом опечаток: кандидаты - ближайшие по
+    триграммам (оператор %> по GIN-индексу), затем проверка числа опечаток в каждом слове.
+    """
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    query_tokens = tokenize(query)
+    normalized = ' '.join(query_tokens)
+    candidates = queryset.filter(search_name__trigram_word_similar=normalized).annotate(
+        similarity=TrigramWordSimilarity(normalized, 'search_name')
+    ).order_by('-similarity').values_list('id', 'search_name')[:FUZZY_CANDIDATES]
+
+    return [star_id for star_id, search_name in candidates if _fuzzy_matches(search_name, query_tokens)]
+
+
+def _fuzzy_matches(search_name, query_tokens):
+    """Все слова запроса есть в одном из вариантов имени целиком, по префиксу или с опечатками."""
+    for variant in split_search_name(search_name):
+        if all(any(word.startswith(token) or within_edit_distance(token, word, max_edit_distance(token))
+                   for word in variant)
+               for token in query_tokens):
+            return True
+    return False
+
+
+def _ranked_queryset(queryset, ranked):
+    if not ranked:
+        return queryset.none()
+    positions = [When(id=star_id, then=Value(position)) for position, (star_id, quality) in enumerate(ranked)]
+    return queryset.filter(id__in=[star_id for star_id, quality in ranked]).annotate(
+        match_position=Case(*positions, default=Value(len(ranked)))
+    ).order_by('match_position')
+
+
+def _few(queryset):
+    return queryset[:FUZZY_MIN_RESULTS].count() < FUZZY_MIN_RESULTS
+
+
+def search_stars(queryset, query):
+    """
+    Фильтрует queryset по имени и сортирует по качеству совпадения и рейтингу.
+    Если совпадений по всем словам запроса меньше FUZZY_MIN_RESULTS, добавляются
+    совпадения с опечатками.
+    """
+    query = query.strip()
+    if not tokenize(query):
+        return queryset
+
+    if use_postgres_search():
+        results = _postgres_search(queryset, query)
+        if _few(results.filter(match_rank__gte=MATCH_ALL_WORDS)):
+            fuzzy_ids = _postgres_fuzzy_ids(queryset, query)
+            if fuzzy_ids:
+                results = _postgres_search(queryset, query, extra_ids=fuzzy_ids)
+        return results
+
+    index = get_name_index()
+    ranked = index.search(query)
+    if _few(_ranked_queryset(queryset, [item for item in ranked if item[1] >= MATCH_ALL_PREFIXES])):
+        ranked = index.search(query, fuzzy=True)
+    return _ranked_queryset(queryset, ranked)
+
+
+def stem(word):
+    """
+    Грубая основа слова для поиска по биографиям без полнотекстового движка:
+    отбрасывает окончание, оставляя не меньше четырех букв.
+    """
+    if len(word) <= 4:
+        return word
+    return word[:max(4, len(word) - 2)]
+
+
+def search_biographies(queryset, query):
+    """
+    Полнотекстовый поиск по биографиям. На PostgreSQL - по столбцу search_vector
+    (to_tsvector('russian', content), GIN-индекс), ранжирование ts_rank_cd, затем рейтинг.
+    На других базах - поиск основ слов подстрокой, ранжирование по числу найденных слов.
+    """
+    query = query.strip()
+    words = tokenize(query)
+    if not words:
+        return queryset
+
+    if use_postgres_search():
+        tsquery = "websearch_to_tsquery('russian', %s)"
+        return queryset.filter(
+            RawSQL(f'star_star.search_vector @@ {tsquery}', [query], output_field=BooleanField())
+        ).annotate(
+            bio_rank=RawSQL(f'ts_rank_cd(star_star.search_vector, {tsquery})', [query], output_field=FloatField())
+        ).order_by('-bio_rank', '-rating', 'id')
+
+    # Регулярное выражение, а не LIKE: в SQLite LIKE не учитывает регистр только для латиницы
+    patterns = [_stem_pattern(word_stem) for word_stem in dict.fromkeys(stem(word) for word in words)]
+    any_stem = Q()
+    matched = Value(0)
+    for pattern in patterns:
+        any_stem |= Q(content__iregex=pattern)
+        matched = matched + Case(When(content__iregex=pattern, then=Value(1)), default=Value(0),
+                                 output_field=IntegerField())
+    return queryset.filter(any_stem).annotate(bio_rank=matched).order_by('-bio_rank', '-rating', 'id')
+
+
+def _stem_pattern(word_stem):
+    """Регулярное выражение для основы слова, не различающее е и ё."""
+    return re.escape(word_stem).replace('е', '[её]')
+
+
+def _render_snippet(text):
+    """Экранирует фрагмент и превращает маркеры подсветки в <mark>."""
+    text = escape(' '.join(html.unescape(strip_tags(text)).split()))
+    return mark_safe(text.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+
+
+def _python_snippet(content, patterns):
+    """Фрагмент вокруг первого найденного слова в начале биографии."""
+    text = ' '.join(strip_tags(content).split())
+    pattern = re.compile(r'\w*(?:' + '|'.join(patterns) + r')\w*', re.IGNORECASE)
+
+    found = pattern.search(text)
+    start = max(0, found.start() - BIO_SNIPPET_LENGTH // 3) if found else 0
+    fragment = pattern.sub(lambda match: HIGHLIGHT_START + match.group() + HIGHLIGHT_END,
+                           text[start:start + BIO_SNIPPET_LENGTH])
+    return ('… ' if start else '') + fragment + (' …' if start + BIO_SNIPPET_LENGTH < len(text) else '')
+
+
+def biography_snippets(star_ids, query):
+    """
+    Фрагменты биографий с подсветкой найденных слов для страницы результатов: {id: html}.
+    Обрабатывается только начало биографии (BIO_SNIPPET_SOURCE_LENGTH символов).
+    """
+    star_ids = list(star_ids)
+    words = tokenize(query)
+    if not star_ids or not words:
+        return {}
+
+    if use_postgres_search():
+        options = (f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, '
+                   f'MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=" … "')
+        rows = Star.objects.filter(id__in=star_ids).annotate(
+            snippet=RawSQL(
+                "ts_headline('russian', left(star_star.content, %s), websearch_to_tsquery('russian', %s), %s)",
+                [BIO_SNIPPET_SOURCE_LENGTH, query.strip(), options]
+            )
+        ).values_list('id', 'snippet')
+        return {star_id: _render_snippet(snippet) for star_id, snippet in rows}
+
+    patterns = [_stem_pattern(word_stem) for word_stem in dict.fromkeys(stem(word) for word in words)]
+    rows = Star.objects.filter(id__in=star_ids).annotate(
+        head=Substr('content', 1, BIO_SNIPPET_SOURCE_LENGTH)
+    ).values_list('id', 'head')
+    return {star_id: _render_snippet(_python_snippet(head, patterns)) for star_id, head in rows}
@@ -0,0 +1,190 @@
+"""
+Снимок индекса имен для поиска в браузере.
+
+Опубликованные знаменитости выгружаются в сжатый gzip JSON: id, варианты написания
+имени (нормализованные слова из Star.search_name), slug, рейтинг и день рождения MMDD,
+по убыванию рейтинга. Файл называется по хэшу содержимого и никогда не меняется,
+поэтому отдается с долгим кэшированием; актуальный хэш сообщает небольшой манифест.
+
+Снимок пересобирается инкрементально: из предыдущего файла берутся строки, к ним
+применяются изменения после прошлой сборки (по time_update) и снятия с публикации.
+Миграции меняют данные в обход time_update, поэтому после новой миграции приложения
+снимок собирается заново целиком.
+Неизменившиеся данные дают тот же файл с тем же хэшем. Собирается он после импорта
+и командой export_search_index (по расписанию, с --if-changed - правки из админки);
+представление только отдает уже собранный манифест.
+"""
+import gzip
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Star
+from .search import search_index_version
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_FIELDS = ['id', 'names', 'slug', 'rating', 'mmdd']
+
+EXPORT_DIR = 'search_index'
+EXPORT_MANIFEST_PATH = f'{EXPORT_DIR}/manifest.json'
+EXPORT_MANIFEST_KEY = 'search_export_manifest'
+EXPORT_LOCK_KEY = 'search_export_lock'
+
+# Сколько последних файлов хранить (клиенты могут догружать предыдущую версию)
+EXPORT_KEEP_FILES = 2
+
+EXPORT_BATCH_SIZE = 5000
+
+
+def export_path(content_hash):
+    return f'{EXPORT_DIR}/names-{content_hash}.json.gz'
+
+
+def _rows(queryset):
+    for star_id, search_name, slug, rating, birth_date in queryset.values_list(
+            'id', 'search_name', 'slug', 'rating', 'birth_date').iterator(chunk_size=20000):
+        yield [star_id, search_name.strip('/'), slug, rating, birth_date.strftime('%m%d') if birth_date else '']
+
+
+def schema_version():
+    """Последняя примененная миграция приложения star."""
+    return (MigrationRecorder(connection).migration_qs.filter(app='star')
+            .order_by('-id').values_list('name', flat=True).first())
+
+
+def get_manifest():
+    """Манифест текущего снимка (из кэша или из хранилища) или None."""
+    manifest = cache.get(EXPORT_MANIFEST_KEY)
+    if manifest is None and default_storage.exists(EXPORT_MANIFEST_PATH):
+        with default_storage.open(EXPORT_MANIFEST_PATH, 'rb') as f:
+            manifest = json.loads(f.read())
+        cache.set(EXPORT_MANIFEST_KEY, manifest, None)
+    return manifest
+
+
+def load_snapshot(manifest):
+    """Строки предыдущего снимка {id: строка} или None, если снимок недоступен или другого формата."""
+    if not manifest or manifest.get('format') != EXPORT_FORMAT_VERSION:
+        return None
+    path = export_path(manifest['hash'])
+    if not default_storage.exists(path):
+        return None
+    with default_storage.open(path, 'rb') as f:
+        data = json.loads(gzip.decompress(f.read()))
+    return {row[0]: row for row in data['stars']}
+
+
+def collect_rows(previous=None, since=None):
+    """
+    Строки снимка {id: строка}. С предыдущим снимком перечитываются только знаменитости,
+    измененные после since, и опубликованные, которых в нем нет.
+    Возвращает (строки, количество изменений).
+    """
+    published = Star.objects.filter(is_published=True)
+    if previous is None or since is None:
+        rows = {row[0]: row for row in _rows(published)}
+        return rows, len(rows)
+
+    rows = previous
+    published_ids = set(published.values_list('id', flat=True))
+    removed = rows.keys() - published_ids
+    for star_id in removed:
+        del rows[star_id]
+
+    changed = 0
+    for row in _rows(published.filter(time_update__gte=since)):
+        changed += rows.get(row[0]) != row
+        rows[row[0]] = row
+
+    missing = list(published_ids - rows.keys())
+    for start in range(0, len(missing), EXPORT_BATCH_SIZE):
+        for row in _rows(published.filter(id__in=missing[start:start + EXPORT_BATCH_SIZE])):
+            rows[row[0]] = row
+            changed += 1
+
+    return rows, changed + len(removed)
+
+
+def _save_manifest(manifest):
+    if default_storage.exists(EXPORT_MANIFEST_PATH):
+        default_storage.delete(EXPORT_MANIFEST_PATH)
+    default_storage.save(EXPORT_MANIFEST_PATH, ContentFile(json.dumps(manifest).encode()))
+    cache.set(EXPORT_MANIFEST_KEY, manifest, None)
+
+
+def _remove_old_files(current_path):
+    """Удаляет старые файлы снимка, оставляя EXPORT_KEEP_FILES последних."""
+    _, files = default_storage.listdir(EXPORT_DIR)
+    paths = [f'{EXPORT_DIR}/{name}' for name in files if name.startswith('names-')]
+    paths = [path for path in paths if path != current_path]
+    paths.sort(key=default_storage.get_modified_time, reverse=True)
+    for path in paths[EXPORT_KEEP_FILES - 1:]:
+        default_storage.delete(path)
+
+
+def export_search_index(incremental=True):
+    """
+    Собирает снимок и обновляет манифест. Файл с тем же содержимым не перезаписывается.
+    Возвращает (манифест, количество измененных строк).
+    """
+    # Время и версия берутся до чтения данных: изменения во время сборки попадут в следующую
+    started = timezone.now()
+    version = search_index_version()
+    schema = schema_version()
+
+    manifest = get_manifest()
+    if manifest is not None and manifest.get('schema') != schema:
+        incremental = False
+    previous = load_snapshot(manifest) if incremental else None
+    since = parse_datetime(manifest['built']) if previous is not None else None
+    rows, changed = collect_rows(previous, since)
+
+    stars = sorted(rows.values(), key=lambda row: (-row[3], row[0]))
+    content = json.dumps(
+        {'format': EXPORT_FORMAT_VERSION, 'fields': EXPORT_FIELDS, 'stars': stars},
+        ensure_ascii=False, separators=(',', ':')
+    ).encode()
+    content_hash = hashlib.sha256(content).hexdigest()[:16]
+
+    path = export_path(content_hash)
+    if not default_storage.exists(path):
+        # mtime=0 - одинаковые данные дают одинаковые байты
+        default_storage.save(path, ContentFile(gzip.compress(content, compresslevel=9, mtime=0)))
+
+    manifest = {
+        'format': EXPORT_FORMAT_VERSION,
+        'hash': content_hash,
+        'count': len(stars),
+        'size': default_storage.size(path),
+        'built': started.isoformat(),
+        'source_version': version,
+        'schema': schema,
+    }
+    _save_manifest(manifest)
+    _remove_old_files(path)
+    return manifest, changed
+
+
+def refresh_search_export():
+    """
+    Пересобирает снимок, если знаменитости изменились после прошлой сборки (сменилась
+    версия индексов поиска или применена новая миграция), одним процессом. Возвращает (манифест, количество измененных
+    строк) или None, если снимок актуален или его уже собирает другой процесс.
+    """
+    manifest = get_manifest()
+    if (manifest is not None and manifest.get('source_version') == search_index_version()
+            and manifest.get('schema') == schema_version()):
+        return None
+    if not cache.add(EXPORT_LOCK_KEY, 1, 60 * 10):
+        return None
+    try:
+        return export_search_index()
+    finally:
+        cache.delete(EXPORT_LOCK_KEY)
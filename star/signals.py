@@ -0,0 +1,180 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .counts import change_counts, add_keys, pair_keys, star_keys
+from .models import Star, Category, Country
+from .search import invalidate_search_indexes
+from .tags import sync_tags, sync_tag_slugs
+
+
+def _apply_deltas(deltas):
+    """Применяет изменения счетчиков и синхронизирует затронутые теги."""
+    change_counts(deltas)
+    sync_tags(deltas)
+
+
+def _relation_ids(star):
+    """Возвращает id категорий и стран знаменитости."""
+    category_ids = list(star.categories.values_list('id', flat=True))
+    country_ids = list(star.countries.values_list('id', flat=True))
+    return category_ids, country_ids
+
+
+@receiver(pre_save, sender=Star)
+def remember_published_state(sender, instance, raw=False, **kwargs):
+    """Запоминает, была ли знаменитость опубликована до сохранения, и поля, видимые в поиске."""
+    if raw or instance.pk is None:
+        instance._was_published = None
+        instance._was_search_fields = None
+        return
+
+    previous = Star.objects.filter(pk=instance.pk).values_list('is_published', 'name', 'slug').first()
+    instance._was_published = previous[0] if previous else None
+    instance._was_search_fields = previous
+
+
+def _search_fields(instance):
+    # Рейтинг и дата рождения в индексах влияют только на порядок - их правки попадают
+    # в индексы при следующей перестройке, отдельная перестройка ради них не нужна
+    return instance.is_published, instance.name, instance.slug
+
+
+@receiver(post_save, sender=Star)
+def update_counts_on_publish(sender, instance, created, raw=False, **kwargs):
+    """Обновляет счетчики при публикации и снятии с публикации."""
+    was_published = getattr(instance, '_was_published', None)
+    if raw or created or was_published is None or was_published == instance.is_published:
+        return
+
+    delta = 1 if instance.is_published else -1
+    category_ids, country_ids = _relation_ids(instance)
+    _apply_deltas(add_keys({}, star_keys(category_ids, country_ids), delta))
+
+
+@receiver(post_save, sender=Star)
+def invalidate_search_on_save(sender, instance, created, raw=False, **kwargs):
+    """Перестраивает индексы поиска (и снимок для браузера), если изменились публикация, имя или slug."""
+    if raw:
+        return
+    previous = getattr(instance, '_was_search_fields', None)
+    if created or previous is None:
+        changed = instance.is_published
+    else:
+        changed = previous != _search_fields(instance) and (previous[0] or instance.is_published)
+    if changed:
+        invalidate_search_indexes()
+
+
+@receiver(post_delete, sender=Star)
+def invalidate_search_on_delete(sender, instance, **kwargs):
+    """Убирает удаленную опубликованную знаменитость из индексов поиска."""
+    if instance.is_published:
+        invalidate_search_indexes()
+
+
+@receiver(pre_delete, sender=Star)
+def update_counts_on_delete(sender, instance, **kwargs):
+    """Вычитает удаляемую опубликованную знаменитость из счетчиков."""
+    if not instance.is_published:
+        return
+
+    category_ids, country_ids = _relation_ids(instance)
+    _apply_deltas(add_keys({}, star_keys(category_ids, country_ids), -1))
+
+
+def _relation_keys(field_name, changed_ids, other_ids):
+    """Ключи счетчиков, затронутые изменением одной из связей знаменитости."""
+    if field_name == 'categories':
+        return pair_keys(changed_ids, other_ids) + [(category_id, None) for category_id in changed_ids]
+    return pair_keys(other_ids, changed_ids) + [(None, country_id) for country_id in changed_ids]
+
+
+def _handle_relation_change(field_name, sender, instance, action, reverse, pk_set):
+    # Столбцы промежуточной таблицы: star_id и category_id / country_id
+    related_column = 'category_id' if field_name == 'categories' else 'country_id'
+    other_field = 'countries' if field_name == 'categories' else 'categories'
+
+    if action in ('pre_remove', 'pre_clear'):
+        # Запоминаем реально существующие связи до удаления
+        links = sender.objects.all()
+        if reverse:
+            links = links.filter(**{related_column: instance.pk}, star__is_published=True)
+            if pk_set is not None:
+                links = links.filter(star_id__in=pk_set)
+        else:
+            links = links.filter(star_id=instance.pk)
+            if pk_set is not None:
+                links = links.filter(**{f'{related_column}__in': pk_set})
+        instance._removed_links = list(links.values_list('star_id', related_column))
+        return
+
+    if action == 'post_add':
+        if reverse:
+            star_ids = Star.objects.filter(pk__in=pk_set, is_published=True).values_list('id', flat=True)
+            links = [(star_id, instance.pk) for star_id in star_ids]
+        elif instance.is_published:
+            links = [(instance.pk, related_id) for related_id in pk_set]
+        else:
+            links = []
+        delta = 1
+    elif action in ('post_remove', 'post_clear'):
+        links = getattr(instance, '_removed_links', [])
+        instance._removed_links = []
+        if not reverse and not instance.is_published:
+            links = []
+        delta = -1
+    else:
+        return
+
+    if not links:
+        return
+
+    # Группируем изменения по знаменитостям и подтягиваем их вторую связь одним запросом
+    changed_by_star = {}
+    for star_id, related_id in links:
+        changed_by_star.setdefault(star_id, []).append(related_id)
+
+    other_through = getattr(Star, other_field).through
+    other_column = 'country_id' if other_field == 'countries' else 'category_id'
+    other_by_star = {star_id: [] for star_id in changed_by_star}
+    for star_id, other_id in (other_through.objects.filter(star_id__in=changed_by_star)
+                              .values_list('star_id', other_column)):
+        other_by_star[star_id].append(other_id)
+
+    deltas = {}
+    for star_id, changed_ids in changed_by_star.items():
+        add_keys(deltas, _relation_keys(field_name, changed_ids, other_by_star[star_id]), delta)
+    _apply_deltas(deltas)
+
+
+@receiver(m2m_changed, sender=Star.categories.through)
+def update_counts_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Поддерживает счетчики при изменении категорий знаменитости."""
+    _handle_relation_change('categories', sender, instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=Star.countries.through)
+def update_counts_on_countries_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Поддерживает счетчики при изменении стран знаменитости."""
+    _handle_relation_change('countries', sender, instance, action, reverse, pk_set)
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=Country)
+def remember_slug(sender, instance, raw=False, **kwargs):
+    """Запоминает slug категории или страны до сохранения."""
+    if raw or instance.pk is None:
+        instance._was_slug = None
+        return
+    instance._was_slug = sender.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Country)
+def update_tags_on_slug_change(sender, instance, created, raw=False, **kwargs):
+    """Пересчитывает slug тегов после смены slug категории или страны."""
+    was_slug = getattr(instance, '_was_slug', None)
+    if raw or created or was_slug is None or was_slug == instance.slug:
+        return
+    field = 'category_id' if sender is Category else 'country_id'
+    sync_tag_slugs(**{field: instance.pk})
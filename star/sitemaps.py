@@ -1,6 +1,7 @@
 from django.contrib.sitemaps import Sitemap
 from django.urls import reverse
-from .models import Star, Country, Category
+from .models import Star, Country, Category, Tag
+from .utils import NAME_LETTERS
 from datetime import datetime, date, timedelta
 import calendar
 
@@ -42,6 +43,21 @@ class CategorySitemap(Sitemap):
         return reverse('stars_by_category', kwargs={'slug': obj.slug})
 
 
+class TagSitemap(Sitemap):
+    changefreq = 'weekly'
+    priority = 0.7
+
+    def items(self):
+        # Реестр тегов уже содержит только жизнеспособные виртуальные категории
+        return Tag.objects.only('slug', 'time_update').order_by('slug')
+
+    def lastmod(self, obj):
+        return obj.time_update
+
+    def location(self, obj):
+        return reverse('tag', kwargs={'tag_slug': obj.slug})
+
+
 class BirthdaySitemap(Sitemap):
     changefreq = 'daily'
     priority = 0.7
@@ -100,12 +116,10 @@ class NamesSitemap(Sitemap):
     priority = 0.5
 
     def items(self):
-        # Получаем все буквы, для которых есть знаменитости
-        letters = []
-        for letter in 'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЭЮЯ':
-            if Star.objects.filter(is_published=True, name__istartswith=letter).exists():
-                letters.append(letter)
-        return letters
+        # Все буквы, для которых есть знаменитости, одним запросом
+        used = set(Star.objects.filter(is_published=True, name_letter__in=NAME_LETTERS)
+                   .values_list('name_letter', flat=True).distinct())
+        return [letter for letter in NAME_LETTERS if letter in used]
 
     def location(self, obj):
-        return reverse('names_letter', kwargs={'letter': obj})
\ No newline at end of file
+        return reverse('names_letter', kwargs={'letter': obj.lower()})
\ No newline at end of file
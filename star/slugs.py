@@ -0,0 +1,108 @@
+"""
+Подбор уникальных slug для стран, категорий и знаменитостей.
+
+Основа slug - транслитерация названия (результат кэшируется: одни и те же имена и
+названия встречаются постоянно). Занятые варианты основы (сама основа и slug,
+начинающиеся с 'основа-') загружаются одним запросом - для пакета одним запросом на SLUG_QUERY_CHUNK основ, -
+после чего свободные номера выбираются в памяти.
+
+Между подбором и вставкой другой процесс может занять тот же slug. Тогда вставка
+падает с IntegrityError, и slug подбирается заново (до SLUG_SAVE_ATTEMPTS попыток);
+вставка выполняется в точке сохранения, поэтому внешняя транзакция не прерывается.
+"""
+from functools import lru_cache
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+from transliterate import translit
+
+# Сколько основ проверяется одним запросом
+SLUG_QUERY_CHUNK = 400
+
+SLUG_SAVE_ATTEMPTS = 5
+
+
+@lru_cache(maxsize=50000)
+def slug_base(text):
+    return slugify(translit(text, 'ru', reversed=True))
+
+
+class SlugAllocator:
+    """Выдает свободные slug модели; занятые запоминает, поэтому повторов внутри пакета нет."""
+
+    def __init__(self, model, fallback=''):
+        self.model = model
+        self.fallback = fallback
+        self.used = set()
+        self.loaded = set()
+        # Основа -> номер, с которого продолжать поиск
+        self.next_number = {}
+
+    def _load(self, bases):
+        bases = [base for base in dict.fromkeys(bases) if base not in self.loaded]
+        for start in range(0, len(bases), SLUG_QUERY_CHUNK):
+            q = Q()
+            for base in bases[start:start + SLUG_QUERY_CHUNK]:
+                # Основа - полное имя, поэтому лишних совпадений по префиксу мало; они просто считаются занятыми
+                q |= Q(slug=base) | Q(slug__startswith=f'{base}-')
+            self.used.update(self.model.objects.filter(q).values_list('slug', flat=True))
+        self.loaded.update(bases)
+
+    def _next_slug(self, base):
+        n = self.next_number.get(base, 0)
+        while True:
+            slug = f'{base}-{n}' if n else base
+            if slug not in self.used:
+                break
+            n += 1
+        self.next_number[base] = n + 1
+        self.used.add(slug)
+        return slug
+
+    def allocate(self, texts):
+        """Свободные slug для названий texts, в том же порядке."""
+        bases = [slug_base(text) or self.fallback for text in texts]
+        self._load(bases)
+        return [self._next_slug(base) for base in bases]
+
+
+def _slugs_taken(model, slugs):
+    return model.objects.filter(slug__in=slugs).exists()
+
+
+def save_with_slug(instance, text, save, fallback=''):
+    """
+    Сохраняет объект функцией save. Если slug не задан, подбирает свободный по text
+    и при гонке с другим процессом (IntegrityError на этом slug) подбирает заново.
+    """
+    if instance.slug:
+        save()
+        return
+
+    model = type(instance)
+    for attempt in range(SLUG_SAVE_ATTEMPTS):
+        instance.slug = SlugAllocator(model, fallback).allocate([text])[0]
+        try:
+            with transaction.atomic():
+                save()
+            return
+        except IntegrityError:
+            # Ошибка не из-за slug или попытки кончились - пробрасываем
+            if attempt == SLUG_SAVE_ATTEMPTS - 1 or not _slugs_taken(model, [instance.slug]):
+                instance.slug = ''
+                raise
+
+
+def bulk_create_with_slugs(model, objs, texts, fallback=''):
+    """bulk_create с подбором slug для всего пакета и повтором при гонке за slug."""
+    for attempt in range(SLUG_SAVE_ATTEMPTS):
+        allocator = SlugAllocator(model, fallback)
+        for obj, slug in zip(objs, allocator.allocate(texts)):
+            obj.slug = slug
+        try:
+            with transaction.atomic():
+                return model.objects.bulk_create(objs)
+        except IntegrityError:
+            if attempt == SLUG_SAVE_ATTEMPTS - 1 or not _slugs_taken(model, [obj.slug for obj in objs]):
+                raise
@@ -0,0 +1,342 @@
+"""
+Импорт через промежуточные таблицы (import_stars --staged).
+
+Строки файла разбираются теми же функциями, что и при обычном импорте, и пакетами
+записываются в ImportRow и ImportLink - таблицы, которые сайт не читает, поэтому
+загрузка не блокирует star_star и не показывает посетителям половину импорта.
+Там же наборными запросами (по всем строкам сразу, без циклов в Python):
+- отбрасываются повторы имен внутри файла (остается первая строка);
+- строки сопоставляются с существующими знаменитостями по имени;
+- определяется действие: new, changed, refresh (изменился только отпечаток строки),
+  unchanged (тот же отпечаток) или skip (существующая без --update).
+Неизвестные страны и категории до публикации не создаются: связи с ними получают
+временные отрицательные id.
+
+Публикация - одна короткая транзакция: создание недостающих стран и категорий,
+INSERT ... SELECT новых, UPDATE ... FROM
+измененных (правила те же, что в importing: пустые ячейки не затирают данные),
+удаление лишних и вставка недостающих связей. После нее - один пакет пересчетов
+и инвалидации кэша (importing.finish_import), затем строки запуска удаляются.
+"""
+import datetime
+import uuid
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Exists, Min, OuterRef, Subquery
+from django.utils import timezone
+
+from .cache_keys import star_cache_keys
+from .importing import (ImportStats, References, PhotoLocator, IMPORT_BATCH_SIZE, DEFAULT_COUNTRY,
+                        DEFAULT_CATEGORY, batched, parse_rows, finish_import)
+from .models import Star, Country, Category, ImportRow, ImportLink
+from .slugs import SlugAllocator, SLUG_SAVE_ATTEMPTS
+
+# Строки прерванных запусков удаляются при следующем импорте
+STAGING_KEEP = datetime.timedelta(days=1)
+
+# (связь, столбец промежуточной таблицы M2M, признак явного указания в строке)
+RELATIONS = [
+    ('countries', 'country_id', 'countries_given'),
+    ('categories', 'category_id', 'categories_given'),
+]
+
+
+def _tables():
+    tables = {
+        'row': ImportRow._meta.db_table,
+        'link': ImportLink._meta.db_table,
+        'star': Star._meta.db_table,
+    }
+    for kind, column, given in RELATIONS:
+        tables[kind] = getattr(Star, kind).through._meta.db_table
+    return {key: connection.ops.quote_name(table) for key, table in tables.items()}
+
+
+def _execute(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _remove_stale_runs():
+    stale = ImportRow.objects.filter(created_at__lt=timezone.now() - STAGING_KEEP).values('run').distinct()
+    ImportLink.objects.filter(run__in=stale).delete()
+    ImportRow.objects.filter(run__in=stale).delete()
+
+
+class StagedReferences(References):
+    """
+    Страны и категории для промежуточных таблиц: недостающие получают временные
+    отрицательные id и создаются только при публикации (create_missing).
+    """
+
+    def __init__(self):
+        super().__init__()
+        # связь -> {название: временный id}
+        self.missing = {'countries': {}, 'categories': {}}
+
+    def country_ids(self, names):
+        return [self._staged('countries', self.countries, name) for name in names]
+
+    def category_ids(self, names):
+        return [self._staged('categories', self.categories, name) for name in names]
+
+    def _staged(self, kind, known, name):
+        if name in known:
+            return known[name]
+        missing = self.missing[kind]
+        if name not in missing:
+            missing[name] = -(len(missing) + 1)
+        return missing[name]
+
+    def create_missing(self, run):
+        """Создает недостающие страны и категории и подставляет их id в связи запуска (в транзакции публикации)."""
+        for kind, model, field in (('countries', Country, 'name'), ('categories', Category, 'title')):
+            missing = self.missing[kind]
+            if not missing:
+                continue
+            # Другой процесс мог создать их после начала импорта
+            existing = dict(model.objects.filter(**{f'{field}__in': list(missing)}).values_list(field, 'id'))
+            for name, staged_id in missing.items():
+                related_id = existing.get(name)
+                if related_id is None:
+                    # save() модели подбирает slug
+                    obj = model(**{field: name})
+                    obj.save()
+                    related_id = obj.id
+                ImportLink.objects.filter(run=run, kind=kind, related_id=staged_id).update(related_id=related_id)
+
+
+def stage_rows(run, rows, stats, references, update_existing, images_dir, batch_size, progress=None):
+    """Разбирает строки и записывает их в промежуточные таблицы пакетами по batch_size."""
+    photos = PhotoLocator(images_dir)
+    line = 0
+    try:
+        for parsed in batched(parse_rows(rows, stats), batch_size):
+            # Фотографии нужны новым знаменитостям и существующим без фотографии
+            names = [data['name'] for data in parsed]
+            with_photo = set()
+            existing = set()
+            for name, photo in Star.objects.filter(name__in=names).values_list('name', 'photo'):
+                existing.add(name)
+                if photo:
+                    with_photo.add(name)
+            photo_paths = photos.locate_many([
+                data['img'] for data in parsed
+                if data['name'] not in existing or (update_existing and data['name'] not in with_photo)
+            ])
+
+            staged, links = [], []
+            for data in parsed:
+                line += 1
+                names_source = Star(name=data['name'])
+                names_source.fill_name_fields()
+                staged.append(ImportRow(
+                    run=run,
+                    line=line,
+                    name=data['name'],
+                    birth_date=data['birth_date'],
+                    death_date=data['death_date'],
+                    content=data['content'] or None,
+                    wikipedia=data['wikipedia'],
+                    ruwiki=data['ruwiki'],
+                    rating=data['rating'],
+                    photo=photo_paths.get(data['img']),
+                    fingerprint=data['fingerprint'],
+                    search_name=names_source.search_name,
+                    name_letter=names_source.name_letter,
+                    name_sort=names_source.name_sort,
+                    countries_given=data['countries'] != [DEFAULT_COUNTRY],
+                    categories_given=data['categories'] != [DEFAULT_CATEGORY],
+                ))
+                for kind, related_ids in (('countries', references.country_ids(data['countries'])),
+                                          ('categories', references.category_ids(data['categories']))):
+                    links += [ImportLink(run=run, line=line, kind=kind, related_id=related_id)
+                              for related_id in dict.fromkeys(related_ids)]
+
+            ImportRow.objects.bulk_create(staged)
+            ImportLink.objects.bulk_create(links)
+            if progress:
+                progress(stats)
+    finally:
+        photos.close()
+
+
+def resolve_actions(run, stats, update_existing):
+    """Повторы, сопоставление с базой и действие для каждой строки - наборными запросами."""
+    rows = ImportRow.objects.filter(run=run)
+
+    # Повторы имени внутри файла: остается первая строка
+    first_lines = rows.values('name').annotate(first=Min('line')).values('first')
+    duplicates = rows.exclude(line__in=first_lines)
+    ImportLink.objects.filter(run=run, line__in=duplicates.values('line')).delete()
+    stats.skipped += duplicates.delete()[0]
+
+    # Как при обычном импорте, при одинаковых именах в базе обновляется последняя знаменитость
+    rows.update(star_id=Subquery(Star.objects.filter(name=OuterRef('name')).order_by('-id').values('id')[:1]))
+    rows.filter(star_id__isnull=True).update(action='new')
+
+    existing = rows.filter(star_id__isnull=False)
+    if not update_existing:
+        existing.update(action='skip')
+        return
+    existing.filter(Exists(Star.objects.filter(pk=OuterRef('star_id'), source_fingerprint=OuterRef('fingerprint')))
+                    ).update(action='unchanged')
+    existing.filter(action='').update(action='update')
+
+    # Отпечаток изменился: есть ли отличия в полях или связях (иначе записывается только отпечаток)
+    t = _tables()
+    field_changes = ' OR '.join(
+        [f'(r.{field} IS NOT NULL AND (s.{field} IS NULL OR s.{field} <> r.{field}))'
+         for field in ('wikipedia', 'ruwiki', 'content', 'death_date')]
+        + ['s.birth_date <> r.birth_date',
+           '(r.rating <> 0 AND s.rating <> r.rating)',
+           "(r.photo IS NOT NULL AND (s.photo IS NULL OR s.photo = ''))"]
+    )
+    link_changes = ' OR '.join(f"""
+        (r.{given} = %s AND (
+            EXISTS (SELECT 1 FROM {t['link']} l WHERE l.run = r.run AND l.line = r.line AND l.kind = '{kind}'
+                    AND NOT EXISTS (SELECT 1 FROM {t[kind]} m WHERE m.star_id = r.star_id AND m.{column} = l.related_id))
+            OR EXISTS (SELECT 1 FROM {t[kind]} m WHERE m.star_id = r.star_id
+                    AND NOT EXISTS (SELECT 1 FROM {t['link']} l WHERE l.run = r.run AND l.line = r.line
+                                    AND l.kind = '{kind}' AND l.related_id = m.{column}))))
+    """ for kind, column, given in RELATIONS)
+    _execute(f"""
+        UPDATE {t['row']} SET action = 'changed'
+        WHERE id IN (
+            SELECT r.id FROM {t['row']} r JOIN {t['star']} s ON s.id = r.star_id
+            WHERE r.run = %s AND r.action = 'update' AND ({field_changes} OR {link_changes})
+        )
+    """, [run] + [True] * len(RELATIONS))
+    rows.filter(action='update').update(action='refresh')
+
+
+def allocate_staged_slugs(run):
+    """Slug для новых строк: один SlugAllocator на весь запуск, поэтому повторов нет."""
+    allocator = SlugAllocator(Star, 'star')
+    new_rows = ImportRow.objects.filter(run=run, action='new').order_by('line').only('id', 'name')
+    for batch in batched(new_rows.iterator(chunk_size=IMPORT_BATCH_SIZE), IMPORT_BATCH_SIZE):
+        for staged, slug in zip(batch, allocator.allocate([staged.name for staged in batch])):
+            staged.slug = slug
+        ImportRow.objects.bulk_update(batch, ['slug'])
+
+
+def publish(run, references):
+    """Переносит проверенные строки в star_star и связи - в одной транзакции."""
+    t = _tables()
+    now = timezone.now()
+    with transaction.atomic():
+        references.create_missing(run)
+        _execute(f"""
+            INSERT INTO {t['star']} (name, slug, birth_date, death_date, content, wikipedia, ruwiki, rating, photo,
+                                     search_name, name_letter, name_sort, source_fingerprint,
+                                     is_published, time_create, time_update)
+            SELECT name, slug, birth_date, death_date, COALESCE(content, ''), wikipedia, ruwiki, rating, photo,
+                   search_name, name_letter, name_sort, fingerprint, %s, %s, %s
+            FROM {t['row']} WHERE run = %s AND action = 'new' ORDER BY line
+        """, [True, now, now, run])
+        _execute(f"""
+            UPDATE {t['row']} SET star_id = (SELECT s.id FROM {t['star']} s WHERE s.slug = {t['row']}.slug)
+            WHERE run = %s AND action = 'new'
+        """, [run])
+
+        _execute(f"""
+            UPDATE {t['star']} SET
+                wikipedia = COALESCE(r.wikipedia, {t['star']}.wikipedia),
+                ruwiki = COALESCE(r.ruwiki, {t['star']}.ruwiki),
+                content = COALESCE(r.content, {t['star']}.content),
+                birth_date = r.birth_date,
+                death_date = COALESCE(r.death_date, {t['star']}.death_date),
+                rating = CASE WHEN r.rating <> 0 THEN r.rating ELSE {t['star']}.rating END,
+                photo = CASE WHEN {t['star']}.photo IS NULL OR {t['star']}.photo = '' THEN r.photo
+                             ELSE {t['star']}.photo END,
+                source_fingerprint = r.fingerprint,
+                time_update = %s
+            FROM {t['row']} r
+            WHERE r.run = %s AND r.action = 'changed' AND {t['star']}.id = r.star_id
+        """, [now, run])
+        _execute(f"""
+            UPDATE {t['star']} SET source_fingerprint = r.fingerprint
+            FROM {t['row']} r
+            WHERE r.run = %s AND r.action = 'refresh' AND {t['star']}.id = r.star_id
+        """, [run])
+
+        for kind, column, given in RELATIONS:
+            _execute(f"""
+                DELETE FROM {t[kind]} WHERE EXISTS (
+                    SELECT 1 FROM {t['row']} r
+                    WHERE r.run = %s AND r.action = 'changed' AND r.{given} = %s AND r.star_id = {t[kind]}.star_id
+                      AND NOT EXISTS (SELECT 1 FROM {t['link']} l WHERE l.run = r.run AND l.line = r.line
+                                      AND l.kind = '{kind}' AND l.related_id = {t[kind]}.{column})
+                )
+            """, [run, True])
+            _execute(f"""
+                INSERT INTO {t[kind]} (star_id, {column})
+                SELECT DISTINCT r.star_id, l.related_id
+                FROM {t['row']} r JOIN {t['link']} l ON l.run = r.run AND l.line = r.line AND l.kind = '{kind}'
+                WHERE r.run = %s AND (r.action = 'new' OR (r.action = 'changed' AND r.{given} = %s))
+                  AND NOT EXISTS (SELECT 1 FROM {t[kind]} m WHERE m.star_id = r.star_id AND m.{column} = l.related_id)
+            """, [run, True])
+
+
+def publish_with_retry(run, references):
+    """Публикация; если другой процесс занял выбранный slug, slug подбираются заново."""
+    for attempt in range(SLUG_SAVE_ATTEMPTS):
+        try:
+            publish(run, references)
+            return
+        except IntegrityError:
+            taken = Star.objects.filter(slug__in=ImportRow.objects.filter(run=run, action='new').values('slug'))
+            if attempt == SLUG_SAVE_ATTEMPTS - 1 or not taken.exists():
+                raise
+            allocate_staged_slugs(run)
+
+
+def _star_values(star_ids):
+    return {star_id: values for star_id, *values in Star.objects.filter(id__in=star_ids).values_list(
+        'id', 'slug', 'birth_date', 'rating')}
+
+
+def import_stars_staged(rows, update_existing=False, images_dir='img-2', batch_size=IMPORT_BATCH_SIZE,
+                        progress=None):
+    """Импорт через промежуточные таблицы (см. описание модуля). Возвращает ImportStats."""
+    stats = ImportStats()
+    run = uuid.uuid4().hex
+    references = StagedReferences()
+    _remove_stale_runs()
+    try:
+        stage_rows(run, rows, stats, references, update_existing, images_dir, batch_size, progress)
+        resolve_actions(run, stats, update_existing)
+        allocate_staged_slugs(run)
+
+        rows = ImportRow.objects.filter(run=run)
+        changed_ids = list(rows.filter(action='changed').values_list('star_id', flat=True))
+        before = _star_values(changed_ids)
+        publish_with_retry(run, references)
+        after = _star_values(changed_ids)
+
+        actions = dict(rows.values_list('action').annotate(n=Count('id')).order_by())
+        stats.created = actions.get('new', 0)
+        stats.updated = actions.get('changed', 0)
+        stats.unchanged = actions.get('unchanged', 0) + actions.get('refresh', 0)
+        stats.skipped += actions.get('skip', 0)
+
+        for star_id, slug, birth_date in rows.filter(action='new').values_list('star_id', 'slug', 'birth_date'):
+            stats.changed_ids.append(star_id)
+            stats.cache_keys.update(star_cache_keys(slug, birth_date))
+        for star_id in changed_ids:
+            stats.changed_ids.append(star_id)
+            for slug, birth_date, rating in (before[star_id], after[star_id]):
+                stats.cache_keys.update(star_cache_keys(slug, birth_date))
+            if before[star_id] != after[star_id]:
+                stats.search_changed = True
+        # Связи сверяются только при публикации; изменения новых и измененных пересчитываются целиком
+        stats.relations_changed = bool(stats.changed_ids)
+        stats.search_changed = stats.search_changed or bool(stats.created)
+    finally:
+        ImportLink.objects.filter(run=run).delete()
+        ImportRow.objects.filter(run=run).delete()
+
+    if stats.changed_ids:
+        finish_import(stats)
+    return stats
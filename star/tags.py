@@ -0,0 +1,122 @@
+import logging
+
+from django.db import transaction
+from django.db.models import Q
+
+from .counts import TAG_MIN_STARS
+from .models import StarCount, Tag
+
+logger = logging.getLogger(__name__)
+
+
+def tag_slug(category, country):
+    """Slug виртуальной категории: категория и страна через дефис."""
+    return f"{category.slug}-{country.slug}"
+
+
+def _viable_pairs(pairs=None):
+    """
+    Возвращает {(category_id, country_id): StarCount} для пересечений, набравших TAG_MIN_STARS.
+    Если pairs задан, рассматриваются только эти пересечения.
+    """
+    rows = StarCount.objects.filter(
+        category__isnull=False,
+        country__isnull=False,
+        count__gte=TAG_MIN_STARS
+    ).select_related('category', 'country')
+
+    if pairs is not None:
+        q = Q()
+        for category_id, country_id in pairs:
+            q |= Q(category_id=category_id, country_id=country_id)
+        rows = rows.filter(q)
+
+    return {(row.category_id, row.country_id): row for row in rows}
+
+
+def _sync(viable, existing):
+    """
+    Приводит теги existing ({пара: Tag}) в соответствие со счетчиками viable ({пара: StarCount}).
+    Возвращает (создано, обновлено, удалено).
+    """
+    stale_ids = [tag.id for pair, tag in existing.items() if pair not in viable]
+    if stale_ids:
+        Tag.objects.filter(id__in=stale_ids).delete()
+
+    updated = 0
+    taken_slugs = None
+    new_tags = []
+    for pair, row in viable.items():
+        tag = existing.get(pair)
+        slug = tag_slug(row.category, row.country)
+
+        if tag is None or tag.slug != slug:
+            # Slug может совпасть у разных пар (дефисы в slug категории и страны) - побеждает
+            # первая; новый тег пропускается, существующий сохраняет прежний slug
+            if taken_slugs is None:
+                taken_slugs = set(Tag.objects.values_list('slug', flat=True))
+            if slug in taken_slugs:
+                logger.warning('Slug тега "%s" (категория %s, страна %s) уже занят: %s',
+                               slug, row.category_id, row.country_id,
+                               'тег не создан' if tag is None else f'оставлен прежний "{tag.slug}"')
+                slug = None
+            else:
+                taken_slugs.add(slug)
+                if tag is not None:
+                    taken_slugs.discard(tag.slug)
+
+        if tag is None:
+            if slug is not None:
+                new_tags.append(Tag(slug=slug, category_id=row.category_id, country_id=row.country_id,
+                                    count=row.count))
+            continue
+
+        slug = slug or tag.slug
+        if tag.count != row.count or tag.slug != slug:
+            tag.count = row.count
+            tag.slug = slug
+            tag.save(update_fields=['count', 'slug', 'time_update'])
+            updated += 1
+
+    if new_tags:
+        Tag.objects.bulk_create(new_tags, ignore_conflicts=True)
+
+    return len(new_tags), updated, len(stale_ids)
+
+
+def sync_tags(keys):
+    """Обновляет реестр тегов для изменившихся ключей счетчиков."""
+    pairs = {(category_id, country_id) for category_id, country_id in keys
+             if category_id is not None and country_id is not None}
+    if not pairs:
+        return
+
+    existing = {}
+    q = Q()
+    for category_id, country_id in pairs:
+        q |= Q(category_id=category_id, country_id=country_id)
+    for tag in Tag.objects.filter(q):
+        existing[(tag.category_id, tag.country_id)] = tag
+
+    _sync(_viable_pairs(pairs), existing)
+
+
+def sync_tag_slugs(**filters):
+    """
+    Обновляет теги категории или страны после смены ее slug
+    (filters: category_id=... или country_id=...).
+    """
+    keys = set(Tag.objects.filter(**filters).values_list('category_id', 'country_id'))
+    keys.update(StarCount.objects.filter(country__isnull=False, category__isnull=False,
+                                         count__gte=TAG_MIN_STARS, **filters)
+                .values_list('category_id', 'country_id'))
+    sync_tags(keys)
+
+
+@transaction.atomic
+def rebuild_tags():
+    """Перестраивает весь реестр тегов по таблице счетчиков. Возвращает (создано, обновлено, удалено)."""
+    existing = {(tag.category_id, tag.country_id): tag for tag in Tag.objects.all()}
+    # Крупные теги получают slug первыми при коллизиях
+    viable = dict(sorted(_viable_pairs().items(), key=lambda item: -item[1].count))
+    return _sync(viable, existing)
@@ -0,0 +1,377 @@
+"""
+Ограничение частоты запросов к дорогим страницам (поиск и списки с фильтрами).
+
+У каждого клиента есть "ведро" токенов: оно пополняется со скоростью rate токенов
+в секунду до емкости burst, запрос списывает столько токенов, сколько стоит.
+Стоимость заранее оценивается по параметрам запроса (текстовый поиск и фильтр
+по имени дороже простой страницы), а после ответа уточняется по фактическому
+времени работы представления - ответ из кэша обходится дешево, медленный запрос
+уходит в долг.
+
+Проверяются два ведра: адрес клиента и его подсеть (/24 для IPv4, /64 для IPv6).
+Адрес берется из заголовка прокси (STAR_THROTTLE_IP_HEADER); запросы с частного или
+локального адреса без этого заголовка - это прокси без настройки, все посетители
+попали бы в одно ведро, поэтому они не ограничиваются, а в лог пишется ошибка.
+Поисковые роботы узнаются по User-Agent, но общий бюджет робота получают только после
+проверки адреса: обратная запись DNS в домене робота и прямая запись этого имени,
+указывающая на тот же адрес. Проверка идет в фоновом пуле, результат кэшируется.
+Запрос проверку не ждет: до появления результата в кэше робот считается непроверенным.
+Не прошедший проверку - обычный клиент; робот без правила проверки (или пока не
+проверенный) получает бюджет робота отдельно на каждый адрес и общее ведро подсети.
+Ведра хранятся в Redis и списываются атомарно Lua-скриптом; если кэш не Redis
+(разработка, тесты) или Redis недоступен - в памяти процесса.
+
+Клиент сверх бюджета получает сохраненную копию той же страницы, если она есть,
+иначе ответ 429 с заголовком Retry-After.
+"""
+import hashlib
+import concurrent.futures
+import ipaddress
+import logging
+import math
+import re
+import socket
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Бюджет по умолчанию (переопределяется в settings): токенов в секунду и емкость ведра
+THROTTLE_RATE = 1.0
+THROTTLE_BURST = 60
+CRAWLER_RATE = 5.0
+CRAWLER_BURST = 300
+
+# Домены обратной записи DNS для проверки роботов (по началу имени робота из CRAWLER_RE)
+CRAWLER_DOMAINS = {
+    'googlebot': ('.googlebot.com', '.google.com'),
+    'yandex': ('.yandex.ru', '.yandex.net', '.yandex.com'),
+    'bingbot': ('.search.msn.com',),
+    'mail.ru_bot': ('.mail.ru',),
+    'applebot': ('.applebot.apple.com',),
+    'baiduspider': ('.baidu.com', '.baidu.jp'),
+    'petalbot': ('.petalsearch.com',),
+    'ahrefsbot': ('.ahrefs.com', '.ahrefs.net'),
+    'semrushbot': ('.semrush.com',),
+}
+CRAWLER_VERIFY_THREADS = 4
+CRAWLER_VERIFIED_TIMEOUT = 60 * 60 * 24
+CRAWLER_REJECTED_TIMEOUT = 60 * 60
+
+# Ведро подсети во столько раз больше ведра одного адреса
+SUBNET_FACTOR = 4
+SUBNET_PREFIX_V4 = 24
+SUBNET_PREFIX_V6 = 64
+
+# Оценка стоимости запроса в токенах
+COST_PAGE = 1
+COST_FILTER = 2
+COST_NAME_FILTER = 4
+COST_SEARCH = 5
+COST_BIO_SEARCH = 10
+COST_DEEP_PAGE = 2
+DEEP_PAGE = 20
+
+# Фактическая стоимость: токен за каждые 100 мс работы представления
+SECONDS_PER_TOKEN = 0.1
+
+# Сколько хранится копия дорогой страницы для клиентов сверх бюджета
+DEGRADED_CACHE_TIMEOUT = 60 * 10
+
+# Ведра в памяти процесса: при превышении числа ключей удаляются полные ведра
+LOCAL_MAX_BUCKETS = 100000
+
+KEY_PREFIX = 'throttle:'
+
+CRAWLER_RE = re.compile(
+    r'(googlebot|yandex\w*bot|yandeximages|bingbot|mail\.ru_bot|duckduckbot|applebot|baiduspider|'
+    r'petalbot|ahrefsbot|semrushbot|mj12bot|dotbot|bytespider|gptbot)',
+    re.IGNORECASE
+)
+
+# KEYS - ведра; ARGV: время, стоимость, списать ли без проверки, затем пары rate, burst на каждое ведро.
+# Возвращает {1 или 0, сколько секунд ждать}: списывается со всех ведер или ни с одного
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local force = tonumber(ARGV[3])
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[2 + i * 2])
+  local burst = tonumber(ARGV[3 + i * 2])
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local value = tonumber(state[1]) or burst
+  local ts = tonumber(state[2]) or now
+  value = math.min(burst, value + math.max(0, now - ts) * rate)
+  tokens[i] = value
+  if value < cost then
+    wait = math.max(wait, (cost - value) / rate)
+  end
+end
+if wait > 0 and force == 0 then
+  return {0, tostring(wait)}
+end
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[2 + i * 2])
+  local burst = tonumber(ARGV[3 + i * 2])
+  local value = math.min(burst, tokens[i] - cost)
+  redis.call('HSET', key, 'tokens', tostring(value), 'ts', tostring(now))
+  redis.call('EXPIRE', key, math.ceil((burst - value) / rate) + 1)
+end
+return {1, tostring(wait)}
+"""
+
+
+class LocalBuckets:
+    """Ведра в памяти процесса - тот же алгоритм, что в TAKE_SCRIPT."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def take(self, buckets, cost, now, force=False):
+        with self.lock:
+            tokens = []
+            wait = 0.0
+            for key, rate, burst in buckets:
+                value, ts = self.buckets.get(key, (burst, now))[:2]
+                value = min(burst, value + max(0.0, now - ts) * rate)
+                tokens.append(value)
+                if value < cost:
+                    wait = max(wait, (cost - value) / rate)
+
+            if wait > 0 and not force:
+                return False, wait
+
+            if len(self.buckets) > LOCAL_MAX_BUCKETS:
+                self.prune(now)
+            for (key, rate, burst), value in zip(buckets, tokens):
+                self.buckets[key] = (min(burst, value - cost), now, rate, burst)
+            return True, wait
+
+    def prune(self, now):
+        """Удаляет ведра, которые успели бы наполниться (их состояние совпадает с новым ведром)."""
+        self.buckets = {
+            key: state for key, state in self.buckets.items()
+            if state[0] + (now - state[1]) * state[2] < state[3]
+        }
+
+
+local_buckets = LocalBuckets()
+
+_redis_script = None
+_redis_checked = False
+
+
+def redis_script():
+    """Lua-скрипт в Redis кэша по умолчанию или None, если кэш не Redis."""
+    global _redis_script, _redis_checked
+    if not _redis_checked:
+        try:
+            from django_redis import get_redis_connection
+            _redis_script = get_redis_connection('default').register_script(TAKE_SCRIPT)
+        except (ImportError, NotImplementedError):
+            _redis_script = None
+        _redis_checked = True
+    return _redis_script
+
+
+def throttle_budget():
+    return (getattr(settings, 'STAR_THROTTLE_RATE', THROTTLE_RATE),
+            getattr(settings, 'STAR_THROTTLE_BURST', THROTTLE_BURST))
+
+
+def client_ip(request):
+    """Адрес клиента: из заголовка прокси (STAR_THROTTLE_IP_HEADER), иначе REMOTE_ADDR."""
+    header = getattr(settings, 'STAR_THROTTLE_IP_HEADER', None)
+    # Последний адрес в цепочке добавлен нашим прокси, предыдущие может подставить клиент
+    value = request.META.get(header, '').split(',')[-1].strip() if header else ''
+    return value or request.META.get('REMOTE_ADDR', '')
+
+
+_proxy_reported = False
+
+
+def _behind_unconfigured_proxy(request, address):
+    """Адрес частный или локальный и пришел не из заголовка прокси - об этом один раз пишется ошибка."""
+    global _proxy_reported
+    header = getattr(settings, 'STAR_THROTTLE_IP_HEADER', None)
+    if (header and request.META.get(header)) or not (address.is_private or address.is_loopback):
+        return False
+    if not _proxy_reported and not settings.DEBUG:
+        _proxy_reported = True
+        logger.error('Запрос с адреса %s без заголовка %s: ограничение частоты отключено, '
+                     'проверьте STAR_THROTTLE_IP_HEADER и настройки прокси', address, header)
+    return True
+
+
+def _resolves_to_crawler(address, domains):
+    """Обратная запись адреса в одном из доменов робота, и прямая запись имени - тот же адрес."""
+    try:
+        host = socket.gethostbyaddr(address)[0].lower().rstrip('.')
+        if not host.endswith(domains):
+            return False
+        addresses = {ipaddress.ip_address(info[4][0].split('%')[0]) for info in socket.getaddrinfo(host, None)}
+    except (OSError, UnicodeError, ValueError):
+        return False
+    return ipaddress.ip_address(address) in addresses
+
+
+_verify_pool = concurrent.futures.ThreadPoolExecutor(max_workers=CRAWLER_VERIFY_THREADS,
+                                                     thread_name_prefix='crawler-dns')
+_verify_lock = threading.Lock()
+_verifying = {}
+
+
+def _verify_crawler(key, address, domains):
+    try:
+        verified = _resolves_to_crawler(address, domains)
+        cache.set(key, verified, CRAWLER_VERIFIED_TIMEOUT if verified else CRAWLER_REJECTED_TIMEOUT)
+        return verified
+    finally:
+        with _verify_lock:
+            _verifying.pop(key, None)
+
+
+def crawler_verified(name, address):
+    """
+    True - адрес принадлежит роботу name, False - нет, None - для робота нет правила
+    проверки или ее результата еще нет в кэше (тогда проверка запускается в фоне).
+    """
+    domains = next((domains for prefix, domains in CRAWLER_DOMAINS.items() if name.startswith(prefix)), None)
+    if domains is None or not getattr(settings, 'STAR_THROTTLE_VERIFY_CRAWLERS', True):
+        return None
+
+    key = f'{KEY_PREFIX}crawler-ip:{name}:{address}'
+    verified = cache.get(key)
+    if verified is not None:
+        return verified
+    # Одна проверка на адрес, сколько бы запросов с него ни пришло
+    with _verify_lock:
+        if key not in _verifying:
+            _verifying[key] = _verify_pool.submit(_verify_crawler, key, address, domains)
+    return None
+
+
+def client_buckets(request):
+    """Ведра клиента: [(ключ, rate, burst)]."""
+    rate, burst = throttle_budget()
+    ip = client_ip(request)
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return [(f'{KEY_PREFIX}ip:{ip}', rate, burst)]
+    if _behind_unconfigured_proxy(request, address):
+        return []
+
+    crawler = CRAWLER_RE.search(request.META.get('HTTP_USER_AGENT', ''))
+    verified = False
+    if crawler:
+        name = crawler.group(1).lower()
+        crawler_rate = getattr(settings, 'STAR_THROTTLE_CRAWLER_RATE', CRAWLER_RATE)
+        crawler_burst = getattr(settings, 'STAR_THROTTLE_CRAWLER_BURST', CRAWLER_BURST)
+        verified = crawler_verified(name, str(address))
+        if verified:
+            return [(f'{KEY_PREFIX}crawler:{name}', crawler_rate, crawler_burst)]
+
+    prefix = SUBNET_PREFIX_V4 if address.version == 4 else SUBNET_PREFIX_V6
+    subnet = ipaddress.ip_network(f'{address}/{prefix}', strict=False)
+    buckets = [
+        (f'{KEY_PREFIX}ip:{address}', rate, burst),
+        (f'{KEY_PREFIX}net:{subnet}', rate * SUBNET_FACTOR, burst * SUBNET_FACTOR),
+    ]
+    if crawler and verified is None:
+        # Непроверенный робот: бюджет робота, но свой у каждого адреса, и общее ведро подсети
+        buckets[0] = (f'{KEY_PREFIX}crawler:{name}:{address}', crawler_rate, crawler_burst)
+    return buckets
+
+
+def estimate_cost(request):
+    """Оценка стоимости запроса по параметрам - списывается до выполнения представления."""
+    params = request.GET
+    if params.get('q', '').strip():
+        cost = COST_BIO_SEARCH if params.get('scope') == 'bio' else COST_SEARCH
+    elif params.get('name', '').strip():
+        cost = COST_NAME_FILTER
+    elif params.get('country') or params.get('category') or params.get('sort'):
+        cost = COST_FILTER
+    else:
+        cost = COST_PAGE
+
+    page = params.get('page', '')
+    if page.isdigit() and int(page) > DEEP_PAGE:
+        cost += COST_DEEP_PAGE
+    return cost
+
+
+def take_tokens(buckets, cost, force=False):
+    """Списывает cost токенов со всех ведер. Возвращает (разрешено, секунд до наполнения)."""
+    now = time.time()
+    script = redis_script()
+    if script is not None:
+        keys = [key for key, rate, burst in buckets]
+        args = [now, cost, int(force)]
+        for key, rate, burst in buckets:
+            args += [rate, burst]
+        try:
+            allowed, wait = script(keys=keys, args=args)
+            return bool(int(allowed)), float(wait)
+        except Exception:
+            # Redis недоступен - считаем в памяти процесса, как и кэш с IGNORE_EXCEPTIONS
+            pass
+    return local_buckets.take(buckets, cost, now, force)
+
+
+def _copy_key(request):
+    return 'throttle_copy_' + hashlib.md5(request.get_full_path().encode()).hexdigest()
+
+
+def over_budget_response(request, wait):
+    """Сохраненная копия страницы или 429 с Retry-After."""
+    retry_after = str(max(1, math.ceil(wait)))
+    copy = cache.get(_copy_key(request))
+    if copy is not None:
+        content, content_type = copy
+        response = HttpResponse(content, content_type=content_type)
+        response['X-Throttled'] = 'cached'
+    else:
+        response = HttpResponse('Слишком много запросов, повторите позже.',
+                                content_type='text/plain; charset=utf-8', status=429)
+    response['Retry-After'] = retry_after
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def throttle(view):
+    """Декоратор представления: ограничение частоты запросов с оплатой по стоимости."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not getattr(settings, 'STAR_THROTTLE_ENABLED', True):
+            return view(request, *args, **kwargs)
+
+        buckets = client_buckets(request)
+        cost = estimate_cost(request)
+        allowed, wait = take_tokens(buckets, cost)
+        if not allowed:
+            return over_budget_response(request, wait)
+
+        started = time.monotonic()
+        response = view(request, *args, **kwargs)
+        actual = max(COST_PAGE, math.ceil((time.monotonic() - started) / SECONDS_PER_TOKEN))
+        if actual != cost:
+            take_tokens(buckets, actual - cost, force=True)
+
+        # Копия дорогой страницы для клиентов сверх бюджета (без личных сообщений)
+        storage = getattr(request, '_messages', None)
+        if response.status_code == 200 and actual > COST_PAGE and not getattr(storage, 'used', False):
+            cache.set(_copy_key(request), (response.content, response['Content-Type']), DEGRADED_CACHE_TIMEOUT)
+
+        return response
+
+    return wrapper
@@ -19,6 +19,9 @@ urlpatterns = [
     path('about/', views.about, name='about'),
     path('add/', views.add_star, name='add_star'),
     path('search/', views.search, name='search'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
+    path('search/index.json', views.search_index_manifest, name='search_index_manifest'),
+    path('search/index-<slug:content_hash>.json', views.search_index_file, name='search_index_file'),
 
     # Каталожные страницы - кэшируем на день
     path('country/<slug:slug>/', views.stars_by_country, name='stars_by_country'),
@@ -1,3 +1,97 @@
+import re
+from functools import lru_cache
+
+from transliterate import translit
+
+_WORD_RE = re.compile(r'\w+')
+_LATIN_RE = re.compile(r'[a-z]')
+
+# Названия месяцев в родительном падеже ("5 мая") -> номер месяца
+MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
+    'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12
+}
+
+# Буквы алфавитного указателя имен: Ё относится к Е
+NAME_LETTERS = 'АБВГДЕЖЗИЙКЛМНОПРСТУФХЦЧШЩЭЮЯ'
+
+# Длина ключа сортировки имени (Star.name_sort)
+NAME_SORT_LENGTH = 120
+
+# Частицы короче этой длины ищутся и слитно со следующим словом ("ди каприо" -> "дикаприо")
+PARTICLE_MAX_LENGTH = 3
+
+
+def normalize_text(text):
+    """Приводит строку к виду для поиска: нижний регистр, ё -> е."""
+    return (text or '').lower().replace('ё', 'е')
+
+
+def tokenize(text):
+    """Разбивает строку на нормализованные слова."""
+    return _WORD_RE.findall(normalize_text(text))
+
+
+def first_letter(text):
+    """Буква имени в алфавитном указателе: первая буква, заглавная, Ё -> Е."""
+    match = _WORD_RE.search(normalize_text(text))
+    return match.group()[0].upper() if match else ''
+
+
+def name_sort_key(text):
+    """
+    Ключ сортировки имени: слова в нижнем регистре без знаков препинания, ё -> е.
+    Первым символом идет группа - кириллица, затем латиница, затем остальное.
+    Ключ сравнивается побайтно, поэтому порядок не зависит от правил сравнения базы.
+    """
+    words = tokenize(text)
+    if not words:
+        return ''
+    first = words[0][0]
+    group = '1' if 'а' <= first <= 'я' else '2' if 'a' <= first <= 'z' else '3'
+    return (group + ' '.join(words))[:NAME_SORT_LENGTH]
+
+
+@lru_cache(maxsize=65536)
+def transliterate_text(text, to_latin=True):
+    """Транслитерация нормализованной строки (кириллица <-> латиница), слова через пробел."""
+    result = translit(text, 'ru', reversed=to_latin)
+    # Мягкий и твердый знак transliterate передает апострофом - при поиске его не набирают
+    return ' '.join(tokenize(result.replace("'", '')))
+
+
+def search_variants(text):
+    """
+    Варианты написания имени для поиска: нормализованное имя, его транслитерация
+    (латиница для кириллических имен и наоборот) и они же с частицей, слитой
+    со следующим словом ("леонардо ди каприо" -> "леонардо дикаприо").
+    """
+    name = ' '.join(tokenize(text))
+    if not name:
+        return []
+
+    variants = [name, transliterate_text(name, to_latin=not _LATIN_RE.search(name))]
+    for variant in variants[:2]:
+        words = variant.split()
+        for position in range(len(words) - 1):
+            if len(words[position]) <= PARTICLE_MAX_LENGTH:
+                merged = words[:position] + [words[position] + words[position + 1]] + words[position + 2:]
+                variants.append(' '.join(merged))
+
+    return list(dict.fromkeys(variant for variant in variants if variant))
+
+
+def build_search_name(text):
+    """Строка вариантов имени для столбца Star.search_name: '/вариант/вариант/'."""
+    variants = search_variants(text)
+    return '/' + '/'.join(variants) + '/' if variants else ''
+
+
+def split_search_name(search_name):
+    """Обратное к build_search_name: список вариантов, каждый - кортеж слов."""
+    return [tuple(variant.split()) for variant in search_name.strip('/').split('/') if variant]
+
+
 class GenitiveCountry:
     """Обертка для объекта Country, которая возвращает name_2 вместо name.
     Делегирует все остальные атрибуты и методы оригинальному объекту."""
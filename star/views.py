@@ -1,25 +1,41 @@
-import re
 from django.contrib import messages
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponseNotFound
-from django.db.models import Count, Q, F, Case, When, Value, IntegerField
+from django.http import HttpResponseNotFound, JsonResponse, FileResponse, Http404
+from django.db.models import Count, Q, F, Case, When, Value, IntegerField, Window
+from django.db.models.functions import RowNumber
 from django.core.paginator import Paginator
 from datetime import date, timedelta
 import calendar
+import hashlib
 from django.core.cache import cache
 from django.conf import settings
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.core.files.storage import default_storage
 from django.views.decorators.cache import cache_page
 from django.utils.functional import cached_property
 
-from .models import Star, Country, Category, FeedbackMessage
+from .models import Star, Country, Category, FeedbackMessage, StarCount, Tag, SimilarStars
 from .forms import StarForm, ContactForm
-from .utils import GenitiveCountry
+from .utils import GenitiveCountry, NAME_LETTERS, first_letter
+from .cache_keys import (CATALOGUE_PAGE_SIZE, TOP_LIST_SIZE, CATEGORY_TOP_SIZE, VIABLE_TAGS_LIMIT,
+                         INDEX_TODAY_LIMIT, INDEX_TOMORROW_LIMIT, ALL_COUNTRIES, ALL_CATEGORIES, CELEBRITIES,
+                         country_prefix, category_prefix, tag_prefix, birthday_prefix, page_key,
+                         top_countries_key, top_categories_key, viable_tags_category_key, viable_tags_country_key,
+                         star_detail_key, birthday_stars_key, index_page_key)
+from .throttling import throttle
+from .search_export import get_manifest, export_path
+from .search import (search_stars, search_biographies, biography_snippets, suggest_names, parse_date_query,
+                     SUGGEST_LIMIT)
 
 # Определяем константы для TTL кэша
 CACHE_DAY = 60 * 60 * 24  # 24 часа
 CACHE_WEEK = 60 * 60 * 24 * 7  # 7 дней
 CACHE_HOUR = 60 * 60  # 1 час
 
+# Сколько лидеров тега кэшируется для блоков на странице звезды (с запасом на исключения)
+TAG_PREVIEW_POOL = 20
+
 
 def get_coming_birthday_order():
     """
@@ -47,6 +63,24 @@ def get_coming_birthday_order():
     )
 
 
+def apply_sort(stars, sort_by):
+    """
+    Применяет к списку знаменитостей сортировку из параметра sort.
+    Порядок совпадает с частичными индексами star_pub_*_idx (id - для стабильной пагинации).
+    """
+    if sort_by == 'rating':
+        return stars.order_by('-rating', 'id')
+    if sort_by == 'name_asc':
+        return stars.order_by('name_sort', 'id')
+    if sort_by == 'name_desc':
+        return stars.order_by('-name_sort', '-id')
+    if sort_by == 'birthday':
+        # Сортировка по ближайшему дню рождения
+        coming_birthday_days = get_coming_birthday_order()
+        return stars.annotate(days_until_birthday=coming_birthday_days).order_by('days_until_birthday', 'id')
+    return stars
+
+
 def get_calendar_days(year, month):
     """
     Генерирует календарные дни для отображения в мини-календаре.
@@ -116,7 +150,7 @@ def get_page_range(paginator, page, on_each_side=2, on_ends=1):
 def check_tag_viability(category_slug, country_slug):
     """
     Проверяет, содержит ли виртуальная категория достаточное количество знаменитостей.
-    Результат кэшируется.
+    Читает реестр тегов, результат кэшируется.
     """
     cache_key = f'tag_viability_{category_slug}_{country_slug}'
     cached_result = cache.get(cache_key)
@@ -124,58 +158,42 @@ def check_tag_viability(category_slug, country_slug):
     if cached_result is not None:
         return cached_result
 
-    try:
-        category = Category.objects.get(slug=category_slug)
-        country = Country.objects.get(slug=country_slug)
+    result = Tag.objects.filter(
+        category__slug=category_slug,
+        country__slug=country_slug
+    ).exists()
 
-        count = Star.objects.filter(
-            is_published=True,
-            categories=category,
-            countries=country
-        ).count()
-
-        result = count >= 10
-        # Кэшируем результат на неделю
-        cache.set(cache_key, result, CACHE_WEEK)
-        return result
-    except (Category.DoesNotExist, Country.DoesNotExist):
-        return False
+    # Кэшируем результат на неделю
+    cache.set(cache_key, result, CACHE_WEEK)
+    return result
 
 
 def get_viable_tags(category, limit=None):
     """
     Возвращает список жизнеспособных виртуальных категорий для данной категории.
-    Результат кэшируется.
+    Читает реестр тегов, результат кэшируется.
     """
-    cache_key = f'viable_tags_category_{category.id}_{limit}'
+    cache_key = viable_tags_category_key(category.id, limit)
     cached_result = cache.get(cache_key)
 
     if cached_result is not None:
         return cached_result
 
-    viable_tags = []
-    countries = Country.objects.all()
-
-    for country in countries:
-        count = Star.objects.filter(
-            is_published=True,
-            categories=category,
-            countries=country
-        ).count()
-
-        if count >= 10:
-            viable_tags.append({
-                'slug': f"{category.slug}-{country.slug}",
-                'name': country.name,
-                'count': count
-            })
-
-    # Сортируем по количеству знаменитостей
-    viable_tags.sort(key=lambda x: x['count'], reverse=True)
+    # Сразу сортируем по количеству знаменитостей
+    tags = Tag.objects.filter(category=category).select_related('country').order_by('-count')
 
     # Ограничиваем, если нужно
-    if limit and len(viable_tags) > limit:
-        viable_tags = viable_tags[:limit]
+    if limit:
+        tags = tags[:limit]
+
+    viable_tags = [
+        {
+            'slug': tag_obj.slug,
+            'name': tag_obj.country.name,
+            'count': tag_obj.count
+        }
+        for tag_obj in tags
+    ]
 
     # Кэшируем результат на день
     cache.set(cache_key, viable_tags, CACHE_DAY)
@@ -186,38 +204,30 @@ def get_viable_tags(category, limit=None):
 def get_viable_country_tags(country, limit=None):
     """
     Возвращает список жизнеспособных виртуальных категорий для данной страны.
-    Результат кэшируется.
+    Читает реестр тегов, результат кэшируется.
     """
-    cache_key = f'viable_tags_country_{country.id}_{limit}'
+    cache_key = viable_tags_country_key(country.id, limit)
     cached_result = cache.get(cache_key)
 
     if cached_result is not None:
         return cached_result
 
-    viable_tags = []
-    categories = Category.objects.all()
-
-    for category in categories:
-        count = Star.objects.filter(
-            is_published=True,
-            categories=category,
-            countries=country
-        ).count()
-
-        if count >= 10:
-            viable_tags.append({
-                'slug': f"{category.slug}-{country.slug}",
-                'title': category.title,
-                'name': category.title,  # Добавляем для совместимости с шаблоном
-                'count': count
-            })
-
-    # Сортируем по количеству знаменитостей
-    viable_tags.sort(key=lambda x: x['count'], reverse=True)
+    # Сразу сортируем по количеству знаменитостей
+    tags = Tag.objects.filter(country=country).select_related('category').order_by('-count')
 
     # Ограничиваем, если нужно
-    if limit and len(viable_tags) > limit:
-        viable_tags = viable_tags[:limit]
+    if limit:
+        tags = tags[:limit]
+
+    viable_tags = [
+        {
+            'slug': tag_obj.slug,
+            'title': tag_obj.category.title,
+            'name': tag_obj.category.title,  # Добавляем для совместимости с шаблоном
+            'count': tag_obj.count
+        }
+        for tag_obj in tags
+    ]
 
     # Кэшируем результат на день
     cache.set(cache_key, viable_tags, CACHE_DAY)
@@ -225,23 +235,31 @@ def get_viable_country_tags(country, limit=None):
     return viable_tags
 
 
-def get_top_countries(count=20, exclude_id=None):
+def get_top_countries(count=TOP_LIST_SIZE, exclude_id=None):
     """
-    Возвращает топ стран по количеству знаменитостей.
-    Результат кэшируется.
+    Возвращает топ стран по количеству опубликованных знаменитостей.
+    Читает таблицу счетчиков, результат кэшируется.
     """
-    cache_key = f'top_countries_{count}_{exclude_id}'
+    cache_key = top_countries_key(count, exclude_id)
     cached_result = cache.get(cache_key)
 
     if cached_result is not None:
         return cached_result
 
-    query = Country.objects.annotate(star_count=Count('stars')).order_by('-star_count')
+    rows = StarCount.objects.filter(
+        category__isnull=True,
+        country__isnull=False,
+        count__gt=0
+    ).select_related('country').order_by('-count')
 
     if exclude_id:
-        query = query.exclude(id=exclude_id)
+        rows = rows.exclude(country_id=exclude_id)
 
-    top_countries = list(query[:count])
+    # Шаблоны ожидают объекты Country с атрибутом star_count
+    top_countries = []
+    for row in rows[:count]:
+        row.country.star_count = row.count
+        top_countries.append(row.country)
 
     # Кэшируем на день
     cache.set(cache_key, top_countries, CACHE_DAY)
@@ -249,23 +267,31 @@ def get_top_countries(count=20, exclude_id=None):
     return top_countries
 
 
-def get_top_categories(count=10, exclude_id=None):
+def get_top_categories(count=CATEGORY_TOP_SIZE, exclude_id=None):
     """
-    Возвращает топ категорий по количеству знаменитостей.
-    Результат кэшируется.
+    Возвращает топ категорий по количеству опубликованных знаменитостей.
+    Читает таблицу счетчиков, результат кэшируется.
     """
-    cache_key = f'top_categories_{count}_{exclude_id}'
+    cache_key = top_categories_key(count, exclude_id)
     cached_result = cache.get(cache_key)
 
     if cached_result is not None:
         return cached_result
 
-    query = Category.objects.annotate(star_count=Count('stars')).order_by('-star_count')
+    rows = StarCount.objects.filter(
+        country__isnull=True,
+        category__isnull=False,
+        count__gt=0
+    ).select_related('category').order_by('-count')
 
     if exclude_id:
-        query = query.exclude(id=exclude_id)
+        rows = rows.exclude(category_id=exclude_id)
 
-    top_categories = list(query[:count])
+    # Шаблоны ожидают объекты Category с атрибутом star_count
+    top_categories = []
+    for row in rows[:count]:
+        row.category.star_count = row.count
+        top_categories.append(row.category)
 
     # Кэшируем на день
     cache.set(cache_key, top_categories, CACHE_DAY)
@@ -273,12 +299,165 @@ def get_top_categories(count=10, exclude_id=None):
     return top_categories
 
 
+def get_facet_counts(country_id=None, category_id=None, text_stars=None, text_key=''):
+    """
+    Счетчики для фильтров: сколько знаменитостей будет найдено при выборе каждой страны
+    и каждой категории с учетом остальных фильтров (фильтр по самому измерению не учитывается).
+    Без текстового фильтра счетчики берутся из таблицы StarCount, с ним - одним агрегатным
+    запросом по найденным знаменитостям (text_stars). Кэшируется по набору фильтров;
+    text_key начинается с источника текста (search: или filter:), чтобы ключи не совпадали.
+    Возвращает ({id страны: количество}, {id категории: количество}).
+    """
+    text_hash = hashlib.md5(text_key.encode()).hexdigest() if text_stars is not None else ''
+    cache_key = f'facets_{country_id}_{category_id}_{text_hash}'
+    cached_result = cache.get(cache_key)
+
+    if cached_result is not None:
+        return cached_result
+
+    country_counts = {}
+    category_counts = {}
+
+    if text_stars is None:
+        # Страны при выбранной категории (или общие счетчики стран) и категории при выбранной стране
+        rows = StarCount.objects.filter(count__gt=0).filter(
+            Q(country__isnull=False, category_id=category_id) if category_id
+            else Q(country__isnull=False, category__isnull=True)
+        ) | StarCount.objects.filter(count__gt=0).filter(
+            Q(category__isnull=False, country_id=country_id) if country_id
+            else Q(category__isnull=False, country__isnull=True)
+        )
+        for row_category_id, row_country_id, count in rows.values_list('category_id', 'country_id', 'count'):
+            if row_country_id is not None and row_category_id == category_id:
+                country_counts[row_country_id] = count
+            if row_category_id is not None and row_country_id == country_id:
+                category_counts[row_category_id] = count
+    else:
+        country_stars = text_stars.filter(categories=category_id) if category_id else text_stars
+        category_stars = text_stars.filter(countries=country_id) if country_id else text_stars
+
+        by_country = Star.countries.through.objects.filter(
+            star_id__in=country_stars.values('id')
+        ).values('country_id').annotate(
+            facet=Value(0), star_count=Count('star_id')
+        ).values_list('facet', 'country_id', 'star_count')
+        by_category = Star.categories.through.objects.filter(
+            star_id__in=category_stars.values('id')
+        ).values('category_id').annotate(
+            facet=Value(1), star_count=Count('star_id')
+        ).values_list('facet', 'category_id', 'star_count')
+
+        for facet, related_id, count in by_country.union(by_category, all=True):
+            if facet == 0:
+                country_counts[related_id] = count
+            else:
+                category_counts[related_id] = count
+
+    result = (country_counts, category_counts)
+
+    # Кэшируем на час
+    cache.set(cache_key, result, CACHE_HOUR)
+
+    return result
+
+
+def apply_facets(objects, counts, selected_slug=None):
+    """Оставляет варианты фильтра с ненулевым счетчиком (и выбранный) и проставляет им facet_count."""
+    result = []
+    for obj in objects:
+        count = counts.get(obj.id, 0)
+        if count or obj.slug == selected_slug:
+            obj.facet_count = count
+            result.append(obj)
+    return result
+
+
+def name_filter_facet(name_filter):
+    """Аргументы get_facet_counts для фильтра по имени на каталожных страницах."""
+    if not name_filter:
+        return None, ''
+    return Star.objects.filter(is_published=True, name__icontains=name_filter), f'filter:{name_filter}'
+
+
+def get_tag_preview_stars(tags):
+    """
+    Возвращает {tag.id: [звезды]} - лидеров по рейтингу для каждого тега.
+    Списки общие для всех страниц и кэшируются по паре категория-страна;
+    недостающие загружаются одним оконным запросом.
+    """
+    cache_keys = {
+        tag_obj.id: f'tag_preview_category_{tag_obj.category_id}_country_{tag_obj.country_id}'
+        for tag_obj in tags
+    }
+    cached = cache.get_many(list(cache_keys.values()))
+
+    result = {}
+    missing = {}
+    for tag_obj in tags:
+        key = cache_keys[tag_obj.id]
+        if key in cached:
+            result[tag_obj.id] = cached[key]
+        else:
+            missing[(tag_obj.category_id, tag_obj.country_id)] = tag_obj
+
+    if missing:
+        pairs_q = Q()
+        for category_id, country_id in missing:
+            pairs_q |= Q(categories=category_id, countries=country_id)
+
+        # Нумеруем звезды внутри каждой пары по рейтингу и берем первые TAG_PREVIEW_POOL
+        ranked = Star.objects.filter(pairs_q, is_published=True).annotate(
+            preview_category=F('categories'),
+            preview_country=F('countries'),
+            preview_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('categories'), F('countries')],
+                order_by=[F('rating').desc(), F('id').asc()]
+            )
+        ).filter(preview_rank__lte=TAG_PREVIEW_POOL).only('id', 'name', 'slug', 'rating')
+
+        loaded = {pair: [] for pair in missing}
+        for preview_star in ranked.order_by('preview_rank'):
+            pair = (preview_star.preview_category, preview_star.preview_country)
+            if pair in loaded:
+                loaded[pair].append(preview_star)
+
+        to_cache = {}
+        for pair, preview_stars in loaded.items():
+            tag_obj = missing[pair]
+            result[tag_obj.id] = preview_stars
+            to_cache[cache_keys[tag_obj.id]] = preview_stars
+
+        # Кэшируем на день
+        cache.set_many(to_cache, CACHE_DAY)
+
+    return result
+
+
+def get_similar_stars(star, exclude_ids=(), limit=6):
+    """
+    Возвращает похожих знаменитостей по предрассчитанному списку
+    (команда compute_similar_stars), сохраняя порядок по похожести.
+    """
+    neighbour_ids = SimilarStars.objects.filter(star=star).values_list('neighbour_ids', flat=True).first()
+    if not neighbour_ids:
+        return []
+
+    neighbour_ids = [star_id for star_id in neighbour_ids if star_id not in exclude_ids]
+    stars = Star.objects.filter(id__in=neighbour_ids, is_published=True).only(
+        'id', 'name', 'slug', 'rating', 'birth_date', 'death_date', 'photo'
+    )
+    stars_by_id = {similar_star.id: similar_star for similar_star in stars}
+
+    return [stars_by_id[star_id] for star_id in neighbour_ids if star_id in stars_by_id][:limit]
+
+
 def get_birthday_stars(month, day, year=None, limit=None):
     """
     Возвращает звезд с днем рождения в указанную дату.
     Результат кэшируется.
     """
-    cache_key = f'birthday_stars_{month}_{day}_{year}_{limit}'
+    cache_key = birthday_stars_key(month, day, year, limit)
     cached_result = cache.get(cache_key)
 
     if cached_result is not None:
@@ -310,7 +489,7 @@ def index(request):
     """Главная страница сайта с кэшированием."""
     # Кэш ключ для всей страницы
     today = date.today()
-    cache_key = f'index_page_{today.month}_{today.day}'
+    cache_key = index_page_key(today.month, today.day)
     cached_context = cache.get(cache_key)
 
     if cached_context is not None:
@@ -320,8 +499,8 @@ def index(request):
     tomorrow = today + timedelta(days=1)
 
     # Находим звезд с днями рождения сегодня и завтра через кэширующую функцию
-    today_stars = get_birthday_stars(today.month, today.day, limit=12)
-    tomorrow_stars = get_birthday_stars(tomorrow.month, tomorrow.day, limit=8)
+    today_stars = get_birthday_stars(today.month, today.day, limit=INDEX_TODAY_LIMIT)
+    tomorrow_stars = get_birthday_stars(tomorrow.month, tomorrow.day, limit=INDEX_TOMORROW_LIMIT)
 
     # Создаем контекст
     context = {
@@ -343,7 +522,7 @@ def index(request):
 def star_detail(request, slug):
     """Детальная страница звезды с кэшированием."""
     # Кэш ключ для страницы звезды
-    cache_key = f'star_detail_{slug}'
+    cache_key = star_detail_key(slug)
     cached_context = cache.get(cache_key)
 
     if cached_context is not None:
@@ -359,77 +538,60 @@ def star_detail(request, slug):
     # Сет для хранения ID звезд, которые уже были добавлены в блоки
     used_star_ids = {star.id}  # Добавляем текущую звезду, чтобы исключить ее
 
-    # Находим популярные виртуальные категории для этой звезды
+    # Все жизнеспособные теги для комбинаций категорий и стран звезды - одним запросом
+    star_tags = list(Tag.objects.filter(
+        category__in=[category.id for category in star.categories.all()],
+        country__in=[country.id for country in star.countries.all()]
+    ).select_related('category', 'country').order_by('-count'))
+
+    # Общие для всех звезд списки лидеров тегов; исключение применяем в памяти
+    preview_lists = get_tag_preview_stars(star_tags)
+
+    # Находим популярные виртуальные категории для этой звезды, начиная с самых крупных
     popular_tag_blocks = []
 
-    # Проверяем все комбинации категорий и стран звезды
-    for category in star.categories.all():
-        for country in star.countries.all():
+    for tag_obj in star_tags:
+        # Фильтруем, оставляя только не использованные ранее звезды
+        unique_preview_stars = []
+        for preview_star in preview_lists.get(tag_obj.id, []):
+            if preview_star.id not in used_star_ids and len(unique_preview_stars) < 5:
+                unique_preview_stars.append(preview_star)
+                used_star_ids.add(preview_star.id)
+
+        # Если осталось хотя бы 3 уникальных звезды, создаем блок
+        if len(unique_preview_stars) >= 3:
             # Создаем обертку для отображения в название блока
-            genitive_country = GenitiveCountry(country)
-
-            # Ключ кэша для количества знаменитостей
-            count_cache_key = f'star_count_category_{category.id}_country_{country.id}'
-            count = cache.get(count_cache_key)
-
-            if count is None:
-                count = Star.objects.filter(
-                    is_published=True,
-                    categories=category,
-                    countries=country
-                ).count()
-                cache.set(count_cache_key, count, CACHE_DAY)
-
-            # Если знаменитостей достаточно, добавляем блок
-            if count >= 10:
-                # Ключ кэша для предпросмотра звезд
-                preview_cache_key = f'preview_stars_category_{category.id}_country_{country.id}_exclude_{star.id}'
-                preview_stars = cache.get(preview_cache_key)
-
-                if preview_stars is None:
-                    # Получаем примеры звезд для предпросмотра
-                    preview_stars = list(Star.objects.filter(
-                        is_published=True,
-                        categories=category,
-                        countries=country
-                    ).exclude(id__in=used_star_ids).order_by('-rating')[:10])
-                    cache.set(preview_cache_key, preview_stars, CACHE_DAY)
-
-                # Фильтруем, оставляя только не использованные ранее звезды
-                unique_preview_stars = []
-                for preview_star in preview_stars:
-                    if preview_star.id not in used_star_ids and len(unique_preview_stars) < 5:
-                        unique_preview_stars.append(preview_star)
-                        used_star_ids.add(preview_star.id)
-
-                # Если осталось хотя бы 3 уникальных звезды, создаем блок
-                if len(unique_preview_stars) >= 3:
-                    popular_tag_blocks.append({
-                        'slug': f"{category.slug}-{country.slug}",
-                        'title': f"{category.title} из {genitive_country.name}",
-                        'count': count,
-                        'stars': unique_preview_stars
-                    })
-
-    # Сортируем блоки по количеству знаменитостей и берем топ-3
-    popular_tag_blocks.sort(key=lambda x: x['count'], reverse=True)
-    popular_tag_blocks = popular_tag_blocks[:3]
+            genitive_country = GenitiveCountry(tag_obj.country)
+            popular_tag_blocks.append({
+                'slug': tag_obj.slug,
+                'title': f"{tag_obj.category.title} из {genitive_country.name}",
+                'count': tag_obj.count,
+                'stars': unique_preview_stars
+            })
+
+            # Показываем не больше трех блоков
+            if len(popular_tag_blocks) == 3:
+                break
+
+    # Похожие знаменитости из офлайн-расчета, без повторов из блоков тегов
+    similar_stars = get_similar_stars(star, exclude_ids=used_star_ids)
 
     # Получаем все страны и категории для формы фильтра через кэширующие функции
-    countries = cache.get('all_countries')
+    countries = cache.get(ALL_COUNTRIES)
     if countries is None:
         countries = list(Country.objects.all())
-        cache.set('all_countries', countries, CACHE_DAY)
+        cache.set(ALL_COUNTRIES, countries, CACHE_DAY)
 
-    categories = cache.get('all_categories')
+    categories = cache.get(ALL_CATEGORIES)
     if categories is None:
         categories = list(Category.objects.all())
-        cache.set('all_categories', categories, CACHE_DAY)
+        cache.set(ALL_CATEGORIES, categories, CACHE_DAY)
 
     # Создаем контекст
     context = {
         'star': star,
         'popular_tag_blocks': popular_tag_blocks,
+        'similar_stars': similar_stars,
         'countries': countries,
         'categories': categories,
         'title': f"{star.name} - биография и день рождения",
@@ -473,10 +635,11 @@ def about(request):
     return render(request, 'star/about.html', context)
 
 
+@throttle
 def stars_by_country(request, slug):
     """Страница знаменитостей по стране с кэшированием."""
     # Базовый кэш-ключ для страницы
-    base_cache_key = f'country_{slug}'
+    base_cache_key = country_prefix(slug)
 
     # Получаем параметры сортировки и фильтрации
     sort_by = request.GET.get('sort', 'birthday')
@@ -488,7 +651,7 @@ def stars_by_country(request, slug):
     # Если есть фильтры, не используем базовый кэш
     if not (name_filter or country_filter or category_filter):
         # Полный кэш-ключ включает параметры сортировки и страницы
-        cache_key = f'{base_cache_key}_{sort_by}_page{page_number}'
+        cache_key = page_key(base_cache_key, page_number, sort_by)
         cached_context = cache.get(cache_key)
 
         if cached_context is not None:
@@ -508,39 +671,38 @@ def stars_by_country(request, slug):
         stars = stars.filter(categories=category)
 
     # Применяем сортировку
-    if sort_by == 'rating':
-        stars = stars.order_by('-rating')
-    elif sort_by == 'name_asc':
-        stars = stars.order_by('name')
-    elif sort_by == 'name_desc':
-        stars = stars.order_by('-name')
-    elif sort_by == 'birthday':
-        # Сортировка по ближайшему дню рождения
-        coming_birthday_days = get_coming_birthday_order()
-        stars = stars.annotate(days_until_birthday=coming_birthday_days).order_by('days_until_birthday')
+    stars = apply_sort(stars, sort_by)
 
     # Получаем ТОП-10 виртуальных категорий для этой страны через кэш
-    viable_tags = get_viable_country_tags(country_obj, limit=10)
+    viable_tags = get_viable_country_tags(country_obj, limit=VIABLE_TAGS_LIMIT)
     top_categories = viable_tags
 
     # Получаем другие популярные страны через кэш
-    top_countries = get_top_countries(count=20, exclude_id=country_obj.id)
+    top_countries = get_top_countries(count=TOP_LIST_SIZE, exclude_id=country_obj.id)
 
     # Пагинация
-    paginator = Paginator(stars, 20)  # По 20 знаменитостей на страницу
+    paginator = Paginator(stars, CATALOGUE_PAGE_SIZE)
     page_obj = paginator.get_page(page_number)
     page_range = get_page_range(paginator, page_obj)
 
     # Получаем все страны и категории для фильтров через кэш
-    all_countries = cache.get('all_countries')
+    all_countries = cache.get(ALL_COUNTRIES)
     if all_countries is None:
         all_countries = list(Country.objects.all())
-        cache.set('all_countries', all_countries, CACHE_DAY)
+        cache.set(ALL_COUNTRIES, all_countries, CACHE_DAY)
 
-    all_categories = cache.get('all_categories')
+    all_categories = cache.get(ALL_CATEGORIES)
     if all_categories is None:
         all_categories = list(Category.objects.all())
-        cache.set('all_categories', all_categories, CACHE_DAY)
+        cache.set(ALL_CATEGORIES, all_categories, CACHE_DAY)
+
+    # Счетчики для фильтров: пустые варианты скрываются
+    country_counts, category_counts = get_facet_counts(
+        country_obj.id, category.id if category_filter else None,
+        *name_filter_facet(name_filter)
+    )
+    all_countries = apply_facets(all_countries, country_counts, country_obj.slug)
+    all_categories = apply_facets(all_categories, category_counts, category_filter)
 
     # Создаем обертку для отображения в шаблоне
     country = GenitiveCountry(country_obj)
@@ -571,10 +733,11 @@ def stars_by_country(request, slug):
     return render(request, 'star/country.html', context)
 
 
+@throttle
 def stars_by_category(request, slug):
     """Страница знаменитостей по категории с кэшированием."""
     # Базовый кэш-ключ для страницы
-    base_cache_key = f'category_{slug}'
+    base_cache_key = category_prefix(slug)
 
     # Получаем параметры сортировки и фильтрации
     sort_by = request.GET.get('sort', 'birthday')
@@ -586,7 +749,7 @@ def stars_by_category(request, slug):
     # Если есть фильтры, не используем базовый кэш
     if not (name_filter or country_filter or category_filter):
         # Полный кэш-ключ включает параметры сортировки и страницы
-        cache_key = f'{base_cache_key}_{sort_by}_page{page_number}'
+        cache_key = page_key(base_cache_key, page_number, sort_by)
         cached_context = cache.get(cache_key)
 
         if cached_context is not None:
@@ -606,39 +769,38 @@ def stars_by_category(request, slug):
         stars = stars.filter(countries=country)
 
     # Применяем сортировку
-    if sort_by == 'rating':
-        stars = stars.order_by('-rating')
-    elif sort_by == 'name_asc':
-        stars = stars.order_by('name')
-    elif sort_by == 'name_desc':
-        stars = stars.order_by('-name')
-    elif sort_by == 'birthday':
-        # Сортировка по ближайшему дню рождения
-        coming_birthday_days = get_coming_birthday_order()
-        stars = stars.annotate(days_until_birthday=coming_birthday_days).order_by('days_until_birthday')
+    stars = apply_sort(stars, sort_by)
 
     # Получаем жизнеспособные теги для этой категории через кэш
-    viable_tags = get_viable_tags(category, limit=10)
+    viable_tags = get_viable_tags(category, limit=VIABLE_TAGS_LIMIT)
     top_countries = viable_tags
 
     # Получаем другие популярные категории через кэш
-    top_categories = get_top_categories(count=10, exclude_id=category.id)
+    top_categories = get_top_categories(count=CATEGORY_TOP_SIZE, exclude_id=category.id)
 
     # Пагинация
-    paginator = Paginator(stars, 20)
+    paginator = Paginator(stars, CATALOGUE_PAGE_SIZE)
     page_obj = paginator.get_page(page_number)
     page_range = get_page_range(paginator, page_obj)
 
     # Получаем все страны и категории для фильтров через кэш
-    all_countries = cache.get('all_countries')
+    all_countries = cache.get(ALL_COUNTRIES)
     if all_countries is None:
         all_countries = list(Country.objects.all())
-        cache.set('all_countries', all_countries, CACHE_DAY)
+        cache.set(ALL_COUNTRIES, all_countries, CACHE_DAY)
 
-    all_categories = cache.get('all_categories')
+    all_categories = cache.get(ALL_CATEGORIES)
     if all_categories is None:
         all_categories = list(Category.objects.all())
-        cache.set('all_categories', all_categories, CACHE_DAY)
+        cache.set(ALL_CATEGORIES, all_categories, CACHE_DAY)
+
+    # Счетчики для фильтров: пустые варианты скрываются
+    country_counts, category_counts = get_facet_counts(
+        country.id if country_filter else None, category.id,
+        *name_filter_facet(name_filter)
+    )
+    all_countries = apply_facets(all_countries, country_counts, country_filter)
+    all_categories = apply_facets(all_categories, category_counts, category.slug)
 
     # Составляем контекст
     context = {
@@ -684,8 +846,8 @@ def add_star(request):
                 today = date.today()
                 if star.birth_date.month == today.month and star.birth_date.day == today.day:
                     # Очищаем кэш именинников сегодня
-                    cache.delete(f'index_page_{today.month}_{today.day}')
-                    cache.delete(f'birthday_stars_{today.month}_{today.day}_None_None')
+                    cache.delete(index_page_key(today.month, today.day))
+                    cache.delete(birthday_stars_key(today.month, today.day))
 
                 # ЗАМЕНЯЕМ НА:
                 # Очищаем кэш категорий и стран
@@ -693,26 +855,26 @@ def add_star(request):
                 # Очищаем общие ключи
                 cache.delete('site_stats')
                 cache.delete('star_count')
-                cache.delete(f'index_page_{today.month}_{today.day}')
-                cache.delete(f'birthday_stars_{today.month}_{today.day}_None_None')
-                cache.delete('all_countries')
-                cache.delete('all_categories')
-                cache.delete('celebrities_rating_page1')
-                cache.delete('celebrities_birthday_page1')
+                cache.delete(index_page_key(today.month, today.day))
+                cache.delete(birthday_stars_key(today.month, today.day))
+                cache.delete(ALL_COUNTRIES)
+                cache.delete(ALL_CATEGORIES)
+                cache.delete(page_key(CELEBRITIES, 1, 'rating'))
+                cache.delete(page_key(CELEBRITIES, 1, 'birthday'))
 
                 # Очищаем кэш для категорий
                 for category in star.categories.all():
-                    cache.delete(f'category_{category.slug}')
-                    cache.delete(f'category_{category.slug}_birthday_page1')
-                    cache.delete(f'category_{category.slug}_rating_page1')
-                    cache.delete(f'viable_tags_category_{category.id}_10')
+                    cache.delete(category_prefix(category.slug))
+                    cache.delete(page_key(category_prefix(category.slug), 1, 'birthday'))
+                    cache.delete(page_key(category_prefix(category.slug), 1, 'rating'))
+                    cache.delete(viable_tags_category_key(category.id, VIABLE_TAGS_LIMIT))
 
                 # Очищаем кэш для стран
                 for country in star.countries.all():
-                    cache.delete(f'country_{country.slug}')
-                    cache.delete(f'country_{country.slug}_birthday_page1')
-                    cache.delete(f'country_{country.slug}_rating_page1')
-                    cache.delete(f'viable_tags_country_{country.id}_10')
+                    cache.delete(country_prefix(country.slug))
+                    cache.delete(page_key(country_prefix(country.slug), 1, 'birthday'))
+                    cache.delete(page_key(country_prefix(country.slug), 1, 'rating'))
+                    cache.delete(viable_tags_country_key(country.id, VIABLE_TAGS_LIMIT))
 
             messages.success(request,
                              f'Знаменитость "{star.name}" успешно добавлена и будет опубликована после модерации!')
@@ -727,28 +889,35 @@ def add_star(request):
     return render(request, 'star/add-star.html', context)
 
 
+@throttle
 def search(request):
     """Представление для поиска знаменитостей - кэшируем только популярные страны и категории."""
     query = request.GET.get('q', '')
     country_filter = request.GET.get('country', '')
     category_filter = request.GET.get('category', '')
-
-    # Базовый набор знаменитостей
+    # Где искать: по имени или по биографии
+    scope = 'bio' if request.GET.get('scope') == 'bio' else 'name'
+
+    # Запрос-дата: день и месяц ведут на страницу дней рождения, год - к выборке по дате рождения
+    date_query = parse_date_query(query) if scope == 'name' else None
+    if date_query and date_query.day:
+        url = reverse('birthday', kwargs={'month': date_query.month, 'day': date_query.day})
+        if date_query.year:
+            url += f'?year={date_query.year}'
+        return redirect(url)
+
+    # Текстовый поиск по индексу имен или по биографиям: сортировка по релевантности, затем по рейтингу
     stars = Star.objects.filter(is_published=True)
-
-    # Применяем текстовый поиск если указан
-    if query:
-        # Разбиваем запрос на отдельные слова
-        query_words = query.split()
-        q_objects = Q()
-
-        # Создаем OR запрос для каждого слова в имени
-        for word in query_words:
-            # Используем регулярное выражение для поиска без учета регистра
-            word_regex = r'(?i)' + re.escape(word)
-            q_objects |= Q(name__regex=word_regex)
-
-        stars = stars.filter(q_objects)
+    if date_query:
+        stars = stars.filter(birth_date__range=date_query.date_range()).order_by('-rating')
+    elif query.strip() and scope == 'bio':
+        stars = search_biographies(stars, query)
+    elif query.strip():
+        stars = search_stars(stars, query)
+    else:
+        stars = stars.order_by('-rating')
+    # Найденные без учета фильтров - для счетчиков в фильтрах
+    text_stars = stars if date_query or query.strip() else None
 
     # Применяем фильтр по стране если указан
     if country_filter:
@@ -760,12 +929,9 @@ def search(request):
         category = get_object_or_404(Category, slug=category_filter)
         stars = stars.filter(categories=category)
 
-    # Сортировка результатов
-    stars = stars.distinct().order_by('-rating')
-
     # Кэшированное получение ТОП-20 стран и категорий для сайдбара
-    top_countries = get_top_countries(count=20)
-    top_categories = get_top_categories(count=20)
+    top_countries = get_top_countries(count=TOP_LIST_SIZE)
+    top_categories = get_top_categories(count=TOP_LIST_SIZE)
 
     # Пагинация
     paginator = Paginator(stars, 20)
@@ -773,25 +939,42 @@ def search(request):
     page_obj = paginator.get_page(page_number)
     page_range = get_page_range(paginator, page_obj)
 
+    # Фрагменты биографий с подсветкой - только для звезд текущей страницы
+    if query.strip() and scope == 'bio':
+        snippets = biography_snippets([star.id for star in page_obj], query)
+        for star in page_obj:
+            star.snippet = snippets.get(star.id)
+
     # Получаем все страны и категории для фильтров через кэш
-    all_countries = cache.get('all_countries')
+    all_countries = cache.get(ALL_COUNTRIES)
     if all_countries is None:
         all_countries = list(Country.objects.all())
-        cache.set('all_countries', all_countries, CACHE_DAY)
+        cache.set(ALL_COUNTRIES, all_countries, CACHE_DAY)
 
-    all_categories = cache.get('all_categories')
+    all_categories = cache.get(ALL_CATEGORIES)
     if all_categories is None:
         all_categories = list(Category.objects.all())
-        cache.set('all_categories', all_categories, CACHE_DAY)
+        cache.set(ALL_CATEGORIES, all_categories, CACHE_DAY)
+
+    # Счетчики для фильтров по найденным знаменитостям: пустые варианты скрываются
+    country_counts, category_counts = get_facet_counts(
+        country.id if country_filter else None,
+        category.id if category_filter else None,
+        text_stars, f'search:{scope}:{query.strip()}'
+    )
+    all_countries = apply_facets(all_countries, country_counts, country_filter)
+    all_categories = apply_facets(all_categories, category_counts, category_filter)
 
     context = {
         'stars': page_obj,
         'query': query,
+        'scope': scope,
+        'date_title': date_query.title() if date_query else None,
         'country_filter': country_filter,
         'category_filter': category_filter,
         'top_countries': top_countries,
         'top_categories': top_categories,
-        'total_count': stars.count(),
+        'total_count': paginator.count,
         'title': f'Поиск: {query}' if query else 'Поиск',
         'page_range': page_range,
         'all_countries': all_countries,
@@ -800,6 +983,58 @@ def search(request):
     return render(request, 'star/search.html', context)
 
 
+def search_suggest(request):
+    """Подсказки для строки поиска в JSON - из префиксного индекса в памяти, без запросов к базе."""
+    query = request.GET.get('q', '')
+    try:
+        limit = max(1, int(request.GET.get('limit', SUGGEST_LIMIT)))
+    except ValueError:
+        limit = SUGGEST_LIMIT
+
+    results = [
+        {'name': name, 'url': reverse('star_detail', args=[slug])}
+        for name, slug in suggest_names(query, limit)
+    ]
+    response = JsonResponse({'query': query, 'results': results})
+    # Браузер переиспользует ответы при повторном наборе того же префикса
+    patch_cache_control(response, public=True, max_age=300)
+    return response
+
+
+def search_index_manifest(request):
+    """Манифест снимка индекса имен для поиска в браузере: хэш, адрес файла и размер."""
+    manifest = get_manifest()
+    if manifest is None:
+        response = JsonResponse({'error': 'Индекс еще не собран'}, status=503)
+        response['Retry-After'] = '60'
+        return response
+
+    response = JsonResponse({
+        'format': manifest['format'],
+        'hash': manifest['hash'],
+        'url': reverse('search_index_file', args=[manifest['hash']]),
+        'count': manifest['count'],
+        'size': manifest['size'],
+        'built': manifest['built'],
+    })
+    patch_cache_control(response, public=True, max_age=300)
+    return response
+
+
+def search_index_file(request, content_hash):
+    """Файл снимка по хэшу содержимого - неизменяемый, кэшируется браузером на год."""
+    path = export_path(content_hash)
+    if not default_storage.exists(path):
+        raise Http404('Снимок индекса не найден')
+
+    # Браузер сам распакует gzip и получит JSON
+    response = FileResponse(default_storage.open(path, 'rb'), content_type='application/json')
+    response['Content-Encoding'] = 'gzip'
+    response['ETag'] = f'"{content_hash}"'
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    return response
+
+
 def birthday(request, month=None, day=None):
     """Страница с именинниками за определенную дату с кэшированием."""
     today = date.today()
@@ -813,7 +1048,7 @@ def birthday(request, month=None, day=None):
         day = today.day
 
     # Формируем кэш-ключ
-    cache_key = f'birthday_{month}_{day}_{year_filter}_page{page_number}'
+    cache_key = page_key(birthday_prefix(month, day, year_filter), page_number)
     cached_context = cache.get(cache_key)
 
     if cached_context is not None:
@@ -839,7 +1074,7 @@ def birthday(request, month=None, day=None):
     calendar_weeks = get_calendar_days(today.year, int(month))
 
     # Пагинация
-    paginator = Paginator(stars, 20)  # По 20 знаменитостей на страницу
+    paginator = Paginator(stars, CATALOGUE_PAGE_SIZE)
     page_obj = paginator.get_page(page_number)
     page_range = get_page_range(paginator, page_obj)
 
@@ -920,10 +1155,11 @@ def dates(request):
     return render(request, 'star/dates.html', context)
 
 
+@throttle
 def celebrities(request):
     """Страница со всеми знаменитостями с кэшированием."""
     # Базовый кэш-ключ для страницы
-    base_cache_key = 'celebrities'
+    base_cache_key = CELEBRITIES
 
     # Получаем параметры сортировки и фильтрации
     sort_by = request.GET.get('sort', 'rating')
@@ -935,7 +1171,7 @@ def celebrities(request):
     # Если есть фильтры, не используем базовый кэш
     if not (name_filter or country_filter or category_filter):
         # Полный кэш-ключ включает параметры сортировки и страницы
-        cache_key = f'{base_cache_key}_{sort_by}_page{page_number}'
+        cache_key = page_key(base_cache_key, page_number, sort_by)
         cached_context = cache.get(cache_key)
 
         if cached_context is not None:
@@ -955,36 +1191,36 @@ def celebrities(request):
         stars = stars.filter(categories=category)
 
     # Применяем сортировку
-    if sort_by == 'rating':
-        stars = stars.order_by('-rating')
-    elif sort_by == 'name_asc':
-        stars = stars.order_by('name')
-    elif sort_by == 'name_desc':
-        stars = stars.order_by('-name')
-    elif sort_by == 'birthday':
-        # Сортировка по ближайшему дню рождения
-        coming_birthday_days = get_coming_birthday_order()
-        stars = stars.annotate(days_until_birthday=coming_birthday_days).order_by('days_until_birthday')
+    stars = apply_sort(stars, sort_by)
 
     # Кэшированное получение ТОП-20 стран и категорий для сайдбара
-    top_countries = get_top_countries(count=20)
-    top_categories = get_top_categories(count=20)
+    top_countries = get_top_countries(count=TOP_LIST_SIZE)
+    top_categories = get_top_categories(count=TOP_LIST_SIZE)
 
     # Пагинация
-    paginator = Paginator(stars, 20)  # По 20 знаменитостей на страницу
+    paginator = Paginator(stars, CATALOGUE_PAGE_SIZE)
     page_obj = paginator.get_page(page_number)
     page_range = get_page_range(paginator, page_obj)
 
     # Получаем все страны и категории для фильтров через кэш
-    all_countries = cache.get('all_countries')
+    all_countries = cache.get(ALL_COUNTRIES)
     if all_countries is None:
         all_countries = list(Country.objects.all())
-        cache.set('all_countries', all_countries, CACHE_DAY)
+        cache.set(ALL_COUNTRIES, all_countries, CACHE_DAY)
 
-    all_categories = cache.get('all_categories')
+    all_categories = cache.get(ALL_CATEGORIES)
     if all_categories is None:
         all_categories = list(Category.objects.all())
-        cache.set('all_categories', all_categories, CACHE_DAY)
+        cache.set(ALL_CATEGORIES, all_categories, CACHE_DAY)
+
+    # Счетчики для фильтров: пустые варианты скрываются
+    country_counts, category_counts = get_facet_counts(
+        country.id if country_filter else None,
+        category.id if category_filter else None,
+        *name_filter_facet(name_filter)
+    )
+    all_countries = apply_facets(all_countries, country_counts, country_filter)
+    all_categories = apply_facets(all_categories, category_counts, category_filter)
 
     # Формируем контекст
     context = {
@@ -1009,38 +1245,30 @@ def celebrities(request):
     return render(request, 'star/celebrities.html', context)
 
 
+@throttle
 def tag(request, tag_slug):
     """Страница виртуальной категории (тега) с кэшированием."""
     # Базовый кэш-ключ для страницы
-    base_cache_key = f'tag_{tag_slug}'
+    base_cache_key = tag_prefix(tag_slug)
 
     # Получаем параметры сортировки
     sort_by = request.GET.get('sort', 'birthday')
     page_number = request.GET.get('page', 1)
 
     # Полный кэш-ключ
-    cache_key = f'{base_cache_key}_{sort_by}_page{page_number}'
+    cache_key = page_key(base_cache_key, page_number, sort_by)
     cached_context = cache.get(cache_key)
 
     if cached_context is not None:
         return render(request, 'star/tag.html', cached_context)
 
-    # Разбираем slug тега на категорию и страну
-    parts = tag_slug.split('-')
-    if len(parts) < 2:
-        return HttpResponseNotFound("Неверный формат тега")
-
-    # Последняя часть - страна, остальное - категория
-    country_slug = parts[-1]
-    category_slug = '-'.join(parts[:-1])
-
-    # Проверяем жизнеспособность тега перед отображением
-    if not check_tag_viability(category_slug, country_slug):
+    # Находим тег в реестре одним запросом по уникальному slug
+    tag_obj = Tag.objects.select_related('category', 'country').filter(slug=tag_slug).first()
+    if tag_obj is None:
         return HttpResponseNotFound("Страница не найдена")
 
-    # Получаем объекты категории и страны
-    country_obj = get_object_or_404(Country, slug=country_slug)
-    category = get_object_or_404(Category, slug=category_slug)
+    country_obj = tag_obj.country
+    category = tag_obj.category
 
     # Получаем знаменитостей, соответствующих тегу
     stars = Star.objects.filter(
@@ -1050,35 +1278,27 @@ def tag(request, tag_slug):
     )
 
     # Применяем сортировку
-    if sort_by == 'rating':
-        stars = stars.order_by('-rating')
-    elif sort_by == 'name_asc':
-        stars = stars.order_by('name')
-    elif sort_by == 'name_desc':
-        stars = stars.order_by('-name')
-    elif sort_by == 'birthday':
-        coming_birthday_days = get_coming_birthday_order()
-        stars = stars.annotate(days_until_birthday=coming_birthday_days).order_by('days_until_birthday')
+    stars = apply_sort(stars, sort_by)
 
     # Кэшированное получение ТОП-20 стран и категорий для сайдбара
-    top_countries = get_top_countries(count=20)
-    top_categories = get_top_categories(count=20)
+    top_countries = get_top_countries(count=TOP_LIST_SIZE)
+    top_categories = get_top_categories(count=TOP_LIST_SIZE)
 
     # Пагинация
-    paginator = Paginator(stars, 20)
+    paginator = Paginator(stars, CATALOGUE_PAGE_SIZE)
     page_obj = paginator.get_page(page_number)
     page_range = get_page_range(paginator, page_obj)
 
     # Получаем все страны и категории для фильтров через кэш
-    all_countries = cache.get('all_countries')
+    all_countries = cache.get(ALL_COUNTRIES)
     if all_countries is None:
         all_countries = list(Country.objects.all())
-        cache.set('all_countries', all_countries, CACHE_DAY)
+        cache.set(ALL_COUNTRIES, all_countries, CACHE_DAY)
 
-    all_categories = cache.get('all_categories')
+    all_categories = cache.get(ALL_CATEGORIES)
     if all_categories is None:
         all_categories = list(Category.objects.all())
-        cache.set('all_categories', all_categories, CACHE_DAY)
+        cache.set(ALL_CATEGORIES, all_categories, CACHE_DAY)
 
     # Создаем обертку для отображения в шаблоне
     country = GenitiveCountry(country_obj)
@@ -1132,27 +1352,20 @@ def names(request):
     if cached_context is not None:
         return render(request, 'star/names.html', cached_context)
 
-    # Получаем все буквы, с которых начинаются имена знаменитостей
-    letters = {}
-
-    # Для каждой буквы получаем первые 20 знаменитостей
-    for letter in 'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЭЮЯ':
-        # Кэшируем звезды для каждой буквы
-        letter_cache_key = f'names_letter_{letter}_top20'
-        stars = cache.get(letter_cache_key)
-
-        if stars is None:
-            stars = list(Star.objects.filter(
-                is_published=True,
-                name__istartswith=letter
-            ).order_by('name')[:20])
-
-            # Кэшируем на день
-            cache.set(letter_cache_key, stars, CACHE_DAY)
-
-        # Добавляем букву в словарь только если есть знаменитости
-        if stars:
-            letters[letter] = stars
+    # Первые 20 знаменитостей на каждую букву одним запросом
+    stars = Star.objects.filter(is_published=True, name_letter__in=NAME_LETTERS).annotate(
+        letter_rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('name_letter')],
+            order_by=[F('name_sort').asc(), F('id').asc()]
+        )
+    ).filter(letter_rank__lte=20).order_by('name_letter', 'letter_rank')
+
+    # В словарь попадают только буквы, на которые есть знаменитости, в порядке алфавита
+    by_letter = {}
+    for star in stars:
+        by_letter.setdefault(star.name_letter, []).append(star)
+    letters = {letter: by_letter[letter] for letter in NAME_LETTERS if letter in by_letter}
 
     # Формируем контекст
     context = {
@@ -1168,35 +1381,41 @@ def names(request):
 
 def names_letter(request, letter):
     """Страница со знаменитостями на определенную букву с кэшированием."""
+    # Ё и Е - одна буква указателя
+    normalized = first_letter(letter)
+    if normalized.lower() != letter:
+        if not normalized:
+            return HttpResponseNotFound(f"Нет знаменитостей на букву {letter.upper()}")
+        return redirect('names_letter', letter=normalized.lower(), permanent=True)
+    letter = normalized
+
     # Кэш-ключ с учетом страницы пагинации
     page_number = request.GET.get('page', 1)
-    cache_key = f'names_letter_{letter.upper()}_page{page_number}'
+    cache_key = f'names_letter_{letter}_page{page_number}'
     cached_context = cache.get(cache_key)
 
     if cached_context is not None:
         return render(request, 'star/names-letter.html', cached_context)
 
-    # Получаем знаменитостей, имена которых начинаются с указанной буквы
-    stars = Star.objects.filter(
-        is_published=True,
-        name__istartswith=letter.upper()
-    ).order_by('name')
-
-    # Если нет знаменитостей на эту букву, возвращаем 404
-    if not stars.exists():
-        return HttpResponseNotFound(f"Нет знаменитостей на букву {letter.upper()}")
+    # Знаменитости на букву в порядке индекса star_pub_letter_idx
+    stars = Star.objects.filter(is_published=True, name_letter=letter).order_by('name_sort', 'id')
 
     # Пагинация
     paginator = Paginator(stars, 200)  # По 200 знаменитостей на страницу
+
+    # Если нет знаменитостей на эту букву, возвращаем 404
+    if not paginator.count:
+        return HttpResponseNotFound(f"Нет знаменитостей на букву {letter}")
+
     page_obj = paginator.get_page(page_number)
     page_range = get_page_range(paginator, page_obj)
 
     # Формируем контекст
     context = {
         'stars': page_obj,
-        'letter': letter.upper(),
-        'title': f'Знаменитости на букву {letter.upper()}',
-        'total_count': stars.count(),
+        'letter': letter,
+        'title': f'Знаменитости на букву {letter}',
+        'total_count': paginator.count,
         'page_range': page_range,
     }
 